@@ -10,6 +10,7 @@ import os
 import tempfile
 
 from rosette.api import API, DocumentParameters
+from rosette.markup import strip_document
 
 
 def run(key, altUrl='https://api.rosette.com/rest/v1/'):
@@ -28,6 +29,8 @@ def run(key, altUrl='https://api.rosette.com/rest/v1/'):
 
     # Use an HTML file to load data instead of a string
     params.load_document_file(f.name)
+    # Send only the visible text of the page, not its markup
+    params, _ = strip_document(params)
     result = api.sentiment(params)
 
     # Clean up the file
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+
+"""
+Usage accounting and budgets for Rosette API calls.
+
+Copyright (c) 2014-2015 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+METRICS = ("calls", "request_bytes", "response_bytes", "retries")
+
+
+class Budget(object):
+    """A limit on one usage metric, for all calls or for the calls of one tag.
+
+    Once the usage reaches C{soft}, every further call is delayed; once it
+    reaches C{hard}, further calls fail with a L{rosette.api.RosetteException}
+    of status C{budgetExceeded} without being sent.
+    """
+
+    def __init__(self, hard=None, soft=None, metric="calls", tag=None):
+        """ Create a L{Budget}.
+        @param hard: (Optional) Usage at which calls are refused.
+        @param soft: (Optional) Usage at which calls are slowed down.
+        @param metric: One of C{calls}, C{request_bytes}, C{response_bytes} or C{retries}.
+        @param tag: (Optional) Only count and limit the calls made with this tag.
+        """
+        if metric not in METRICS:
+            raise ValueError("metric must be one of " + ", ".join(METRICS))
+        self.hard = hard
+        self.soft = soft
+        self.metric = metric
+        self.tag = tag
+
+
+class Accounting(object):
+    """Thread-safe counts of the calls an L{API} makes, and the bytes and
+    retries they cost, per endpoint and per tag (see L{API.tag}).
+
+    Request bytes are the request bodies as sent, response bytes the
+    response bodies as received (i.e. compressed, if the server compressed
+    them); a request resent after a 429 is counted again and as a retry.
+
+    With a C{snapshot_path}, the counts are written to that file every
+    C{snapshot_interval} seconds and by L{Accounting.close}, and read back
+    when an L{Accounting} is created with the same path, so that a job that
+    is restarted keeps its totals and budgets.  Counts are kept per process.
+    """
+
+    def __init__(self, budgets=(), soft_delay=1.0, snapshot_path=None, snapshot_interval=60.0):
+        """ Create an L{Accounting}.
+        @param budgets: L{Budget} objects enforced before each call.
+        @param soft_delay: Seconds each call is delayed once a soft budget is reached.
+        @param snapshot_path: (Optional) File the counts are saved to and resumed from.
+        @param snapshot_interval: Seconds between snapshots.
+        """
+        self.budgets = list(budgets)
+        self.soft_delay = soft_delay
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval = snapshot_interval
+        self._reset()
+        if snapshot_path is not None:
+            if os.path.exists(snapshot_path):
+                self._load(snapshot_path)
+            self._start_snapshots()
+
+    def _reset(self):
+        self.logger = logging.getLogger('rosette.api')
+        self._lock = threading.Lock()
+        self._counts = {}  # (endpoint, tag) -> metric -> count
+        self._warned = set()
+        self._stop = threading.Event()
+        self._snapshotter = None
+
+    def __getstate__(self):
+        return {"budgets": self.budgets, "soft_delay": self.soft_delay,
+                "snapshot_interval": self.snapshot_interval}
+
+    def __setstate__(self, state):
+        # a copy in another process starts from zero and does not overwrite the snapshot
+        self.__dict__.update(state)
+        self.snapshot_path = None
+        self._reset()
+
+    def _load(self, path):
+        with open(path) as f:
+            saved = json.load(f)
+        for row in saved["counts"]:
+            self._counts[(row["endpoint"], row["tag"])] = dict((m, row[m]) for m in METRICS)
+
+    def _usage(self, metric, tag):
+        return sum(counts[metric] for (endpoint, t), counts in self._counts.items()
+                   if tag is None or t == tag)
+
+    def usage(self, tag=None, endpoint=None):
+        """ Returns a dictionary of metric to count, over all calls or those of one tag or endpoint """
+        with self._lock:
+            result = dict.fromkeys(METRICS, 0)
+            for (e, t), counts in self._counts.items():
+                if (tag is None or t == tag) and (endpoint is None or e == endpoint):
+                    for metric in METRICS:
+                        result[metric] += counts[metric]
+            return result
+
+    def report(self):
+        """ Returns the counts as a dictionary with C{total}, C{endpoints} (endpoint to counts)
+        and C{tags} (tag to counts) entries; calls without a tag are under C{None}. """
+        with self._lock:
+            rows = list(self._counts.items())
+        result = {"total": dict.fromkeys(METRICS, 0), "endpoints": {}, "tags": {}}
+        for (endpoint, tag), counts in rows:
+            for total in (result["total"],
+                          result["endpoints"].setdefault(endpoint, dict.fromkeys(METRICS, 0)),
+                          result["tags"].setdefault(tag, dict.fromkeys(METRICS, 0))):
+                for metric in METRICS:
+                    total[metric] += counts[metric]
+        return result
+
+    def _counter(self, endpoint, tag):
+        counts = self._counts.get((endpoint, tag))
+        if counts is None:
+            counts = self._counts[(endpoint, tag)] = dict.fromkeys(METRICS, 0)
+        return counts
+
+    def charge(self, endpoint, tag=None):
+        """ Enforces the budgets and counts a call; called by the L{API} before sending it.
+        @raise RosetteException: Status C{budgetExceeded} if a hard budget is used up.
+        """
+        delay = False
+        with self._lock:
+            for budget in self.budgets:
+                if budget.tag is not None and budget.tag != tag:
+                    continue
+                usage = self._usage(budget.metric, budget.tag)
+                if budget.hard is not None and usage >= budget.hard:
+                    from rosette.api import RosetteException
+                    raise RosetteException(
+                        "budgetExceeded",
+                        "The " + budget.metric + " budget of " + str(budget.hard) + " is used up",
+                        tag)
+                if budget.soft is not None and usage >= budget.soft:
+                    delay = True
+                    if budget not in self._warned:
+                        self._warned.add(budget)
+                        self.logger.warning('Soft ' + budget.metric + ' budget of ' + str(budget.soft) +
+                                            ' reached; slowing down')
+            self._counter(endpoint, tag)["calls"] += 1
+        if delay and self.soft_delay > 0:
+            time.sleep(self.soft_delay)
+
+    def add(self, endpoint, tag, metric, amount=1):
+        """ Adds C{amount} to a metric of the calls to C{endpoint} with C{tag} """
+        with self._lock:
+            self._counter(endpoint, tag)[metric] += amount
+
+    def snapshot(self, path=None):
+        """ Writes the counts to C{path}, by default the C{snapshot_path}; the file is
+        replaced atomically, so a reader never sees a partial snapshot. """
+        path = path or self.snapshot_path
+        with self._lock:
+            rows = [dict(counts, endpoint=endpoint, tag=tag)
+                    for (endpoint, tag), counts in sorted(self._counts.items(), key=repr)]
+        temporary = path + ".tmp"
+        with open(temporary, "w") as f:
+            json.dump({"time": time.time(), "counts": rows}, f, indent=1, sort_keys=True)
+        if os.name == "nt" and os.path.exists(path):
+            os.remove(path)
+        os.rename(temporary, path)
+
+    def _start_snapshots(self):
+        def run():
+            while not self._stop.wait(self.snapshot_interval):
+                try:
+                    self.snapshot()
+                except (IOError, OSError) as e:
+                    self.logger.warning('Could not save usage snapshot: ' + str(e))
+
+        self._snapshotter = threading.Thread(target=run, name='rosette-usage-snapshot')
+        self._snapshotter.daemon = True
+        self._snapshotter.start()
+
+    def close(self):
+        """ Stops the periodic snapshots and writes a last one """
+        self._stop.set()
+        if self.snapshot_path is not None:
+            self.snapshot()
@@ -17,18 +17,21 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
-from io import BytesIO
-import gzip
 import json
 import logging
+import socket
 import sys
+import threading
 import time
 import os
+import re
+from contextlib import contextmanager
 from socket import gaierror
-import requests
+from rosette.scheduler import Priority
 
 _BINDING_VERSION = "1.1"
 _GZIP_BYTEARRAY = bytearray([0x1F, 0x8b, 0x08])
+_READ_SIZE = 64 * 1024
 
 _IsPy3 = sys.version_info[0] == 3
 
@@ -37,10 +40,25 @@ try:
     import urlparse
 except ImportError:
     import urllib.parse as urlparse
-try:
-    import httplib
-except ImportError:
-    import http.client as httplib
+
+# Modules that are costly to import and not needed by every program are
+# imported on first use: the HTTP client when the first connection is
+# opened, gzip for the first compressed response, requests for the first
+# multipart upload, rosette.bulk (sqlite3) for the first bulk call and
+# rosette.balancer when several service URLs are given.
+_httplib = None
+
+
+def _http_client():
+    """ Returns the HTTP client module, importing it on first use """
+    global _httplib
+    if _httplib is None:
+        try:
+            import httplib as module
+        except ImportError:
+            import http.client as module
+        _httplib = module
+    return _httplib
 
 if _IsPy3:
     _GZIP_SIGNATURE = _GZIP_BYTEARRAY
@@ -58,7 +76,113 @@ class _ReturnObject:
         return self._json
 
 
+class _NoStage(object):
+    """Stands for a profiled stage when the call is not profiled"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NO_STAGE = _NoStage()
+
+
+class _HedgedPrimary(object):
+    """The first copy of a hedged request, sent by the calling thread; the
+    thread of the second copy cancels it by shutting its socket down"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._connection = None
+        self.finished = False
+        self.cancelled = False
+
+    def attach(self, connection, url):
+        """ Notes the connection the request is sent on; raises if the request was cancelled """
+        with self._lock:
+            if self.cancelled:
+                raise RosetteException("hedgeCancelled", "The second copy of the request answered first", url)
+            self._connection = connection
+
+    def cancel(self):
+        with self._lock:
+            if self.finished:
+                return
+            self.cancelled = True
+            sock = getattr(self._connection, "sock", None)
+            if sock is not None:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except socket.error:
+                    pass
+
+    def finish(self):
+        """ Ends the request; a cancelled connection is closed so that the next request reconnects """
+        with self._lock:
+            self.finished = True
+            if self.cancelled and self._connection is not None:
+                self._connection.close()
+
+
+class _SpilledBody(object):
+    """A response body larger than the in-memory ceiling, kept in a temporary file"""
+
+    def __init__(self, spill, size):
+        self._file = spill
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+    def __str__(self):
+        return "<%d byte response>" % self.size
+
+    def loads(self):
+        """ Parses the body.  The text is decoded straight from a memory map of the file, so
+        the compressed and raw bytes are not in memory while it is parsed (on Python 2 the raw
+        bytes are copied, as they are the text); the decoded text and the parsed result still
+        are, since C{json} cannot parse a document piece by piece """
+        import mmap
+        try:
+            self._file.flush()
+            if self.size == 0:
+                return json.loads("")
+            mapped = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                if _IsPy3:
+                    return json.loads(str(mapped, "utf-8"))
+                return json.loads(mapped[:])
+            finally:
+                mapped.close()
+        finally:
+            self._file.close()
+
+
+def _gunzipped(response, received):
+    """ Yields the body of C{response} in pieces, decompressing it if it is gzipped; the
+    number of bytes read from the response is added to C{received[0]} """
+    decompressor = None
+    first = True
+    while True:
+        chunk = response.read(_READ_SIZE)
+        if not chunk:
+            break
+        received[0] += len(chunk)
+        if first and chunk[0:3] == _GZIP_SIGNATURE:
+            import zlib
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        first = False
+        yield decompressor.decompress(chunk) if decompressor is not None else chunk
+    if decompressor is not None:
+        yield decompressor.flush()
+
+
 def _my_loads(obj, response_headers):
+    if isinstance(obj, _SpilledBody):
+        d0 = obj.loads()
+        d0.update(response_headers)
+        return d0
     if _IsPy3:
         d1 = json.loads(obj.decode("utf-8")).copy()
         d1.update(response_headers)
@@ -76,6 +200,7 @@ class RosetteException(Exception):
     """
 
     def __init__(self, status, message, response_message):
+        Exception.__init__(self, status, message, response_message)
         self.status = status
         self.message = message
         self.response_message = response_message
@@ -92,12 +217,18 @@ class _PseudoEnum:
     def __init__(self):
         pass
 
+    @classmethod
+    def values(cls):
+        """ The values of the enumeration, computed once per class """
+        values = cls.__dict__.get("_values")
+        if values is None:
+            values = [v for (k, v) in vars(cls).items() if not k.startswith("_")]
+            cls._values = values
+        return values
+
     @classmethod
     def validate(cls, value, name):
-        values = []
-        for (k, v) in vars(cls).items():
-            if not k.startswith("__"):
-                values += [v]
+        values = cls.values()
 
         # this is still needed to make sure that the parameter NAMES are known.
         # If python didn't allow setting unknown values, this would be a
@@ -122,11 +253,10 @@ class MorphologyOutput(_PseudoEnum):
 
 
 class _DocumentParamSetBase(object):
+    __slots__ = ("__params", "useMultipart")
 
     def __init__(self, repertoire):
-        self.__params = {}
-        for k in repertoire:
-            self.__params[k] = None
+        self.__params = dict.fromkeys(repertoire)
 
     def __setitem__(self, key, val):
         if key not in self.__params:
@@ -145,23 +275,50 @@ class _DocumentParamSetBase(object):
 
     def serialize(self):
         self.validate()
-        v = {}
-        for (key, val) in self.__params.items():
-            if val is None:
-                pass
-            else:
-                v[key] = val
-        return v
+        return dict((key, val) for (key, val) in self.__params.items() if val is not None)
 
 
 def _byteify(s):  # py 3 only
-    l = len(s)
-    b = bytearray(l)
-    for ix in range(l):
-        oc = ord(s[ix])
-        assert (oc < 256)
-        b[ix] = oc
-    return b
+    return bytearray(s, "latin-1")
+
+
+_JSON_ESCAPE_RE = re.compile(b'[\x00-\x1f"\\\\]')
+_JSON_ESCAPES = dict((bytes(bytearray([c])), ('\\u%04x' % c).encode("ascii")) for c in range(0x20))
+_JSON_ESCAPES.update({b'"': b'\\"', b'\\': b'\\\\', b'\n': b'\\n', b'\r': b'\\r', b'\t': b'\\t'})
+
+
+def _is_binary(content):
+    """ True for bytes-like content that is sent without being decoded """
+    return isinstance(content, (bytearray, memoryview)) or (_IsPy3 and isinstance(content, bytes))
+
+
+def _body_size(data):
+    """ Number of bytes of a request body as passed to C{_send} """
+    if data is None:
+        return 0
+    if isinstance(data, list):
+        return sum(memoryview(chunk).nbytes for chunk in data)
+    return len(data)
+
+
+def _json_head(fixed):
+    """ Encodes the parameters other than C{content} as the start of a JSON object
+    ending in C{"content": }, ready for the encoded content to be appended """
+    encoded = json.dumps(fixed, sort_keys=True)
+    return encoded[:-1] + (", " if fixed else "") + '"content": '
+
+
+def _encode_content(head, content):
+    """ Completes a request body started by L{_json_head}.
+    Text content is encoded by C{json}.  Bytes-like content must be UTF-8; it is
+    escaped (copied only if it contains characters needing escapes) and returned
+    with the head and tail as a list of byte strings, so that it is neither decoded
+    nor joined into a new string before being written to the socket. """
+    if not _is_binary(content):
+        return head + json.dumps(content) + "}"
+    if _JSON_ESCAPE_RE.search(content) is not None:
+        content = _JSON_ESCAPE_RE.sub(lambda m: _JSON_ESCAPES[m.group()], content)
+    return [head.encode("ascii") + b'"', content, b'"}']
 
 
 class DocumentParameters(_DocumentParamSetBase):
@@ -203,9 +360,7 @@ class DocumentParameters(_DocumentParamSetBase):
 
     def serialize(self):
         """Internal. Do not use."""
-        self.validate()
-        slz = super(DocumentParameters, self).serialize()
-        return slz
+        return super(DocumentParameters, self).serialize()
 
     def load_document_file(self, path):
         """Loads a file into the object.
@@ -220,7 +375,8 @@ class DocumentParameters(_DocumentParamSetBase):
     def load_document_string(self, s):
         """Loads a string into the object.
         The string will be taken as bytes or as Unicode dependent upon
-        its native python type.
+        its native python type.  Bytes-like objects (C{bytes}, C{bytearray},
+        C{memoryview}) must hold UTF-8 text; they are sent without being decoded.
         @parameter s: A string, possibly a unicode-string, to be loaded
         for subsequent analysis.
         """
@@ -239,6 +395,59 @@ class RelationshipsParameters(DocumentParameters):
             self, ("content", "contentUri", "language", "options", "genre"))
 
 
+class DocumentTemplate(object):
+    """Pre-serialized document parameters for calling an endpoint at a high rate
+    with many short texts that share their other parameters.
+
+    The fixed fields (C{language}, C{genre} and, for relationships, C{options})
+    are validated and encoded to JSON once, when the template is created.
+    L{DocumentTemplate.fill} then only encodes the content and splices it into
+    the prepared body; the result may be passed to any endpoint method that
+    accepts L{DocumentParameters}, e.g.::
+
+        template = DocumentTemplate(language="eng")
+        for text in texts:
+            api.entities(template.fill(text))
+    """
+    __slots__ = ("_head",)
+
+    def __init__(self, language=None, genre=None, options=None):
+        """Create a L{DocumentTemplate}.
+        @param language: (Optional) The ISO639 code of the language of all documents.
+        @param genre: (Optional) The genre of all documents.
+        @param options: (Optional) A dictionary of endpoint options, e.g. for relationships.
+        """
+        fixed = {"language": language, "genre": genre, "options": options}
+        self._head = _json_head(dict((k, v) for (k, v) in fixed.items() if v is not None))
+
+    def fill(self, content):
+        """Returns the parameters of one call.
+        @param content: The text to be processed, as a string or as UTF-8 bytes-like object.
+        """
+        return _FilledTemplate(self._head, content)
+
+
+class _FilledTemplate(object):
+    __slots__ = ("_head", "content")
+    useMultipart = False
+
+    def __init__(self, head, content):
+        self._head = head
+        self.content = content
+
+    def validate(self):
+        if self.content is None:
+            raise RosetteException(
+                "badArgument",
+                "Must supply one of Content or ContentUri",
+                "bad arguments")
+
+    def encode(self):
+        """The JSON request body"""
+        self.validate()
+        return _encode_content(self._head, self.content)
+
+
 class NameTranslationParameters(_DocumentParamSetBase):
     """Parameter object for C{name-translation} endpoint.
     The following values may be set by the indexing (i.e.,C{ parms["name"]}) operator.  The values are all
@@ -264,6 +473,8 @@ class NameTranslationParameters(_DocumentParamSetBase):
     C{targetScheme} The transliteration scheme by which the translated name should be rendered.
     """
 
+    __slots__ = ()
+
     def __init__(self):
         self.useMultipart = False
         _DocumentParamSetBase.__init__(
@@ -307,6 +518,8 @@ class NameSimilarityParameters(_DocumentParamSetBase):
     C{entityType} The entity type, can be "PERSON", "LOCATION" or "ORGANIZATION", optional.
     """
 
+    __slots__ = ()
+
     def __init__(self):
         self.useMultipart = False
         _DocumentParamSetBase.__init__(self, ("name1", "name2"))
@@ -414,11 +627,22 @@ class EndpointCaller:
         @param parameters: An object specifying the data,
         and possible metadata, to be processed by the endpoint.  See the
         details for those object types.
-        @type parameters: For C{name-translation}, L{NameTranslationParameters}, otherwise L{DocumentParameters} or L{str}
+        @type parameters: For C{name-translation}, L{NameTranslationParameters}, otherwise L{DocumentParameters},
+        a filled L{DocumentTemplate} or L{str}
         @return: A python dictionary expressing the result of the invocation.
         """
-
-        if not isinstance(parameters, _DocumentParamSetBase):
+        profiler = self.api.profiler
+        if profiler is None:
+            return self._call(parameters)
+        with profiler.call(self.suburl):
+            return self._call(parameters)
+
+    def _call(self, parameters):
+        json_data = None
+        if isinstance(parameters, _FilledTemplate) and \
+                self.suburl != "name-similarity" and self.suburl != "name-translation":
+            json_data = parameters.encode()
+        elif not isinstance(parameters, _DocumentParamSetBase):
             if self.suburl != "name-similarity" and self.suburl != "name-translation":
                 text = parameters
                 parameters = DocumentParameters()
@@ -431,7 +655,40 @@ class EndpointCaller:
 
         self.useMultipart = parameters.useMultipart
         url = self.service_url + self.suburl
-        params_to_serialize = parameters.serialize()
+        params_to_serialize = None
+        if json_data is None:
+            with self.api._stage("serialize"):
+                params_to_serialize = parameters.serialize()
+            if self.api.preflight is not None:
+                params_to_serialize = self.api.preflight.check(self.suburl, params_to_serialize, self.api)
+        if not self.useMultipart and params_to_serialize is not None and \
+                _is_binary(params_to_serialize.get("content")):
+            content = params_to_serialize.pop("content")
+            json_data = _encode_content(_json_head(params_to_serialize), content)
+        subsumption = self.api.subsumption
+        if subsumption is None or self.useMultipart or json_data is not None or \
+                params_to_serialize is None:
+            return self._request(parameters, url, params_to_serialize, json_data)
+        result, claim = subsumption.lookup(self.suburl, params_to_serialize)
+        if result is not None:
+            return result
+        result = None
+        try:
+            result = self._request(parameters, url, params_to_serialize, json_data)
+            return result
+        finally:
+            subsumption.release(claim, result)
+
+    def _request(self, parameters, url, params_to_serialize, json_data):
+        """ Sends the call, unless the L{API}'s C{near_duplicates} index answers it """
+        duplicates = self.api.near_duplicates
+        token = None
+        if duplicates is not None and not self.useMultipart and json_data is None and \
+                params_to_serialize is not None and not _is_binary(params_to_serialize.get("content")):
+            fixed = dict((k, v) for (k, v) in params_to_serialize.items() if k != "content")
+            result, token = duplicates.lookup(self.suburl, fixed, params_to_serialize.get("content") or "")
+            if result is not None:
+                return result
         headers = {}
         if self.user_key is not None:
             headers["X-RosetteAPI-Key"] = self.user_key
@@ -441,7 +698,7 @@ class EndpointCaller:
             params = dict(
                 (key,
                  value) for key,
-                value in params_to_serialize.iteritems() if key == 'language')
+                value in params_to_serialize.items() if key == 'language')
             files = {
                 'content': (
                     os.path.basename(
@@ -452,6 +709,7 @@ class EndpointCaller:
                     'request_options',
                     json.dumps(params),
                     'application/json')}
+            import requests
             request = requests.Request(
                 'POST', url, files=files, headers=headers)
             prepared_request = request.prepare()
@@ -468,15 +726,21 @@ class EndpointCaller:
             headers['Accept'] = "application/json"
             headers['Accept-Encoding'] = "gzip"
             headers['Content-Type'] = "application/json"
-            r = self.api._post_http(url, params_to_serialize, headers)
-        return self.__finish_result(r, "operate")
+            r = self.api._post_http(url, params_to_serialize, headers, json_data)
+        result = self.__finish_result(r, "operate")
+        if token is not None:
+            duplicates.add(token, result)
+        return result
 
 
-class API:
+class API(object):
     """
     Rosette Python Client Binding API; representation of a Rosette server.
     Call instance methods upon this object to obtain L{EndpointCaller} objects
     which can communicate with particular Rosette server endpoints.
+
+    An L{API} object may be shared between threads; each thread uses its own
+    HTTP connection.
     """
 
     def __init__(
@@ -486,18 +750,76 @@ class API:
             retries=5,
             reuse_connection=True,
             refresh_duration=0.5,
-            debug=False):
+            debug=False,
+            name_prefilter=None,
+            health_check_interval=10.0,
+            circuit_breaker=None,
+            scheduler=None,
+            max_response_memory=None,
+            max_response_size=None,
+            cassette=None,
+            transport=None,
+            accounting=None,
+            limiter=None,
+            hedging=None,
+            near_duplicates=None,
+            profiler=None,
+            future_workers=None,
+            subsumption=None,
+            preflight=None):
         """ Create an L{API} object.
         @param user_key: (Optional; required for servers requiring authentication.) An authentication string to be sent
          as user_key with all requests.  The default Rosette server requires authentication.
          to the server.
+        @param service_url: The base URL of the Rosette server, or a list of base URLs of
+         equivalent servers.  Requests are spread over a list by least-outstanding-requests
+         balancing; a server that cannot be reached is ejected and the request is retried on another.
+        @param name_prefilter: (Optional) A L{rosette.prefilter.NamePrefilter} consulted by L{API.name_similarity}
+         before calling the server; pairs scoring below its threshold are answered locally.
+        @param health_check_interval: When several service URLs are given, the number of seconds
+         between background pings of each server; 0 disables health checks.
+        @param circuit_breaker: (Optional) A L{rosette.circuit.CircuitBreaker}.  Requests to an endpoint
+         whose circuit is open fail at once with a L{RosetteException} of status C{circuitOpen}.
+        @param scheduler: (Optional) A L{rosette.scheduler.Scheduler} limiting the requests in flight;
+         waiting requests are started by priority and fair share, see L{API.priority}.
+        @param max_response_memory: (Optional) Size in bytes above which a response body is
+         moved from memory to a temporary file while it is received.  Parsing it still needs
+         the decoded text and the result in memory.
+        @param max_response_size: (Optional) Size in bytes above which a response is refused
+         with a L{RosetteException} of status C{responseTooLarge}.
+        @param cassette: (Optional) A L{rosette.cassette.Cassette} that records the exchanges
+         with the server, or replays recorded exchanges instead of connecting to it.
+        @param transport: (Optional) A L{rosette.transport.Transport} creating the connections, with
+         DNS caching, TLS session reuse and connections opened ahead of time.
+        @param accounting: (Optional) A L{rosette.accounting.Accounting} counting the calls, bytes and
+         retries per endpoint and tag (see L{API.tag}), and enforcing its budgets.
+        @param limiter: (Optional) A L{rosette.limiter.AdaptiveLimiter} limiting the requests in flight
+         to what the server currently sustains; it is applied before the C{scheduler}.
+        @param hedging: (Optional) A L{rosette.hedging.HedgePolicy}.  A call that is slow compared to
+         recent calls to the same endpoint is sent a second time, and the first answer is used.
+        @param near_duplicates: (Optional) A L{rosette.dedup.NearDuplicateIndex}.  A document nearly
+         identical to one sent before is not sent again; the earlier result is reused or flagged.
+        @param profiler: (Optional) A L{rosette.profiler.ClientProfiler} measuring the CPU time and
+         memory each client-side stage of a sample of the calls takes.
+        @param future_workers: Number of threads running the calls of the C{..._future} methods
+         (see L{API.submit}); by default 8, or the maximum of the C{limiter}.
+        @param subsumption: (Optional) A L{rosette.subsumption.SubsumptionCache}.  Calls whose result
+         is part of the result of a broader call about the same document (e.g. C{morphology/lemmas}
+         of C{morphology/complete}) are answered from it when it is kept or in flight.
+        @param preflight: (Optional) A L{rosette.preflight.Preflight} refusing, or repairing, calls
+         the server would refuse (blank content, unsupported language, malformed names, ...)
+         before they are sent.
         """
         # logging.basicConfig(filename="binding.log", filemode="w", level=logging.DEBUG)
         self.user_key = user_key
-        self.service_url = service_url if service_url.endswith(
-            '/') else service_url + '/'
+        if isinstance(service_url, (list, tuple)):
+            service_urls = list(service_url)
+        else:
+            service_urls = [service_url]
+        service_urls = [u if u.endswith('/') else u + '/' for u in service_urls]
+        self.service_url = service_urls[0]
         self.logger = logging.getLogger('rosette.api')
-        self.logger.info('Initialized on ' + self.service_url)
+        self.logger.info('Initialized on ' + ', '.join(service_urls))
         self.debug = debug
 
         if (retries < 1):
@@ -508,20 +830,347 @@ class API:
         self.num_retries = retries
         self.reuse_connection = reuse_connection
         self.connection_refresh_duration = refresh_duration
-        self.http_connection = None
+        self._local = threading.local()
+        self.name_prefilter = name_prefilter
+        self.circuit_breaker = circuit_breaker
+        self.scheduler = scheduler
+        self.max_response_memory = max_response_memory
+        self.max_response_size = max_response_size
+        self.cassette = cassette
+        self.transport = transport
+        self.accounting = accounting
+        self.limiter = limiter
+        self.hedging = hedging
+        self.near_duplicates = near_duplicates
+        self.profiler = profiler
+        self.future_workers = future_workers
+        self.subsumption = subsumption
+        self.preflight = preflight
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        if transport is not None and getattr(cassette, "mode", None) != "replay":
+            transport.warm(service_urls)
+
+        self.health_check_interval = health_check_interval
+        self.balancer = None
+        if len(service_urls) > 1:
+            from rosette.balancer import Balancer
+            self.balancer = Balancer(service_urls)
+            self._start_health_checks()
+        self._pid = os.getpid()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_local"]
+        del state["logger"]
+        del state["_executor"]
+        del state["_executor_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.logger = logging.getLogger('rosette.api')
+        self._local = threading.local()
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._pid = os.getpid()
+        self._start_health_checks()
+
+    def _start_health_checks(self):
+        if self.balancer is not None and self.health_check_interval > 0:
+            self.balancer.start_health_checks(self._check_node, self.health_check_interval)
+
+    def _after_fork(self):
+        """ Drops the connections, locks and threads inherited from the parent process,
+        so that a child never writes to a socket its parent or siblings are using """
+        for helper in (self.balancer, self.circuit_breaker, self.scheduler, self.name_prefilter,
+                       self.transport, self.accounting, self.limiter, self.hedging,
+                       self.near_duplicates, self.profiler, self.subsumption, self.preflight,
+                       self.cassette):
+            if helper is not None:
+                helper.__setstate__(helper.__getstate__())
+        self.__setstate__(self.__getstate__())
+
+    def close(self):
+        """ Stops background activity (such as health checks and the threads of the
+        C{..._future} methods) started by this L{API} """
+        if self.balancer is not None:
+            self.balancer.stop()
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
+
+    def submit(self, function, *args, **kwargs):
+        """ Runs C{function(*args, **kwargs)} on the L{API}'s thread pool, with the tag and
+        schedule of the calling thread; e.g. C{api.submit(api.entities, params, True)}.  The
+        C{..._future} variants of the endpoint methods, such as C{api.entities_future(params)},
+        are shorthands for this.  The pool threads keep their connections between calls.
+
+        The returned future works with C{concurrent.futures.wait} and C{as_completed}.  A call
+        can be cancelled with C{Future.cancel} until a thread starts it; a started call runs to
+        the end.  On Python 2 this requires the C{futures} package.
+        @return: A C{concurrent.futures.Future} holding the result or the L{RosetteException}.
+        """
+        if self._pid != os.getpid():
+            self._after_fork()
+        with self._executor_lock:
+            if self._executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+                workers = self.future_workers
+                if workers is None:
+                    workers = self.limiter.maximum if self.limiter is not None else 8
+                self._executor = ThreadPoolExecutor(max_workers=workers)
+            executor = self._executor
+        tag = getattr(self._local, "tag", None)
+        schedule = getattr(self._local, "schedule", None)
+
+        def run():
+            self._local.tag = tag
+            self._local.schedule = schedule
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self._local.tag = None
+                self._local.schedule = None
+        return executor.submit(run)
+
+    @property
+    def http_connection(self):
+        """ The HTTP connection used by the calling thread """
+        return getattr(self._local, "connection", None)
+
+    @http_connection.setter
+    def http_connection(self, connection):
+        self._local.connection = connection
+
+    @contextmanager
+    def priority(self, priority=Priority.HIGH, queue="default"):
+        """ Context manager setting the scheduling priority class and fair-share queue
+        of the requests made by the calling thread inside the block, e.g.
+        C{with api.priority(Priority.LOW, "reprocessing"): api.entities(params)}.
+        Only has an effect if the L{API} has a C{scheduler}.
+        @param priority: An element of L{rosette.scheduler.Priority}.
+        @param queue: The name of the queue (tenant, job) to charge the requests to.
+        """
+        previous = getattr(self._local, "schedule", None)
+        self._local.schedule = (priority, queue)
+        try:
+            yield
+        finally:
+            self._local.schedule = previous
+
+    def _schedule(self):
+        """ The (priority, queue) of the calling thread's requests """
+        return getattr(self._local, "schedule", None) or (Priority.NORMAL, "default")
+
+    @contextmanager
+    def tag(self, tag):
+        """ Context manager charging the requests made by the calling thread inside the block
+        to C{tag} (e.g. a job name) in the L{API}'s C{accounting}.
+        @param tag: A string; tags do not nest, the innermost one applies.
+        """
+        previous = getattr(self._local, "tag", None)
+        self._local.tag = tag
+        try:
+            yield
+        finally:
+            self._local.tag = previous
+
+    def _account(self, metric, amount):
+        """ Adds to a usage metric of the calling thread's current call """
+        charge = getattr(self._local, "charge", None)
+        if charge is not None:
+            self.accounting.add(charge[0], charge[1], metric, amount)
 
     def _connect(self, parsedUrl):
-        """ Simple connection method
+        """ Simple connection method; selects (creating if needed) the calling thread's
+        connection to the host of C{parsedUrl}
         @param parsedUrl: The URL on which to process
         """
-        if not self.reuse_connection or self.http_connection is None:
+        connections = getattr(self._local, "connections", None)
+        if connections is None:
+            connections = self._local.connections = {}
+        key = (parsedUrl.scheme, parsedUrl.netloc)
+        if not self.reuse_connection or connections.get(key) is None:
             loc = parsedUrl.netloc
-            if parsedUrl.scheme == "https":
-                self.http_connection = httplib.HTTPSConnection(loc)
+            if self.transport is not None:
+                connections[key] = self.transport.connection(parsedUrl.scheme, loc)
+            elif parsedUrl.scheme == "https":
+                connections[key] = _http_client().HTTPSConnection(loc)
             else:
-                self.http_connection = httplib.HTTPConnection(loc)
+                connections[key] = _http_client().HTTPConnection(loc)
+            if self.cassette is not None:
+                connections[key] = self.cassette.wrap(connections[key])
+        self.http_connection = connections[key]
+
+    def _check_node(self, node):
+        """ Health check of one service URL; raises if the server cannot be pinged """
+        headers = {'Accept': 'application/json'}
+        if self.user_key is not None:
+            headers["X-RosetteAPI-Key"] = self.user_key
+        self._request_node("GET", node + "ping", None, headers)
+
+    def _stage(self, name):
+        """ Context manager measuring a stage of the current call for the L{API}'s profiler """
+        if self.profiler is None:
+            return _NO_STAGE
+        return self.profiler.stage(name)
 
     def _make_request(self, op, url, data, headers):
+        """
+        Sends the request, waiting for a slot first if the L{API} has a limiter or scheduler
+
+        @param op: POST or GET
+        @param url: endpoint URL
+        @param data: request data
+        @param headers: request headers
+        """
+        if self._pid != os.getpid():
+            self._after_fork()
+        if self.hedging is not None and not getattr(self._local, "hedge", False):
+            return self._hedged(op, url, data, headers)
+        if self.accounting is not None:
+            charge = (url[len(self.service_url):], getattr(self._local, "tag", None))
+            self.accounting.charge(*charge)
+            self._local.charge = charge
+        try:
+            if self.limiter is None:
+                return self._scheduled(op, url, data, headers)
+            return self._limited(op, url, data, headers)
+        finally:
+            self._local.charge = None
+
+    def _hedged(self, op, url, data, headers):
+        """ Sends the request through the hedge policy: first from the calling thread, and
+        again, if it is slow, from a worker thread that takes over its tag and schedule """
+        tag = getattr(self._local, "tag", None)
+        schedule = getattr(self._local, "schedule", None)
+        caller = threading.current_thread()
+        primary = _HedgedPrimary()
+
+        def attempt():
+            local = self._local
+            first = threading.current_thread() is caller
+            previous = (getattr(local, "hedge", False), getattr(local, "tag", None),
+                        getattr(local, "schedule", None), getattr(local, "primary", None))
+            local.hedge, local.tag, local.schedule = True, tag, schedule
+            local.primary = primary if first else None
+            try:
+                return self._make_request(op, url, data, dict(headers))
+            finally:
+                local.hedge, local.tag, local.schedule, local.primary = previous
+                if first:
+                    primary.finish()
+
+        return self.hedging.call(url[len(self.service_url):], attempt, primary.cancel)
+
+    def _limited(self, op, url, data, headers):
+        """ Sends the request within the limiter, telling it whether the server was overloaded """
+        token = self.limiter.acquire()
+        self._local.throttled = False
+        self._local.last_status = None
+        self._local.sent_at = None
+        overloaded = False
+        try:
+            result = self._scheduled(op, url, data, headers)
+            overloaded = self._local.throttled
+            return result
+        except RosetteException as exception:
+            status = self._local.last_status
+            overloaded = self._local.throttled or exception.status == "ConnectionError" or \
+                (status is not None and status >= 500)
+            raise
+        finally:
+            # latency counts from the scheduler slot, and only successful answers are samples
+            status = self._local.last_status
+            sent_at = self._local.sent_at
+            self.limiter.release(token, overloaded, url[len(self.service_url):],
+                                 None if sent_at is None else time.time() - sent_at,
+                                 status is not None and 200 <= status < 300)
+
+    def _scheduled(self, op, url, data, headers):
+        """ Sends the request, within a scheduler slot if the L{API} has a scheduler """
+        if self.scheduler is None:
+            self._local.sent_at = time.time()
+            return self._dispatch(op, url, data, headers)
+        with self.scheduler.slot(*self._schedule()):
+            self._local.sent_at = time.time()
+            return self._dispatch(op, url, data, headers)
+
+    def _dispatch(self, op, url, data, headers):
+        """
+        Sends the request, choosing a server when several service URLs are configured.
+        If a server cannot be reached it is ejected and the request is sent to another.
+
+        @param op: POST or GET
+        @param url: endpoint URL, relative to the first service URL
+        @param data: request data
+        @param headers: request headers
+        """
+        if self.balancer is None:
+            return self._request_node(op, url, data, headers)
+
+        relative = url[len(self.service_url):]
+        tried = []
+        while True:
+            node = self.balancer.acquire(tried)
+            if node is None:
+                raise RosetteException(
+                    "ConnectionError",
+                    "Unable to establish connection to any Rosette API server",
+                    url)
+            tried.append(node)
+            try:
+                return self._request_node(op, node + relative, data, headers)
+            except RosetteException as exception:
+                if exception.status == "ConnectionError":
+                    self.balancer.eject(node)
+                elif exception.status != "circuitOpen":
+                    raise
+            finally:
+                self.balancer.release(node)
+
+    def _request_node(self, op, url, data, headers):
+        """
+        Sends a request to one server, refusing it immediately if the circuit
+        breaker has opened the circuit of its host and endpoint
+
+        @param op: POST or GET
+        @param url: endpoint URL
+        @param data: request data
+        @param headers: request headers
+        """
+        if self.circuit_breaker is None:
+            return self._send(op, url, data, headers)
+
+        parsedUrl = urlparse.urlparse(url)
+        key = (parsedUrl.netloc, parsedUrl.path)
+        if not self.circuit_breaker.allow(key):
+            raise RosetteException(
+                "circuitOpen",
+                "Requests to this endpoint are suspended after repeated failures",
+                url)
+        self._local.last_status = None
+        start = time.time()
+        success = False
+        cancelled = False
+        try:
+            result = self._send(op, url, data, headers)
+            success = True
+            return result
+        except RosetteException as exception:
+            status = self._local.last_status
+            success = exception.status != "ConnectionError" and \
+                status is not None and status != 429 and status < 500
+            # a cancelled copy of a hedged request says nothing about the server
+            cancelled = exception.status == "hedgeCancelled"
+            raise
+        finally:
+            if not cancelled:
+                self.circuit_breaker.record(key, success, time.time() - start)
+
+    def _send(self, op, url, data, headers):
         """
         Handles the actual request, retrying if a 429 is encountered
 
@@ -532,8 +1181,11 @@ class API:
         """
         headers['User-Agent'] = "RosetteAPIPython/" + _BINDING_VERSION
         parsedUrl = urlparse.urlparse(url)
+        primary = getattr(self._local, "primary", None)
 
         self._connect(parsedUrl)
+        if primary is not None:
+            primary.attach(self.http_connection, url)
 
         message = None
         code = "unknownError"
@@ -544,7 +1196,11 @@ class API:
                 self.http_connection.request(op, url, data, headers)
                 response = self.http_connection.getresponse()
                 status = response.status
-                rdata = response.read()
+                self._local.last_status = status
+                rdata = self._read_body(response, url)
+                if self.accounting is not None:
+                    self._account("request_bytes", _body_size(data))
+                    self._account("response_bytes", self._local.received)
                 response_headers["responseHeaders"] = (
                     dict(response.getheaders()))
                 if status == 200:
@@ -552,11 +1208,16 @@ class API:
                         self.http_connection.close()
                     return rdata, status, response_headers
                 if status == 429:
+                    self._local.throttled = True
                     code = status
                     message = "{0} ({1})".format(rdata, i)
+                    if self.accounting is not None and i < self.num_retries:
+                        self._account("retries", 1)
                     time.sleep(self.connection_refresh_duration)
                     self.http_connection.close()
                     self._connect(parsedUrl)
+                    if primary is not None:
+                        primary.attach(self.http_connection, url)
                     continue
                 if rdata is not None:
                     try:
@@ -570,7 +1231,10 @@ class API:
                         raise RosetteException(code, message, url)
                     except:
                         raise
-            except (httplib.BadStatusLine, gaierror):
+            except (_http_client().HTTPException, gaierror, socket.error):
+                self.http_connection.close()
+                if primary is not None:
+                    primary.attach(None, url)
                 raise RosetteException(
                     "ConnectionError",
                     "Unable to establish connection to the Rosette API server",
@@ -581,6 +1245,61 @@ class API:
 
         raise RosetteException(code, message, url)
 
+    def _read_body(self, response, url):
+        """
+        Reads a response body.  Unless C{max_response_memory} or C{max_response_size}
+        is set, the body is read at once.  Otherwise it is read in pieces, gunzipped
+        as it arrives, and moved to a temporary file once it exceeds C{max_response_memory};
+        bodies over C{max_response_size} are refused.  The number of bytes read from the
+        response, before decompression, is left in C{self._local.received}.
+
+        @param response: the HTTP response
+        @param url: endpoint URL
+        @return: The body as a string, or a L{_SpilledBody}
+        """
+        limit = self.max_response_size
+        ceiling = self.max_response_memory
+        if limit is None and ceiling is None:
+            body = response.read()
+            self._local.received = len(body)
+            return body
+
+        length = response.getheader("Content-Length")
+        if limit is not None and length is not None and int(length) > limit:
+            self._refuse_body(limit, url)
+        chunks = []
+        size = 0
+        spill = None
+        received = [0]
+        self._local.received = 0
+        for chunk in _gunzipped(response, received):
+            size += len(chunk)
+            if limit is not None and size > limit:
+                if spill is not None:
+                    spill.close()
+                self._refuse_body(limit, url)
+            if spill is None and ceiling is not None and size > ceiling:
+                import tempfile
+                spill = tempfile.TemporaryFile()
+                spill.writelines(chunks)
+                chunks = None
+            if spill is not None:
+                spill.write(chunk)
+            else:
+                chunks.append(chunk)
+        self._local.received = received[0]
+        if spill is not None:
+            return _SpilledBody(spill, size)
+        return b"".join(chunks)
+
+    def _refuse_body(self, limit, url):
+        """ Drops the connection, whose response is not fully read, and signals the size error """
+        self.http_connection.close()
+        raise RosetteException(
+            "responseTooLarge",
+            "The response exceeds the limit of {0} bytes".format(limit),
+            url)
+
     def _get_http(self, url, headers):
         """
         Simple wrapper for the GET request
@@ -588,31 +1307,48 @@ class API:
         @param url: endpoint URL
         @param headers: request headers
         """
-        (rdata, status, response_headers) = self._make_request(
-            "GET", url, None, headers)
-        return _ReturnObject(_my_loads(rdata, response_headers), status)
+        with self._stage("_make_request"):
+            (rdata, status, response_headers) = self._make_request(
+                "GET", url, None, headers)
+        with self._stage("_my_loads"):
+            return _ReturnObject(_my_loads(rdata, response_headers), status)
 
-    def _post_http(self, url, data, headers):
+    def _post_http(self, url, data, headers, json_data=None):
         """
         Simple wrapper for the POST request
 
         @param url: endpoint URL
         @param data: request data
         @param headers: request headers
+        @param json_data: (Optional) the already encoded request body, used instead of C{data};
+        either a string or a list of byte strings to be sent one after the other
         """
-        if data is None:
+        if isinstance(json_data, list):
+            if _IsPy3:
+                headers['Content-Length'] = str(_body_size(json_data))
+            else:
+                json_data = b"".join(json_data)
+        elif json_data is not None:
+            pass
+        elif data is None:
             json_data = ""
         else:
-            json_data = json.dumps(data)
+            with self._stage("json.dumps"):
+                json_data = json.dumps(data)
 
-        (rdata, status, response_headers) = self._make_request(
-            "POST", url, json_data, headers)
+        with self._stage("_make_request"):
+            (rdata, status, response_headers) = self._make_request(
+                "POST", url, json_data, headers)
 
-        if len(rdata) > 3 and rdata[0:3] == _GZIP_SIGNATURE:
-            buf = BytesIO(rdata)
-            rdata = gzip.GzipFile(fileobj=buf).read()
+        if not isinstance(rdata, _SpilledBody) and len(rdata) > 3 and rdata[0:3] == _GZIP_SIGNATURE:
+            with self._stage("gzip"):
+                import gzip
+                from io import BytesIO
+                buf = BytesIO(rdata)
+                rdata = gzip.GzipFile(fileobj=buf).read()
 
-        return _ReturnObject(_my_loads(rdata, response_headers), status)
+        with self._stage("_my_loads"):
+            return _ReturnObject(_my_loads(rdata, response_headers), status)
 
     def ping(self):
         """
@@ -729,6 +1465,36 @@ class API:
         @return: A python dictionary containing the results of name translation."""
         return EndpointCaller(self, "name-translation").call(parameters)
 
+    def name_translation_many(self, parameters_list, memo=None, max_workers=None):
+        """
+        Translate many names, sending each distinct request to the server only once.
+        Repeated L{NameTranslationParameters} in the input, and those already present
+        in C{memo}, are answered without a server call; the remaining distinct requests
+        are sent concurrently.
+        @param parameters_list: An iterable of L{NameTranslationParameters}.
+        @param memo: (Optional) A L{rosette.bulk.PersistentMemo}, or the path of its file,
+        in which results are kept between runs.
+        @param max_workers: The maximum number of concurrent server calls; by default 8, or the
+        maximum of the L{API}'s C{limiter}, which then decides how many are actually in flight.
+        @return: A list of python dictionaries containing the results of name
+        translation, in the order of C{parameters_list}."""
+        from rosette.bulk import PersistentMemo, call_many
+        if max_workers is None:
+            max_workers = self.limiter.maximum if self.limiter is not None else 8
+        schedule = self._schedule()
+
+        def translate(parameters):
+            with self.priority(*schedule):
+                return self.name_translation(parameters)
+
+        if memo is None or isinstance(memo, PersistentMemo):
+            return call_many(translate, parameters_list, memo, max_workers)
+        memo = PersistentMemo(memo)
+        try:
+            return call_many(translate, parameters_list, memo, max_workers)
+        finally:
+            memo.close()
+
     def translated_name(self, parameters):
         """ deprecated
         Call name_translation to perform name analysis and translation
@@ -745,7 +1511,14 @@ class API:
         @param parameters: An object specifying the data,
         and possible metadata, to be processed by the name matcher.
         @type parameters: L{NameSimilarityParameters}
-        @return: A python dictionary containing the results of name matching."""
+        @return: A python dictionary containing the results of name matching.  If the
+        L{API} has a C{name_prefilter} and the pair scores below its threshold, the local
+        result is returned without calling the server."""
+        if self.name_prefilter is not None and isinstance(parameters, NameSimilarityParameters):
+            parameters.validate()
+            local_result = self.name_prefilter.check(parameters)
+            if local_result is not None:
+                return local_result
         return EndpointCaller(self, "name-similarity").call(parameters)
 
     def matched_name(self, parameters):
@@ -756,3 +1529,17 @@ class API:
         @type parameters: L{NameSimilarityParameters}
         @return: A python dictionary containing the results of name matching."""
         return self.name_similarity(parameters)
+
+
+def _future_method(name):
+    def method(self, *args, **kwargs):
+        return self.submit(getattr(self, name), *args, **kwargs)
+    method.__name__ = name + "_future"
+    method.__doc__ = """ Like L{API.%s}, but returns at once a C{concurrent.futures.Future} of
+        the result; see L{API.submit} """ % name
+    return method
+
+for _name in ("ping", "info", "language", "sentences", "tokens", "morphology", "entities",
+              "categories", "sentiment", "relationships", "name_translation", "name_similarity"):
+    setattr(API, _name + "_future", _future_method(_name))
+del _name
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+"""
+Load balancing across several Rosette API servers.
+
+Copyright (c) 2014-2015 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import logging
+import threading
+import time
+import weakref
+
+
+def _weak_method(method, callback):
+    """ Returns a function giving C{method}, or C{None} once its object is garbage collected;
+    C{callback} is then called """
+    owner = getattr(method, "__self__", None)
+    if owner is None:
+        return lambda: method
+    owner_ref = weakref.ref(owner, lambda _: callback())
+    function = method.__func__
+
+    def get():
+        target = owner_ref()
+        return None if target is None else function.__get__(target, type(target))
+    return get
+
+
+def _check_nodes(balancer_ref, check_ref, stop, interval):
+    """ The health checker; it only holds weak references, and ends when the balancer or
+    the owner of the check are garbage collected """
+    while not stop.wait(interval):
+        balancer = balancer_ref()
+        check = check_ref()
+        if balancer is None or check is None:
+            return
+        for node in balancer.nodes:
+            try:
+                check(node)
+            except Exception:
+                balancer.eject(node)
+            else:
+                balancer.readmit(node)
+        del balancer, check
+
+
+class Balancer(object):
+    """Least-outstanding-requests balancing over a list of service URLs.
+
+    A node that fails is ejected for C{ejection_time} seconds, after which it
+    is tried again.  An optional background health checker pings every node
+    periodically, ejecting nodes that fail and readmitting nodes that answer.
+    The checker does not keep the balancer, or the L{API} it checks for, alive.
+    """
+
+    def __init__(self, nodes, ejection_time=30.0):
+        """ Create a L{Balancer}.
+        @param nodes: The base URLs of the servers, each ending in C{/}.
+        @param ejection_time: Seconds a failed node is kept out of rotation.
+        """
+        self.nodes = list(nodes)
+        self.ejection_time = ejection_time
+        self._down_until = dict((node, 0.0) for node in self.nodes)
+        self._reset()
+
+    def _reset(self):
+        self.logger = logging.getLogger('rosette.api')
+        self._lock = threading.Lock()
+        self._outstanding = dict((node, 0) for node in self.nodes)
+        self._stop = threading.Event()
+        self._checker = None
+
+    def __getstate__(self):
+        return {"nodes": self.nodes, "ejection_time": self.ejection_time,
+                "_down_until": dict(self._down_until)}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reset()
+
+    def healthy(self, node):
+        """ Returns C{True} unless C{node} is currently ejected """
+        return self._down_until[node] <= time.time()
+
+    def acquire(self, exclude=()):
+        """ Picks the healthy node with the fewest outstanding requests and counts a
+        request against it.  If every node is ejected, ejected nodes are used rather than failing.
+        @param exclude: Nodes not to pick, e.g. those already tried for this request.
+        @return: The base URL of the chosen node, or C{None} if all nodes are excluded.
+        """
+        with self._lock:
+            candidates = [n for n in self.nodes if n not in exclude]
+            if not candidates:
+                return None
+            healthy = [n for n in candidates if self.healthy(n)] or candidates
+            node = min(healthy, key=lambda n: self._outstanding[n])
+            self._outstanding[node] += 1
+            return node
+
+    def release(self, node):
+        """ Marks a request acquired on C{node} as finished """
+        with self._lock:
+            self._outstanding[node] -= 1
+
+    def eject(self, node):
+        """ Takes C{node} out of rotation for C{ejection_time} seconds """
+        with self._lock:
+            self._down_until[node] = time.time() + self.ejection_time
+        self.logger.warning('Ejected ' + node)
+
+    def readmit(self, node):
+        """ Returns C{node} to rotation """
+        with self._lock:
+            if self._down_until[node] > time.time():
+                self.logger.info('Readmitted ' + node)
+            self._down_until[node] = 0.0
+
+    def start_health_checks(self, check, interval):
+        """ Starts a daemon thread that calls C{check(node)} for every node each C{interval} seconds.
+        A check that raises ejects the node; one that returns readmits it.  The checker stops
+        when the balancer, or the object C{check} is a method of, is garbage collected.
+        """
+        stop = self._stop
+        balancer_ref = weakref.ref(self, lambda _: stop.set())
+        check_ref = _weak_method(check, stop.set)
+        self._checker = threading.Thread(target=_check_nodes, args=(balancer_ref, check_ref, stop, interval),
+                                         name='rosette-health-check')
+        self._checker.daemon = True
+        self._checker.start()
+
+    def stop(self):
+        """ Stops the health checker, if running """
+        self._stop.set()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+
+"""
+Bulk helpers for the Rosette API: concurrent dispatch and persistent memoization.
+
+Copyright (c) 2014-2015 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import json
+import sqlite3
+import sys
+import threading
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+
+def map_concurrently(func, items, max_workers=8):
+    """ Applies C{func} to every element of C{items} using up to C{max_workers} threads.
+    @return: A list of C{(result, exception)} tuples in the order of C{items}; exactly
+    one element of each tuple is C{None}.
+    """
+    items = list(items)
+    outcomes = [None] * len(items)
+    if not items:
+        return outcomes
+    work = queue.Queue()
+    for ix, item in enumerate(items):
+        work.put((ix, item))
+
+    def worker():
+        while True:
+            try:
+                ix, item = work.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                outcomes[ix] = (func(item), None)
+            except Exception:
+                outcomes[ix] = (None, sys.exc_info()[1])
+
+    threads = [threading.Thread(target=worker) for _ in range(max(1, min(max_workers, len(items))))]
+    for t in threads:
+        t.daemon = True
+        t.start()
+    for t in threads:
+        t.join()
+    return outcomes
+
+
+class PersistentMemo(object):
+    """Result memo stored in an SQLite file, keyed by a string.
+
+    Values are stored as JSON.  With C{path=None} the memo lives in memory
+    only and is discarded with the object.
+    """
+
+    def __init__(self, path=None):
+        """ Create a L{PersistentMemo}.
+        @param path: Path of the SQLite file, created if missing, or C{None} for an in-memory memo.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path or ":memory:", check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS memo (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._db.commit()
+
+    def get_many(self, keys):
+        """ Looks up several keys at once.
+        @return: A dictionary holding the keys that were found and their values.
+        """
+        keys = list(keys)
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = self._db.execute(
+                    "SELECT key, value FROM memo WHERE key IN (%s)" % ",".join("?" * len(chunk)), chunk)
+                for key, value in rows:
+                    found[key] = json.loads(value)
+        return found
+
+    def put_many(self, items):
+        """ Stores C{(key, value)} pairs, replacing existing values """
+        with self._lock:
+            self._db.executemany("INSERT OR REPLACE INTO memo (key, value) VALUES (?, ?)",
+                                 [(k, json.dumps(v)) for k, v in items])
+            self._db.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM memo").fetchone()[0]
+
+    def close(self):
+        """ Closes the underlying database """
+        with self._lock:
+            self._db.close()
+
+
+def memo_key(parameters):
+    """ Returns the canonical memo key of a parameters object: its sorted JSON serialization """
+    return json.dumps(parameters.serialize(), sort_keys=True)
+
+
+def call_many(call, parameters_list, memo=None, max_workers=8):
+    """ Calls C{call} once per distinct parameters object, serving repeats and memoized
+    results without contacting the server.
+    @param call: A function taking a parameters object and returning a result dictionary.
+    @param parameters_list: An iterable of parameters objects.
+    @param memo: An optional L{PersistentMemo}; new results are added to it.
+    @param max_workers: Maximum number of concurrent calls for the misses.
+    @return: A list of results in the order of C{parameters_list}.
+    """
+    parameters_list = list(parameters_list)
+    keys = [memo_key(p) for p in parameters_list]
+    results = memo.get_many(set(keys)) if memo is not None else {}
+
+    misses = []
+    seen = set(results)
+    for key, parameters in zip(keys, parameters_list):
+        if key not in seen:
+            seen.add(key)
+            misses.append((key, parameters))
+
+    outcomes = map_concurrently(lambda miss: call(miss[1]), misses, max_workers)
+    fresh = []
+    error = None
+    for (key, _), (result, exc) in zip(misses, outcomes):
+        if exc is None:
+            results[key] = result
+            fresh.append((key, result))
+        elif error is None:
+            error = exc
+    if memo is not None and fresh:
+        memo.put_many(fresh)
+    if error is not None:
+        raise error
+    return [results[key] for key in keys]
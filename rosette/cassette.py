@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+
+"""
+Recording and replaying Rosette API traffic.
+
+Copyright (c) 2014-2015 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import base64
+import gzip
+import hashlib
+import json
+import threading
+import time
+
+try:
+    import urlparse
+except ImportError:
+    import urllib.parse as urlparse
+
+RECORD = "record"
+REPLAY = "replay"
+
+# never written to a cassette
+_SECRET_HEADERS = ("x-rosetteapi-key",)
+
+
+def _body_bytes(body):
+    if body is None:
+        return b""
+    if isinstance(body, list):
+        return b"".join(bytes(memoryview(chunk)) for chunk in body)
+    if not isinstance(body, bytes):
+        return body.encode("utf-8")
+    return body
+
+
+def _key(method, url, body):
+    path = urlparse.urlparse(url).path
+    return method + " " + path + " " + hashlib.sha1(body).hexdigest()
+
+
+class Cassette(object):
+    """A file of recorded Rosette API exchanges.
+
+    In C{record} mode, an L{API} created with C{cassette=} sends its requests
+    to the server as usual and appends each exchange to the file: method,
+    path, request headers (without the API key) and body, response status,
+    headers and body exactly as received (gzipped bodies stay gzipped), and
+    the latency until the body was read.  The file is gzipped JSON, one
+    exchange per line.
+
+    In C{replay} mode no connection is opened.  A request is answered with
+    the recorded response for the same method, path and request body, after
+    the recorded latency multiplied by C{latency_scale}.  Identical requests
+    are answered with their recordings in turn, starting over when all have
+    been used.  A request that was never recorded fails with a
+    L{rosette.api.RosetteException} of status C{notRecorded}.
+
+    A replaying cassette can be pickled and used by forked processes, each
+    of which goes through the recordings from the start.  A recording one
+    cannot: its file is open for appending, and writes from several
+    processes would corrupt it; open a cassette per process instead.
+    """
+
+    def __init__(self, path, mode=REPLAY, latency_scale=1.0):
+        """ Create a L{Cassette}.
+        @param path: Path of the cassette file.
+        @param mode: C{"record"} to append exchanges to the file, C{"replay"} to serve them.
+        @param latency_scale: Factor applied to recorded latencies on replay; 0 disables waiting.
+        """
+        if mode not in (RECORD, REPLAY):
+            raise ValueError("mode must be 'record' or 'replay'")
+        self.path = path
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self._file = None
+        self._exchanges = {}
+        self._reset()
+        if mode == RECORD:
+            self._file = gzip.open(path, "ab")
+        else:
+            with gzip.open(path, "rb") as f:
+                for line in f:
+                    exchange = json.loads(line.decode("utf-8"))
+                    self._exchanges.setdefault(exchange["key"], []).append(exchange)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._next = {}
+
+    def __getstate__(self):
+        if self.mode == RECORD:
+            raise TypeError("A recording Cassette cannot be pickled or shared with a forked process; "
+                            "open a cassette per process")
+        state = self.__dict__.copy()
+        for name in ("_lock", "_next"):
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reset()
+
+    def __len__(self):
+        return sum(len(v) for v in self._exchanges.values())
+
+    def wrap(self, connection):
+        """ Returns the connection the L{API} should use in place of C{connection} """
+        if self.mode == RECORD:
+            return _RecordingConnection(self, connection)
+        return _ReplayConnection(self)
+
+    def _write(self, exchange):
+        line = (json.dumps(exchange, sort_keys=True) + "\n").encode("utf-8")
+        with self._lock:
+            self._exchanges.setdefault(exchange["key"], []).append(exchange)
+            self._file.write(line)
+            self._file.flush()
+
+    def _take(self, key, url):
+        with self._lock:
+            exchanges = self._exchanges.get(key)
+            if not exchanges:
+                from rosette.api import RosetteException
+                raise RosetteException("notRecorded", "No recorded response for this request", url)
+            ix = self._next.get(key, 0)
+            self._next[key] = (ix + 1) % len(exchanges)
+            return exchanges[ix]
+
+    def close(self):
+        """ Closes the cassette file when recording """
+        if self._file is not None:
+            with self._lock:
+                self._file.close()
+                self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class _RecordingResponse(object):
+
+    def __init__(self, cassette, response, exchange, started):
+        self._cassette = cassette
+        self._response = response
+        self._exchange = exchange
+        self._started = started
+        self._chunks = []
+        self._done = False
+        self.status = response.status
+        self.reason = response.reason
+
+    def getheaders(self):
+        return self._response.getheaders()
+
+    def getheader(self, name, default=None):
+        return self._response.getheader(name, default)
+
+    def read(self, amt=None):
+        chunk = self._response.read() if amt is None else self._response.read(amt)
+        if chunk:
+            self._chunks.append(chunk)
+        if not self._done and (amt is None or not chunk):
+            self._done = True
+            self._exchange.update({
+                "status": self.status,
+                "response_headers": [list(h) for h in self._response.getheaders()],
+                "response_body": base64.b64encode(b"".join(self._chunks)).decode("ascii"),
+                "latency": time.time() - self._started})
+            self._cassette._write(self._exchange)
+        return chunk
+
+
+class _RecordingConnection(object):
+
+    def __init__(self, cassette, connection):
+        self._cassette = cassette
+        self._connection = connection
+        self._pending = None
+
+    def request(self, method, url, body=None, headers={}):
+        data = _body_bytes(body)
+        self._pending = ({
+            "key": _key(method, url, data),
+            "method": method,
+            "path": urlparse.urlparse(url).path,
+            "request_headers": dict((k, v) for (k, v) in headers.items()
+                                    if k.lower() not in _SECRET_HEADERS),
+            "request_body": base64.b64encode(data).decode("ascii")}, time.time())
+        self._connection.request(method, url, body, headers)
+
+    def getresponse(self):
+        exchange, started = self._pending
+        return _RecordingResponse(self._cassette, self._connection.getresponse(), exchange, started)
+
+    def close(self):
+        self._connection.close()
+
+
+class _ReplayResponse(object):
+
+    def __init__(self, exchange):
+        self.status = exchange["status"]
+        self.reason = ""
+        self._headers = [tuple(h) for h in exchange["response_headers"]]
+        self._body = base64.b64decode(exchange["response_body"])
+        self._offset = 0
+
+    def getheaders(self):
+        return list(self._headers)
+
+    def getheader(self, name, default=None):
+        for (k, v) in self._headers:
+            if k.lower() == name.lower():
+                return v
+        return default
+
+    def read(self, amt=None):
+        end = len(self._body) if amt is None else self._offset + amt
+        chunk = self._body[self._offset:end]
+        self._offset += len(chunk)
+        return chunk
+
+
+class _ReplayConnection(object):
+
+    def __init__(self, cassette):
+        self._cassette = cassette
+        self._pending = None
+
+    def request(self, method, url, body=None, headers={}):
+        self._pending = (_key(method, url, _body_bytes(body)), url)
+
+    def getresponse(self):
+        exchange = self._cassette._take(*self._pending)
+        if self._cassette.latency_scale > 0:
+            time.sleep(exchange["latency"] * self._cassette.latency_scale)
+        return _ReplayResponse(exchange)
+
+    def close(self):
+        pass
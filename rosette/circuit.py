@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+
+"""
+Circuit breaking for Rosette API endpoints.
+
+Copyright (c) 2014-2015 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from collections import deque
+import logging
+import threading
+import time
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class _Circuit(object):
+
+    def __init__(self, window):
+        self.state = CLOSED
+        self.outcomes = deque(maxlen=window)
+        self.opened_at = 0.0
+        self.probes = 0
+
+
+class CircuitBreaker(object):
+    """Per endpoint, per host circuit breaker.
+
+    Every request is keyed by the server host and the endpoint path.  The
+    outcomes of the last C{window} requests of a key are kept; a request
+    fails if the server could not be reached, answered with a 5xx status,
+    kept answering 429 after all retries, or took longer than
+    C{slow_call_duration} seconds.  Once at least C{min_calls} outcomes are
+    known and the failure rate reaches C{error_rate}, the circuit opens and
+    requests for that key are refused immediately.  After C{open_duration}
+    seconds the circuit is half open: up to C{probes} requests are let
+    through, and the first probe outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, error_rate=0.5, window=20, min_calls=10, slow_call_duration=None,
+                 open_duration=30.0, probes=1):
+        """ Create a L{CircuitBreaker}.
+        @param error_rate: Failure fraction, between 0 and 1, at which a circuit opens.
+        @param window: Number of recent outcomes considered per key.
+        @param min_calls: Minimum number of outcomes before a circuit may open.
+        @param slow_call_duration: Seconds after which a successful request counts as failed, or C{None}.
+        @param open_duration: Seconds a circuit stays open before probing.
+        @param probes: Number of concurrent probe requests allowed while half open.
+        """
+        self.error_rate = error_rate
+        self.window = window
+        self.min_calls = max(1, min(min_calls, window))
+        self.slow_call_duration = slow_call_duration
+        self.open_duration = open_duration
+        self.probes = max(1, probes)
+        self._reset()
+
+    def _reset(self):
+        self.logger = logging.getLogger('rosette.api')
+        self._lock = threading.Lock()
+        self._circuits = {}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in ("logger", "_lock", "_circuits"):
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reset()
+
+    def _circuit(self, key):
+        circuit = self._circuits.get(key)
+        if circuit is None:
+            circuit = self._circuits[key] = _Circuit(self.window)
+        return circuit
+
+    def state(self, key):
+        """ Returns the state (C{closed}, C{open} or C{half-open}) of the circuit for C{key} """
+        with self._lock:
+            circuit = self._circuit(key)
+            if circuit.state == OPEN and time.time() - circuit.opened_at >= self.open_duration:
+                return HALF_OPEN
+            return circuit.state
+
+    def allow(self, key):
+        """ Decides whether a request for C{key} may be sent now, reserving a probe slot
+        if the circuit is half open.
+        @return: C{True} if the request may proceed.
+        """
+        with self._lock:
+            circuit = self._circuit(key)
+            if circuit.state == CLOSED:
+                return True
+            if circuit.state == OPEN:
+                if time.time() - circuit.opened_at < self.open_duration:
+                    return False
+                circuit.state = HALF_OPEN
+                circuit.probes = 0
+            if circuit.probes >= self.probes:
+                return False
+            circuit.probes += 1
+            return True
+
+    def record(self, key, success, duration):
+        """ Records the outcome of a request for C{key} that was allowed by L{CircuitBreaker.allow}.
+        @param success: Whether the request succeeded.
+        @param duration: Seconds the request took.
+        """
+        if success and self.slow_call_duration is not None and duration > self.slow_call_duration:
+            success = False
+        with self._lock:
+            circuit = self._circuit(key)
+            if circuit.state == HALF_OPEN:
+                circuit.probes -= 1
+                if success:
+                    circuit.state = CLOSED
+                    circuit.outcomes.clear()
+                    self.logger.info('Circuit closed for ' + repr(key))
+                else:
+                    self._open(circuit, key)
+                return
+            if circuit.state == OPEN:
+                return
+            circuit.outcomes.append(success)
+            failures = circuit.outcomes.count(False)
+            if len(circuit.outcomes) >= self.min_calls and \
+                    failures >= self.error_rate * len(circuit.outcomes):
+                self._open(circuit, key)
+
+    def _open(self, circuit, key):
+        circuit.state = OPEN
+        circuit.opened_at = time.time()
+        circuit.outcomes.clear()
+        self.logger.warning('Circuit opened for ' + repr(key))
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+
+"""
+Near-duplicate document detection for Rosette API calls.
+
+Copyright (c) 2014-2015 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from collections import OrderedDict
+import copy
+import json
+import random
+import re
+import threading
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+REUSE = "reuse"
+FLAG = "flag"
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+_PRIME = (1 << 31) - 1
+
+
+class NearDuplicateIndex(object):
+    """Recognizes documents that are nearly identical to one already sent.
+
+    Each document is reduced to the MinHash signature of its word
+    C{shingle}-grams; the fraction of equal signature values estimates the
+    Jaccard similarity of two documents.  Signatures are split into C{bands}
+    locality-sensitive hash buckets, so a lookup only compares the documents
+    sharing a bucket.  Only documents sent to the same endpoint with the same
+    other parameters (language, options, ...) are compared.
+
+    When a document is at least C{threshold} similar to a known one, the
+    call is not sent.  In C{reuse} mode the known document's result is
+    returned, with a C{nearDuplicate} entry giving the estimated similarity;
+    offsets in it refer to the known document.  In C{flag} mode only the
+    C{nearDuplicate} entry is returned.
+
+    At most C{capacity} documents are kept, the least recently matched
+    being evicted first.  When NumPy is available signatures are computed
+    as array operations; otherwise a pure python fallback gives identical
+    signatures.
+    """
+
+    def __init__(self, threshold=0.9, mode=REUSE, capacity=10000, num_perm=64, bands=16,
+                 shingle=3, endpoints=None, seed=1):
+        """ Create a L{NearDuplicateIndex}.
+        @param threshold: Estimated Jaccard similarity, between 0 and 1, from which a document is a duplicate.
+        @param mode: C{"reuse"} to return the known result, C{"flag"} to only report the duplicate.
+        @param capacity: Maximum number of documents kept.
+        @param num_perm: Number of MinHash values per signature.
+        @param bands: Number of LSH bands; must divide C{num_perm}.
+        @param shingle: Number of words per shingle.
+        @param endpoints: (Optional) Endpoints to deduplicate, e.g. C{["entities"]}; by default all.
+        @param seed: Seed of the hash permutations.
+        """
+        if mode not in (REUSE, FLAG):
+            raise ValueError("mode must be 'reuse' or 'flag'")
+        if num_perm % bands:
+            raise ValueError("bands must divide num_perm")
+        self.threshold = threshold
+        self.mode = mode
+        self.capacity = capacity
+        self.num_perm = num_perm
+        self.bands = bands
+        self.shingle = max(1, shingle)
+        self.endpoints = None if endpoints is None else set(endpoints)
+        self.seed = seed
+        rand = random.Random(seed)
+        self._a = [rand.randint(1, _PRIME - 1) for _ in range(num_perm)]
+        self._b = [rand.randint(0, _PRIME - 1) for _ in range(num_perm)]
+        self._reset()
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # id -> (signature, result, bucket keys)
+        self._buckets = {}  # bucket key -> set of ids
+        self._next_id = 0
+        self._hits = 0
+        self._misses = 0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in ("_lock", "_entries", "_buckets", "_next_id", "_hits", "_misses"):
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reset()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    @property
+    def stats(self):
+        """ A dictionary with the number of C{hits} (calls not sent) and C{misses} """
+        with self._lock:
+            return {"hits": self._hits, "misses": self._misses}
+
+    def _shingles(self, text):
+        words = _TOKEN_RE.findall(text.lower())
+        n = self.shingle
+        if len(words) <= n:
+            return [u" ".join(words)]
+        return set(u" ".join(words[i:i + n]) for i in range(len(words) - n + 1))
+
+    def signature(self, text):
+        """ Returns the MinHash signature of C{text} as a tuple of C{num_perm} integers """
+        hashes = [hash(s) & _PRIME for s in self._shingles(text)]
+        if numpy is not None:
+            h = numpy.array(hashes, dtype=numpy.int64)
+            a = numpy.array(self._a, dtype=numpy.int64)[:, None]
+            b = numpy.array(self._b, dtype=numpy.int64)[:, None]
+            return tuple(((a * h + b) % _PRIME).min(axis=1).tolist())
+        return tuple(min((a * h + b) % _PRIME for h in hashes) for a, b in zip(self._a, self._b))
+
+    def _bucket_keys(self, group, signature):
+        rows = self.num_perm // self.bands
+        return [(group, band, signature[band * rows:(band + 1) * rows]) for band in range(self.bands)]
+
+    def lookup(self, endpoint, parameters, content):
+        """ Finds a known document similar to C{content}.
+        @param endpoint: The endpoint the document is sent to.
+        @param parameters: The other serialized parameters of the call, as a dictionary.
+        @param content: The text of the document.
+        @return: A pair: the result to return instead of calling the server, or C{None}; and a
+        token to pass to L{NearDuplicateIndex.add} with the server's result.
+        """
+        if self.endpoints is not None and endpoint not in self.endpoints:
+            return None, None
+        group = (endpoint, json.dumps(parameters, sort_keys=True))
+        signature = self.signature(content)
+        keys = self._bucket_keys(group, signature)
+        with self._lock:
+            candidates = set()
+            for key in keys:
+                candidates.update(self._buckets.get(key, ()))
+            best, best_similarity = None, 0.0
+            for entry_id in candidates:
+                known = self._entries[entry_id][0]
+                similarity = sum(1 for x, y in zip(signature, known) if x == y) / float(self.num_perm)
+                if similarity > best_similarity:
+                    best, best_similarity = entry_id, similarity
+            if best is None or best_similarity < self.threshold:
+                self._misses += 1
+                return None, (keys, signature)
+            self._hits += 1
+            self._entries[best] = self._entries.pop(best)  # most recently used
+            result = self._entries[best][1]
+        marker = {"similarity": best_similarity}
+        if self.mode == FLAG:
+            return {"nearDuplicate": marker}, None
+        result = copy.deepcopy(result)
+        result["nearDuplicate"] = marker
+        return result, None
+
+    def add(self, token, result):
+        """ Remembers the server's C{result} for the document of a L{NearDuplicateIndex.lookup}
+        that returned C{token} """
+        if token is None:
+            return
+        keys, signature = token
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (signature, result, keys)
+            for key in keys:
+                self._buckets.setdefault(key, set()).add(entry_id)
+            while len(self._entries) > self.capacity:
+                evicted, (_, _, evicted_keys) = self._entries.popitem(last=False)
+                for key in evicted_keys:
+                    bucket = self._buckets[key]
+                    bucket.discard(evicted)
+                    if not bucket:
+                        del self._buckets[key]
@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+
+"""
+Hedged Rosette API requests.
+
+Copyright (c) 2014-2015 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from collections import deque
+import heapq
+import itertools
+import sys
+import threading
+import time
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+
+class _Workers(object):
+    """Daemon threads that outlive a task, so that each keeps its own HTTP
+    connections between calls.  A thread is added whenever a task finds none
+    idle, up to C{maximum}; beyond that tasks are refused.  A thread idle for
+    C{idle_timeout} seconds exits."""
+
+    def __init__(self, maximum, idle_timeout):
+        self.maximum = maximum
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._tasks = queue.Queue()
+        self._idle = 0
+        self._threads = 0
+
+    def __len__(self):
+        with self._lock:
+            return self._threads
+
+    def submit(self, task):
+        """ Starts C{task} on a thread, unless all C{maximum} threads are busy
+        @return: Whether the task was started.
+        """
+        with self._lock:
+            if self._idle > 0:
+                self._idle -= 1
+            elif self._threads < self.maximum:
+                self._threads += 1
+                thread = threading.Thread(target=self._run, name='rosette-hedge')
+                thread.daemon = True
+                thread.start()
+            else:
+                return False
+        self._tasks.put(task)
+        return True
+
+    def _run(self):
+        while True:
+            try:
+                task = self._tasks.get(timeout=self.idle_timeout)
+            except queue.Empty:
+                with self._lock:
+                    # leave unless a task was handed to the idle threads meanwhile
+                    if self._idle > 0 and self._tasks.empty():
+                        self._idle -= 1
+                        self._threads -= 1
+                        return
+                continue
+            task()
+            with self._lock:
+                self._idle += 1
+
+
+class _Timer(object):
+    """One daemon thread calling functions when they are due.  It exits after
+    C{idle_timeout} seconds with nothing to do."""
+
+    def __init__(self, idle_timeout):
+        self.idle_timeout = idle_timeout
+        self._condition = threading.Condition()
+        self._due = []  # heap of (time, sequence number, function)
+        self._sequence = itertools.count()
+        self._running = False
+
+    def schedule(self, delay, function):
+        with self._condition:
+            heapq.heappush(self._due, (time.time() + delay, next(self._sequence), function))
+            if not self._running:
+                self._running = True
+                thread = threading.Thread(target=self._run, name='rosette-hedge-timer')
+                thread.daemon = True
+                thread.start()
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    if not self._due:
+                        self._condition.wait(self.idle_timeout)
+                        if not self._due:
+                            self._running = False
+                            return
+                        continue
+                    wait = self._due[0][0] - time.time()
+                    if wait <= 0:
+                        function = heapq.heappop(self._due)[2]
+                        break
+                    self._condition.wait(wait)
+            function()
+
+
+class _Race(object):
+    """The state shared by the copies of one hedged call"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.primary_done = False
+        self.launched = False
+        self.outcome = queue.Queue()
+
+
+class HedgePolicy(object):
+    """Sends a second copy of a slow request and takes whichever answer comes first.
+
+    For every endpoint the latencies of the last C{window} calls are kept.
+    Once C{min_samples} are known, a call that has not completed after the
+    C{percentile} latency (but at least C{min_delay} seconds) is sent again,
+    on another connection or, with several service URLs, usually to another
+    server.  Hedges are limited to C{max_extra} times the number of calls, so
+    hedging cannot add more than that fraction of load; the copy that loses
+    is left to finish in the background and its answer is dropped.
+
+    The first copy always runs on the calling thread, so hedging does not
+    limit how many calls run at once.  Second copies run on at most
+    C{max_workers} worker threads, which exit after C{idle_timeout} idle
+    seconds; when all are busy a slow call is not hedged.  When the second
+    copy answers first, the first one is cancelled through the C{cancel}
+    function given to L{HedgePolicy.call}, which lets the calling thread
+    return.
+
+    Both copies count against the L{API}'s accounting, limiter and scheduler.
+    """
+
+    def __init__(self, percentile=95, min_delay=0.01, max_extra=0.05, window=200, min_samples=20,
+                 endpoints=None, max_workers=32, idle_timeout=10.0):
+        """ Create a L{HedgePolicy}.
+        @param percentile: Latency percentile, between 0 and 100, after which a call is hedged.
+        @param min_delay: Minimum seconds before hedging.
+        @param max_extra: Maximum number of hedges as a fraction of the calls.
+        @param window: Number of recent latencies kept per endpoint.
+        @param min_samples: Number of latencies an endpoint needs before its calls are hedged.
+        @param endpoints: (Optional) Endpoints to hedge, e.g. C{["sentiment", "language"]}; by default all.
+        @param max_workers: Maximum number of worker threads sending hedged calls.
+        @param idle_timeout: Seconds after which an idle worker thread exits.
+        """
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.max_extra = max_extra
+        self.window = window
+        self.min_samples = min_samples
+        self.endpoints = None if endpoints is None else set(endpoints)
+        self.max_workers = max(1, max_workers)
+        self.idle_timeout = idle_timeout
+        self._reset()
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._latencies = {}
+        self._calls = 0
+        self._hedged = 0
+        self._hedge_wins = 0
+        self._workers = _Workers(self.max_workers, self.idle_timeout)
+        self._timer = _Timer(self.idle_timeout)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in ("_lock", "_latencies", "_calls", "_hedged", "_hedge_wins", "_workers", "_timer"):
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reset()
+
+    @property
+    def stats(self):
+        """ A dictionary with the number of C{calls}, of calls C{hedged}, and of C{hedge_wins},
+        the hedged calls answered by the second copy. """
+        with self._lock:
+            return {"calls": self._calls, "hedged": self._hedged, "hedge_wins": self._hedge_wins}
+
+    def delay(self, endpoint):
+        """ Returns the seconds after which a call to C{endpoint} should be hedged, or C{None} """
+        if self.endpoints is not None and endpoint not in self.endpoints:
+            return None
+        with self._lock:
+            latencies = self._latencies.get(endpoint)
+            if latencies is None or len(latencies) < self.min_samples:
+                return None
+            ordered = sorted(latencies)
+        rank = int(round(self.percentile / 100.0 * (len(ordered) - 1)))
+        return max(self.min_delay, ordered[rank])
+
+    def _allow_hedge(self):
+        with self._lock:
+            if self._hedged + 1 > self.max_extra * self._calls:
+                return False
+            self._hedged += 1
+            return True
+
+    def _record(self, endpoint, latency, hedge_won):
+        with self._lock:
+            self._calls += 1
+            if hedge_won:
+                self._hedge_wins += 1
+            latencies = self._latencies.get(endpoint)
+            if latencies is None:
+                latencies = self._latencies[endpoint] = deque(maxlen=self.window)
+            latencies.append(latency)
+
+    def call(self, endpoint, attempt, cancel=None):
+        """ Runs C{attempt()} on the calling thread, and a second time on a worker thread if it is slow.
+        @param endpoint: The endpoint name, used to choose the delay.
+        @param attempt: A function sending the request and returning its result.
+        @param cancel: (Optional) A function making the first C{attempt()} raise soon, called from the
+        worker thread when the second copy succeeds first.  Without it the first copy is waited for.
+        @return: The result of the first copy to succeed; if all copies fail, the first copy's
+        exception is raised.
+        """
+        started = time.time()
+        delay = self.delay(endpoint)
+        if delay is None:
+            try:
+                return attempt()
+            finally:
+                self._record(endpoint, time.time() - started, False)
+        race = _Race()
+        self._timer.schedule(delay, lambda: self._launch(race, attempt, cancel))
+        try:
+            result = attempt()
+        except Exception:
+            error = sys.exc_info()[1]
+            with race.lock:
+                race.primary_done = True
+                launched = race.launched
+            if launched:
+                hedge_result, hedge_error = race.outcome.get()
+                if hedge_error is None:
+                    self._record(endpoint, time.time() - started, True)
+                    return hedge_result
+            self._record(endpoint, time.time() - started, False)
+            raise error
+        finally:
+            with race.lock:
+                race.primary_done = True
+        self._record(endpoint, time.time() - started, False)
+        return result
+
+    def _launch(self, race, attempt, cancel):
+        """ Sends the second copy of a call that is still running, if allowed; called by the timer """
+
+        def task():
+            try:
+                outcome = (attempt(), None)
+            except Exception:
+                outcome = (None, sys.exc_info()[1])
+            race.outcome.put(outcome)
+            with race.lock:
+                abandon = outcome[1] is None and not race.primary_done
+            if abandon and cancel is not None:
+                cancel()
+
+        with race.lock:
+            if race.primary_done or not self._allow_hedge():
+                return
+            if not self._workers.submit(task):
+                with self._lock:
+                    self._hedged -= 1
+                return
+            race.launched = True
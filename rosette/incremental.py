@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+
+"""
+Incremental reprocessing of edited documents.
+
+Copyright (c) 2014-2015 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import copy
+import hashlib
+import json
+import re
+import threading
+
+from rosette.api import DocumentParameters, EndpointCaller, RosetteException
+from rosette.bulk import map_concurrently
+
+_PARAGRAPH_BREAK_RE = re.compile(r"\n[ \t\r\f\v]*\n\s*")
+_SENTENCE_BREAK_RE = re.compile(r"(?<=[.!?])\s+")
+
+
+def segment(text, max_block=2000):
+    """ Splits C{text} into blocks: paragraphs, and sentences of paragraphs longer than C{max_block}.
+    An edit only changes the blocks it touches.
+    @return: A list of C{(start, text)} pairs, C{start} being the offset of the block in C{text}.
+    """
+    blocks = []
+    start = 0
+    for end in [m.start() for m in _PARAGRAPH_BREAK_RE.finditer(text)] + [len(text)]:
+        paragraph = text[start:end]
+        if paragraph.strip():
+            if len(paragraph) <= max_block:
+                blocks.append((start, paragraph))
+            else:
+                blocks.extend(_sentence_blocks(paragraph, start, max_block))
+        match = _PARAGRAPH_BREAK_RE.match(text, end)
+        start = match.end() if match else end
+    return blocks
+
+
+def _sentence_blocks(paragraph, offset, max_block):
+    blocks = []
+    block_start = 0
+    for match in _SENTENCE_BREAK_RE.finditer(paragraph):
+        if match.start() - block_start >= max_block:
+            blocks.append((offset + block_start, paragraph[block_start:match.start()]))
+            block_start = match.end()
+    blocks.append((offset + block_start, paragraph[block_start:]))
+    return blocks
+
+
+def _shift(value, delta):
+    """ Returns a copy of a result fragment with every C{...Offset} integer moved by C{delta} """
+    if isinstance(value, dict):
+        return dict((k, v + delta if k.endswith("Offset") and isinstance(v, int) else _shift(v, delta))
+                    for k, v in value.items())
+    if isinstance(value, list):
+        return [_shift(v, delta) for v in value]
+    return value
+
+
+def _merge_entities(entities_lists):
+    merged = []
+    by_key = {}
+    for entities in entities_lists:
+        for entity in entities:
+            key = (entity.get("type"), entity.get("normalized", entity.get("mention")))
+            known = by_key.get(key)
+            if known is None:
+                known = by_key[key] = copy.deepcopy(entity)
+                known["indocChainId"] = len(merged)
+                merged.append(known)
+                continue
+            known["count"] = known.get("count", 1) + entity.get("count", 1)
+            if "confidence" in entity:
+                known["confidence"] = max(known.get("confidence", 0.0), entity["confidence"])
+            if "mentionOffsets" in entity:
+                known.setdefault("mentionOffsets", []).extend(copy.deepcopy(entity["mentionOffsets"]))
+    merged.sort(key=lambda e: -e.get("count", 1))
+    return merged
+
+
+def _merge_document_sentiment(parts):
+    """ Length-weighted vote of the block labels """
+    votes = {}
+    total = 0
+    for length, document in parts:
+        label = document.get("label")
+        votes[label] = votes.get(label, 0.0) + length * document.get("confidence", 1.0)
+        total += length
+    label = max(votes, key=votes.get)
+    return {"label": label, "confidence": votes[label] / total if total else 0.0}
+
+
+def merge_results(blocks):
+    """ Reassembles per-block results into the result for the whole document.
+    @param blocks: A list of C{(start, length, result)} triples, C{result} having offsets relative
+    to its block.
+    @return: A single result with offsets relative to the document.  C{entities} lists are merged
+    by type and normalized form, a C{document} sentiment is a length-weighted vote of the blocks,
+    other lists are concatenated, and other values are taken from the first block.
+    """
+    merged = {}
+    for start, length, result in blocks:
+        for key, value in _shift(result, start).items():
+            if key == "responseHeaders":
+                continue
+            if key == "entities":
+                merged.setdefault(key, []).append(value)
+            elif key == "document" and isinstance(value, dict):
+                merged.setdefault(key, []).append((length, value))
+            elif isinstance(value, list):
+                merged.setdefault(key, []).extend(value)
+            else:
+                merged.setdefault(key, value)
+    if "entities" in merged:
+        merged["entities"] = _merge_entities(merged["entities"])
+    if "document" in merged:
+        merged["document"] = _merge_document_sentiment(merged["document"])
+    return merged
+
+
+def _text(content):
+    if content is None:
+        raise RosetteException("badArgument", "Incremental processing needs the content, not a contentUri",
+                               "bad arguments")
+    if isinstance(content, (bytes, bytearray, memoryview)):
+        try:
+            return bytes(content).decode("utf-8")
+        except UnicodeDecodeError:
+            raise RosetteException("badArgument", "The content is not UTF-8 text", "bad arguments")
+    return content
+
+
+class IncrementalProcessor(object):
+    """Processes successive versions of documents, sending only what changed.
+
+    Each version is split into paragraph blocks (see L{segment}).  For every
+    document id the results of its blocks are kept, keyed by a hash of the
+    block text and the other parameters; when a new version arrives, only
+    blocks not seen in the previous version are sent, and the block results
+    are merged into a full result with offsets relative to the new version.
+
+    Entities and sentiment computed per block can differ from those of the
+    whole document where they depend on context across paragraphs (e.g.
+    coreference chains and the overall label); the merged result is an
+    approximation of the whole-document result in those respects.
+    """
+
+    def __init__(self, api, max_block=2000, max_workers=4):
+        """ Create an L{IncrementalProcessor}.
+        @param api: The L{API} object to send the blocks with.
+        @param max_block: Paragraphs longer than this many characters are split into sentences.
+        @param max_workers: Maximum number of blocks sent concurrently.
+        """
+        self.api = api
+        self.max_block = max_block
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        self._documents = {}  # (endpoint, document id) -> block key -> result
+        self._sent = 0
+        self._reused = 0
+
+    @property
+    def stats(self):
+        """ A dictionary with the number of blocks C{sent} to the server and C{reused} """
+        with self._lock:
+            return {"sent": self._sent, "reused": self._reused}
+
+    def forget(self, document_id):
+        """ Drops the stored block results of a document """
+        with self._lock:
+            for key in [k for k in self._documents if k[1] == document_id]:
+                del self._documents[key]
+
+    def process(self, document_id, parameters, endpoint="entities"):
+        """ Processes a version of a document.
+        @param document_id: Identifies the document across versions.
+        @param parameters: A L{DocumentParameters} with C{content}, or a string.  Byte content
+        is decoded as UTF-8, and the offsets of the result count characters.
+        @param endpoint: The endpoint, e.g. C{"entities"} or C{"sentiment"}.
+        @return: The merged result, with an C{incremental} entry giving the number of C{blocks}
+        and of blocks C{sent}.
+        @raise RosetteException: If there is no content (e.g. only a C{contentUri}), or byte content
+        is not UTF-8.
+        """
+        if not isinstance(parameters, DocumentParameters):
+            text = parameters
+            parameters = DocumentParameters()
+            parameters["content"] = text
+        fixed = dict((k, v) for (k, v) in parameters.serialize().items() if k != "content")
+        fixed_key = json.dumps(fixed, sort_keys=True)
+        blocks = segment(_text(parameters["content"]), self.max_block)
+        keys = [hashlib.sha1((fixed_key + "\n" + text).encode("utf-8")).hexdigest() for _, text in blocks]
+
+        with self._lock:
+            known = self._documents.get((endpoint, document_id), {})
+        missing = {}
+        for key, (start, text) in zip(keys, blocks):
+            if key not in known and key not in missing:
+                missing[key] = text
+
+        def send(item):
+            block = DocumentParameters()
+            for name, value in fixed.items():
+                block[name] = value
+            block["content"] = item[1]
+            return EndpointCaller(self.api, endpoint).call(block)
+
+        items = list(missing.items())
+        outcomes = map_concurrently(send, items, self.max_workers)
+        fresh = dict(known)
+        error = None
+        for (key, _), (result, exc) in zip(items, outcomes):
+            if exc is None:
+                fresh[key] = result
+            elif error is None:
+                error = exc
+        with self._lock:
+            self._sent += len(items)
+            self._reused += len(blocks) - len(items)
+            if error is None:
+                fresh = dict((key, fresh[key]) for key in keys)
+            self._documents[(endpoint, document_id)] = fresh
+        if error is not None:
+            raise error
+
+        result = merge_results([(start, len(text), fresh[key]) for key, (start, text) in zip(keys, blocks)])
+        result["incremental"] = {"blocks": len(blocks), "sent": len(items)}
+        return result
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+
+"""
+Adaptive concurrency limiting of Rosette API requests.
+
+Copyright (c) 2014-2015 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from collections import deque
+import logging
+import threading
+import time
+
+# latencies below this many seconds are treated as equal, so that the jitter
+# of a very fast server does not look like a latency spike
+_MIN_BASELINE = 0.005
+# latencies an endpoint needs before its requests are judged by latency
+_MIN_SAMPLES = 5
+
+
+class AdaptiveLimiter(object):
+    """Limits the number of requests in flight, adapting the limit to the
+    server by additive increase, multiplicative decrease (AIMD).
+
+    While at least half the limit is used and latencies stay within
+    C{latency_tolerance} times the baseline, every successful request raises
+    the limit by C{increase / limit}, i.e. by about C{increase} per round
+    trip.  The baseline of an endpoint is the C{percentile} latency of its
+    last C{window} successful requests, so that calls of varying cost (e.g.
+    short and long documents) do not look like overload.  A request that was
+    throttled (429), could not reach the server or timed out, or took longer
+    than the tolerance, multiplies the limit by C{decrease}.  Only requests
+    started after the previous decrease can cause another, so a burst of
+    failures cuts the limit once.  Other failed requests (e.g. 4xx answers)
+    leave the limit unchanged.
+    """
+
+    def __init__(self, initial=4, minimum=1, maximum=64, increase=1.0, decrease=0.5,
+                 latency_tolerance=2.0, window=100, percentile=90):
+        """ Create an L{AdaptiveLimiter}.
+        @param initial: The starting limit.
+        @param minimum: The lowest limit.
+        @param maximum: The highest limit.
+        @param increase: Growth of the limit per round trip while the server keeps up.
+        @param decrease: Factor, between 0 and 1, applied to the limit on overload.
+        @param latency_tolerance: Multiple of the baseline latency above which a request counts as overload.
+        @param window: Number of recent successful requests per endpoint the baseline latency is taken from.
+        @param percentile: Percentile, between 0 and 100, of the recent latencies used as the baseline.
+        """
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.initial = min(max(initial, self.minimum), self.maximum)
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_tolerance = latency_tolerance
+        self.window = window
+        self.percentile = percentile
+        self._reset()
+
+    def _reset(self):
+        self.logger = logging.getLogger('rosette.api')
+        self._cond = threading.Condition()
+        self._limit = float(self.initial)
+        self._in_flight = 0
+        self._latencies = {}  # endpoint -> recent latencies of successful requests
+        self._last_decrease = 0.0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in ("logger", "_cond", "_limit", "_in_flight", "_latencies", "_last_decrease"):
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reset()
+
+    @property
+    def limit(self):
+        """ The current number of requests allowed in flight """
+        with self._cond:
+            return int(self._limit)
+
+    @property
+    def in_flight(self):
+        """ The number of requests in flight """
+        with self._cond:
+            return self._in_flight
+
+    def acquire(self):
+        """ Blocks until a request may start.
+        @return: A token to pass to L{AdaptiveLimiter.release}.
+        """
+        with self._cond:
+            while self._in_flight >= int(self._limit):
+                self._cond.wait()
+            self._in_flight += 1
+            return time.time()
+
+    def _baseline(self, latencies):
+        ordered = sorted(latencies)
+        rank = int(round(self.percentile / 100.0 * (len(ordered) - 1)))
+        return max(ordered[rank], _MIN_BASELINE)
+
+    def release(self, token, overloaded=False, endpoint=None, latency=None, success=True):
+        """ Marks a request as finished and adapts the limit.
+        @param token: The value returned by L{AdaptiveLimiter.acquire}.
+        @param overloaded: Whether the request was throttled, failed to reach the server or timed out.
+        @param endpoint: (Optional) The endpoint called; baselines are kept per endpoint.
+        @param latency: (Optional) Seconds the server took; by default the time since C{acquire}.
+        @param success: Whether the request succeeded; a failure that is not an overload
+        neither changes the limit nor counts as a latency sample.
+        """
+        now = time.time()
+        if latency is None:
+            latency = now - token
+        with self._cond:
+            # the limit only grows while at least half of it is in use
+            saturated = 2 * self._in_flight >= self._limit
+            self._in_flight -= 1
+            if not overloaded and not success:
+                self._cond.notify_all()
+                return
+            if not overloaded:
+                latencies = self._latencies.get(endpoint)
+                if latencies is None:
+                    latencies = self._latencies[endpoint] = deque(maxlen=self.window)
+                if len(latencies) >= _MIN_SAMPLES:
+                    overloaded = latency > self.latency_tolerance * self._baseline(latencies)
+                latencies.append(latency)
+            if overloaded:
+                if token >= self._last_decrease:
+                    self._limit = max(self.minimum, self._limit * self.decrease)
+                    self._last_decrease = now
+                    self.logger.info('Concurrency limit lowered to %d' % int(self._limit))
+            elif saturated:
+                self._limit = min(self.maximum, self._limit + self.increase / self._limit)
+            self._cond.notify_all()
@@ -0,0 +1,329 @@
+#!/usr/bin/env python
+
+"""
+Load generation and capacity probing for Rosette API deployments.
+
+Copyright (c) 2014-2015 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Run C{python -m rosette.loadgen --help} for the command line interface.
+"""
+
+import argparse
+import io
+import json
+import os
+import random
+import threading
+import time
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+from rosette.api import API, DocumentParameters, RosetteException
+
+
+def _method_name(endpoint):
+    return endpoint.replace("-", "_").replace("/", "_")
+
+
+def load_payloads(directory):
+    """ Reads request payloads named like the mock data, C{<language>-<kind>-<endpoint>.json}.
+    @param directory: A directory such as C{tests/mock-data/request}.
+    @return: A dictionary of L{API} method name to a list of L{DocumentParameters}.
+    """
+    payloads = {}
+    for name in sorted(os.listdir(directory)):
+        base, ext = os.path.splitext(name)
+        parts = base.split("-", 2)
+        if ext != ".json" or len(parts) < 3:
+            continue
+        with io.open(os.path.join(directory, name), encoding="utf-8") as f:
+            fields = json.load(f)
+        params = DocumentParameters()
+        for key, value in fields.items():
+            params[key] = value
+        payloads.setdefault(_method_name(parts[2]), []).append(params)
+    return payloads
+
+
+def load_corpus(directory, endpoints):
+    """ Reads every C{.txt} file of C{directory} as a document for each of C{endpoints}.
+    @param directory: A directory of UTF-8 text files.
+    @param endpoints: L{API} method names, e.g. C{["entities", "sentiment"]}.
+    @return: A dictionary of L{API} method name to a list of L{DocumentParameters}.
+    """
+    documents = []
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(".txt"):
+            with io.open(os.path.join(directory, name), encoding="utf-8") as f:
+                params = DocumentParameters()
+                params["content"] = f.read()
+                documents.append(params)
+    return dict((_method_name(endpoint), documents) for endpoint in endpoints)
+
+
+def _percentile(ordered, fraction):
+    if not ordered:
+        return None
+    rank = int(round(fraction * (len(ordered) - 1)))
+    return ordered[rank]
+
+
+class LoadReport(object):
+    """Outcomes of a L{LoadGenerator} run.
+
+    Every request is counted under its endpoint as succeeded, throttled
+    (the server answered 429) or failed (any other error), with its latency
+    in seconds.  In open-loop runs the latency is measured from the
+    scheduled arrival time, so time spent waiting for a free worker counts.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latencies = {}
+        self._throttled = {}
+        self._errors = {}
+        self.started = time.time()
+        self.elapsed = 0.0
+
+    def record(self, endpoint, latency, status):
+        """ Records one request: C{status} is C{None} on success, otherwise the error status """
+        with self._lock:
+            self._latencies.setdefault(endpoint, []).append(latency)
+            if status == 429 or status == "429":
+                self._throttled[endpoint] = self._throttled.get(endpoint, 0) + 1
+            elif status is not None:
+                self._errors[endpoint] = self._errors.get(endpoint, 0) + 1
+
+    def _stats(self, latencies, throttled, errors):
+        n = len(latencies)
+        ordered = sorted(latencies)
+        return {"requests": n,
+                "throughput": (n - throttled - errors) / self.elapsed if self.elapsed else 0.0,
+                "p50": _percentile(ordered, 0.5),
+                "p90": _percentile(ordered, 0.9),
+                "p99": _percentile(ordered, 0.99),
+                "max": ordered[-1] if ordered else None,
+                "throttle_rate": throttled / float(n) if n else 0.0,
+                "error_rate": errors / float(n) if n else 0.0}
+
+    def summary(self):
+        """ Returns a dictionary of endpoint to its statistics, plus an C{"all"} entry.
+        Statistics are the number of C{requests}, the C{throughput} of successful requests per
+        second, latency percentiles C{p50}, C{p90}, C{p99} and C{max} in seconds, and the
+        C{throttle_rate} and C{error_rate} as fractions of the requests.
+        """
+        with self._lock:
+            result = {}
+            for endpoint, latencies in self._latencies.items():
+                result[endpoint] = self._stats(latencies, self._throttled.get(endpoint, 0),
+                                               self._errors.get(endpoint, 0))
+            everything = [l for latencies in self._latencies.values() for l in latencies]
+            result["all"] = self._stats(everything, sum(self._throttled.values()),
+                                        sum(self._errors.values()))
+            return result
+
+    def format(self):
+        """ Returns the summary as a text table """
+        def ms(value):
+            return "-" if value is None else "%.1f" % (value * 1000)
+        lines = ["%-24s %8s %10s %8s %8s %8s %8s %7s %7s" % (
+            "endpoint", "requests", "ok/s", "p50 ms", "p90 ms", "p99 ms", "max ms", "429 %", "err %")]
+        summary = self.summary()
+        for endpoint in sorted(summary, key=lambda e: (e == "all", e)):
+            s = summary[endpoint]
+            lines.append("%-24s %8d %10.1f %8s %8s %8s %8s %7.1f %7.1f" % (
+                endpoint, s["requests"], s["throughput"], ms(s["p50"]), ms(s["p90"]), ms(s["p99"]),
+                ms(s["max"]), s["throttle_rate"] * 100, s["error_rate"] * 100))
+        return "\n".join(lines)
+
+
+class LoadGenerator(object):
+    """Drives a Rosette API server with a weighted mix of requests.
+
+    In closed-loop mode (C{rate=None}) C{concurrency} workers each send their
+    next request as soon as the previous one returns, which measures the
+    throughput the server sustains at that concurrency.  In open-loop mode
+    requests arrive as a Poisson process at C{rate} per second regardless of
+    how fast the server answers, and up to C{concurrency} are in flight;
+    past the saturation point latency grows without bound.
+
+    The L{API} retries throttled requests itself; create it with
+    C{retries=1} and C{refresh_duration=0} so that a request counts as
+    throttled when the server answers 429 twice in a row.
+    """
+
+    def __init__(self, api, payloads, weights=None, concurrency=8, rate=None, seed=None):
+        """ Create a L{LoadGenerator}.
+        @param api: The L{API} object pointed at the server under test.
+        @param payloads: A dictionary of L{API} method name to a list of parameters, e.g. from
+        L{load_payloads}.
+        @param weights: (Optional) A dictionary of method name to relative share of the requests;
+        by default every method in C{payloads} gets the same share.
+        @param concurrency: Number of workers, i.e. the maximum number of requests in flight.
+        @param rate: Requests per second for an open-loop run, or C{None} for a closed loop.
+        @param seed: (Optional) Seed for the request mix and the arrival times.
+        """
+        weights = weights or dict((endpoint, 1.0) for endpoint in payloads)
+        self._mix = []
+        total = 0.0
+        for endpoint in sorted(weights):
+            if weights[endpoint] <= 0:
+                continue
+            if not payloads.get(endpoint) or not hasattr(api, endpoint):
+                raise RosetteException("badArgument", "No payloads for endpoint", endpoint)
+            total += weights[endpoint]
+            self._mix.append((total, endpoint))
+        if not self._mix:
+            raise RosetteException("badArgument", "Empty request mix", weights)
+        self._total = total
+        self.api = api
+        self.payloads = payloads
+        self.concurrency = max(1, concurrency)
+        self.rate = rate
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+
+    def _pick(self):
+        with self._random_lock:
+            x = self._random.random() * self._total
+            for bound, endpoint in self._mix:
+                if x < bound:
+                    break
+            return endpoint, self._random.choice(self.payloads[endpoint])
+
+    def _call(self, report, endpoint, parameters, scheduled):
+        status = None
+        try:
+            getattr(self.api, endpoint)(parameters)
+        except RosetteException as e:
+            status = e.status
+        except Exception:
+            status = "unknownError"
+        report.record(endpoint, time.time() - scheduled, status)
+
+    def run(self, duration=10.0, requests=None):
+        """ Generates load until C{duration} seconds have passed or C{requests} requests were sent.
+        @return: A L{LoadReport}.
+        """
+        report = LoadReport()
+        deadline = report.started + duration
+        budget = [requests]
+        budget_lock = threading.Lock()
+
+        def take():
+            with budget_lock:
+                if budget[0] is not None:
+                    if budget[0] <= 0:
+                        return False
+                    budget[0] -= 1
+            return time.time() < deadline
+
+        if self.rate is None:
+            def closed_loop():
+                while take():
+                    endpoint, parameters = self._pick()
+                    self._call(report, endpoint, parameters, time.time())
+            workers = [threading.Thread(target=closed_loop) for _ in range(self.concurrency)]
+        else:
+            arrivals = queue.Queue()
+
+            def open_loop():
+                while True:
+                    arrival = arrivals.get()
+                    if arrival is None:
+                        return
+                    self._call(report, arrival[0], arrival[1], arrival[2])
+            workers = [threading.Thread(target=open_loop) for _ in range(self.concurrency)]
+
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        if self.rate is not None:
+            scheduled = time.time()
+            while take():
+                delay = scheduled - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                endpoint, parameters = self._pick()
+                arrivals.put((endpoint, parameters, scheduled))
+                with self._random_lock:
+                    scheduled += self._random.expovariate(self.rate)
+                if scheduled >= deadline:
+                    break
+            for _ in workers:
+                arrivals.put(None)
+        for worker in workers:
+            worker.join()
+        report.elapsed = time.time() - report.started
+        return report
+
+    def probe(self, levels, duration=10.0):
+        """ Runs one load step per level, to locate the saturation point of the server.
+        @param levels: Concurrencies for a closed-loop generator, or rates for an open-loop one.
+        @param duration: Seconds per step.
+        @return: A list of C{(level, report)} pairs.
+        """
+        results = []
+        for level in levels:
+            if self.rate is None:
+                self.concurrency = max(1, int(level))
+            else:
+                self.rate = level
+            results.append((level, self.run(duration)))
+        return results
+
+
+def _weights(text):
+    weights = {}
+    for item in text.split(","):
+        endpoint, _, weight = item.partition("=")
+        weights[_method_name(endpoint.strip())] = float(weight or 1)
+    return weights
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+                                     description='Generates load against a Rosette API server')
+    parser.add_argument('-k', '--key', help='Rosette API Key', default='')
+    parser.add_argument('-u', '--url', help="API URL", default='https://api.rosette.com/rest/v1/')
+    parser.add_argument('--payloads', help='Directory of <language>-<kind>-<endpoint>.json requests',
+                        default=os.path.join('tests', 'mock-data', 'request'))
+    parser.add_argument('--corpus', help='Directory of .txt documents sent to every endpoint of --mix')
+    parser.add_argument('--mix', help='Request mix, e.g. entities=3,language=1')
+    parser.add_argument('-c', '--concurrency', help='Workers; comma separated values run a probe', default='8')
+    parser.add_argument('-r', '--rate', help='Open-loop requests per second; comma separated values run a probe')
+    parser.add_argument('-d', '--duration', help='Seconds per run', type=float, default=10.0)
+    parser.add_argument('--retries', help='Retries of throttled requests', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    weights = _weights(args.mix) if args.mix else None
+    if args.corpus:
+        payloads = load_corpus(args.corpus, list(weights or ["entities"]))
+    else:
+        payloads = load_payloads(args.payloads)
+    api = API(user_key=args.key, service_url=args.url, retries=args.retries, refresh_duration=0)
+    concurrency = [int(c) for c in args.concurrency.split(",")]
+    rates = [float(r) for r in args.rate.split(",")] if args.rate else None
+    generator = LoadGenerator(api, payloads, weights, concurrency[0], rates and rates[0])
+    for level, report in generator.probe(rates or concurrency, args.duration):
+        print("%s %s" % ("rate" if rates else "concurrency", level))
+        print(report.format())
+        print("")
+    api.close()
+
+if __name__ == '__main__':
+    main()
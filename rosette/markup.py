@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+
+"""
+Extraction of the visible text of HTML and XML documents before sending them.
+
+Copyright (c) 2014-2015 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from array import array
+import codecs
+import re
+import unicodedata
+
+from rosette.api import DocumentParameters
+
+try:
+    from html import unescape as _unescape
+except ImportError:
+    from HTMLParser import HTMLParser
+    _unescape = HTMLParser().unescape
+
+_READ_SIZE = 64 * 1024
+
+_TAG_RE = re.compile(r"""<(/?)([A-Za-z][\w:.-]*)(?:[^>"']|"[^"]*"|'[^']*')*>""")
+_TAG_START_RE = re.compile(r"</?[A-Za-z]")
+_COMMENT_RE = re.compile(r"<!--.*?-->", re.DOTALL)
+_DECLARATION_RE = re.compile(r"<[!?][^>]*>")
+_ENTITY_RE = re.compile(r"&(?:#[0-9]+|#[xX][0-9a-fA-F]+|[A-Za-z][A-Za-z0-9]*);?")
+_ENTITY_START_RE = re.compile(r"&(?:#[xX]?[0-9a-fA-F]*|[A-Za-z][A-Za-z0-9]*)?$")
+_PIECE_RE = re.compile(r"\s+|\S+", re.UNICODE)
+_ASCII_RE = re.compile(r"^[\x00-\x7f]*$")
+
+# elements whose content is not displayed
+_HIDDEN = frozenset(("script", "style", "template"))
+_END_TAG_RES = dict((name, re.compile(u"</" + name, re.IGNORECASE)) for name in _HIDDEN)
+# elements that start a new line of text
+_BLOCKS = frozenset((
+    "address", "article", "aside", "blockquote", "br", "caption", "dd", "div", "dl", "dt", "figcaption",
+    "figure", "footer", "form", "h1", "h2", "h3", "h4", "h5", "h6", "header", "hr", "li", "main", "nav",
+    "ol", "option", "p", "pre", "section", "table", "td", "th", "title", "tr", "ul"))
+
+
+class StrippedText(object):
+    """The visible text of a document, with the position in the original
+    markup of every character of the text."""
+
+    def __init__(self, text, starts, ends, source_length):
+        self.text = text
+        self.source_length = source_length
+        self._starts = starts
+        self._ends = ends
+
+    def __len__(self):
+        return len(self.text)
+
+    def source_span(self, start, end):
+        """ Returns the C{(start, end)} span of the original markup that the characters
+        C{start} to C{end} of the text come from """
+        if start >= end:
+            position = self._starts[start] if start < len(self.text) else self.source_length
+            return position, position
+        return self._starts[start], self._ends[end - 1]
+
+    def translate(self, result):
+        """ Returns a copy of a result for the text with its offsets (C{startOffset} and C{endOffset},
+        e.g. in C{mentionOffsets}, and any other C{...Offset}) moved to the original markup """
+        if isinstance(result, list):
+            return [self.translate(value) for value in result]
+        if not isinstance(result, dict):
+            return result
+        translated = dict((key, self.translate(value)) for (key, value) in result.items())
+        start, end = result.get("startOffset"), result.get("endOffset")
+        if isinstance(start, int) and isinstance(end, int):
+            translated["startOffset"], translated["endOffset"] = self.source_span(start, end)
+        for key, value in result.items():
+            if key.endswith("Offset") and key not in ("startOffset", "endOffset") and isinstance(value, int):
+                translated[key] = self.source_span(value, value)[0]
+        return translated
+
+
+class MarkupStripper(object):
+    """Streaming extraction of the visible text of HTML or XML.
+
+    Pieces of the document are given to L{MarkupStripper.feed} as they are
+    read; L{MarkupStripper.close} returns the L{StrippedText}.  Tags,
+    comments and declarations are removed, as is the content of C{script},
+    C{style} and C{template} elements; character references are decoded.
+    Runs of whitespace become a single space, block elements (paragraphs,
+    headings, list items, ...) a line break, and the text is put in the
+    Unicode C{normalization} form.
+
+    Byte input is decoded with C{encoding}; offsets in the original markup
+    are counted in decoded characters.
+    """
+
+    def __init__(self, normalization="NFC", encoding="utf-8"):
+        """ Create a L{MarkupStripper}.
+        @param normalization: A Unicode normalization form (C{"NFC"}, C{"NFKC"}, ...), or C{None}.
+        @param encoding: The encoding of byte input.
+        """
+        self.normalization = normalization
+        self._decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+        self._buffer = u""
+        self._base = 0  # offset of the buffer in the markup
+        self._hidden = None  # end tag of the hidden element being skipped, as a regular expression
+        self._text = []
+        self._length = 0
+        self._starts = array("l")
+        self._ends = array("l")
+        self._space = None  # whitespace owed before the next character: (char, start, end)
+
+    def feed(self, data):
+        """ Adds the next piece of the document, as text or bytes """
+        if not isinstance(data, type(u"")):
+            data = self._decoder.decode(data)
+        self._buffer += data
+        self._consume(False)
+
+    def close(self):
+        """ Ends the document.
+        @return: A L{StrippedText}.
+        """
+        self._buffer += self._decoder.decode(b"", True)
+        self._consume(True)
+        return StrippedText(u"".join(self._text), self._starts, self._ends, self._base)
+
+    def _owe(self, char, start, end):
+        if self._length and (self._space is None or (char == u"\n" and self._space[0] != u"\n")):
+            self._space = (char, start, end)
+
+    def _pay(self):
+        if self._space is not None:
+            char, start, end = self._space
+            self._text.append(char)
+            self._starts.append(start)
+            self._ends.append(end)
+            self._length += 1
+            self._space = None
+
+    def _put(self, text, start, end):
+        """ Appends C{text}, every character of which comes from C{start} to C{end} """
+        self._pay()
+        self._text.append(text)
+        self._starts.extend([start] * len(text))
+        self._ends.extend([end] * len(text))
+        self._length += len(text)
+
+    def _put_word(self, word, start):
+        if self.normalization is None or _ASCII_RE.match(word):
+            self._pay()
+            self._text.append(word)
+            self._starts.extend(range(start, start + len(word)))
+            self._ends.extend(range(start + 1, start + len(word) + 1))
+            self._length += len(word)
+            return
+        # normalize each character with the combining marks that follow it
+        cluster = 0
+        for i in range(1, len(word) + 1):
+            if i == len(word) or not unicodedata.combining(word[i]):
+                self._put(unicodedata.normalize(self.normalization, word[cluster:i]), start + cluster, start + i)
+                cluster = i
+
+    def _put_text(self, text, start):
+        for match in _PIECE_RE.finditer(text):
+            if match.group().isspace():
+                self._owe(u" ", start + match.start(), start + match.start() + 1)
+            else:
+                self._put_word(match.group(), start + match.start())
+
+    def _markup(self, buf, pos, final):
+        """ Handles the markup starting with C{<} at C{pos}.
+        @return: The position after it, C{pos} if the C{<} is text, or C{None} to wait for more input.
+        """
+        if not final and pos + 2 >= len(buf):
+            return None
+        following = buf[pos + 1:pos + 2]
+        if following in (u"!", u"?"):
+            if buf.startswith(u"<!--", pos):
+                match = _COMMENT_RE.match(buf, pos)
+                if match is None:
+                    return len(buf) if final else None
+                return match.end()
+            match = _DECLARATION_RE.match(buf, pos)
+            if match is not None:
+                return match.end()
+            return pos if final else None
+        if not following or _TAG_START_RE.match(buf, pos):
+            match = _TAG_RE.match(buf, pos)
+            if match is None:
+                return pos if final else None
+            name = match.group(2).lower()
+            if name in _BLOCKS:
+                self._owe(u"\n", self._base + pos, self._base + match.end())
+            elif not match.group(1) and name in _HIDDEN and not match.group().endswith(u"/>"):
+                self._hidden = _END_TAG_RES[name]
+            return match.end()
+        return pos
+
+    def _reference(self, buf, pos, final):
+        """ Handles the character reference starting with C{&} at C{pos}.
+        @return: The position after it, C{pos} if the C{&} is text, or C{None} to wait for more input.
+        """
+        match = _ENTITY_RE.match(buf, pos)
+        if not final and (match is None or not match.group().endswith(u";")) and \
+                _ENTITY_START_RE.match(buf, pos):
+            # the reference may go on in the next piece
+            return None
+        if match is None:
+            return pos
+        decoded = _unescape(match.group())
+        if decoded == match.group():
+            return pos
+        end = self._base + match.end()
+        if decoded.isspace():
+            self._owe(u" ", self._base + pos, end)
+        elif self.normalization is not None:
+            self._put(unicodedata.normalize(self.normalization, decoded), self._base + pos, end)
+        else:
+            self._put(decoded, self._base + pos, end)
+        return match.end()
+
+    def _consume(self, final):
+        buf = self._buffer
+        pos = 0
+        while pos < len(buf):
+            if self._hidden is not None:
+                match = self._hidden.search(buf, pos)
+                if match is None:
+                    # keep what could be the start of the end tag
+                    pos = len(buf) if final else max(pos, len(buf) - len(self._hidden.pattern) + 1)
+                    break
+                self._hidden = None
+                pos = match.start()
+                continue
+            char = buf[pos]
+            if char in u"<&":
+                after = (self._markup if char == u"<" else self._reference)(buf, pos, final)
+                if after is None:
+                    break
+                if after == pos:
+                    self._put_text(char, self._base + pos)
+                    after += 1
+                pos = after
+                continue
+            end = len(buf)
+            for stop in (buf.find(u"<", pos), buf.find(u"&", pos)):
+                if stop >= 0:
+                    end = min(end, stop)
+            if end == len(buf) and not final:
+                # a word or combining sequence may go on in the next piece
+                while end > pos and not buf[end - 1].isspace():
+                    end -= 1
+                if end == pos:
+                    break
+            self._put_text(buf[pos:end], self._base + pos)
+            pos = end
+        self._buffer = buf[pos:]
+        self._base += pos
+
+
+def strip_markup(markup, normalization="NFC", encoding="utf-8"):
+    """ Extracts the visible text of a document; see L{MarkupStripper}.
+    @param markup: The document, as text or bytes, or a file object it is read from in pieces.
+    @param normalization: A Unicode normalization form, or C{None}.
+    @param encoding: The encoding of byte input.
+    @return: A L{StrippedText}.
+    """
+    stripper = MarkupStripper(normalization, encoding)
+    if hasattr(markup, "read"):
+        while True:
+            data = markup.read(_READ_SIZE)
+            if not data:
+                break
+            stripper.feed(data)
+    else:
+        stripper.feed(markup)
+    return stripper.close()
+
+
+def strip_document(parameters, normalization="NFC", encoding="utf-8"):
+    """ Replaces the markup content of document parameters by its visible text.
+    @param parameters: A L{DocumentParameters} (or subclass) whose content, set directly or with
+    C{load_document_file}, is HTML or XML.
+    @param normalization: A Unicode normalization form, or C{None}.
+    @param encoding: The encoding of byte content.
+    @return: A pair: new parameters, sent as JSON, with the text as content; and the
+    L{StrippedText}, whose L{StrippedText.translate} moves the offsets of results to the markup.
+    """
+    stripped = strip_markup(parameters["content"], normalization, encoding)
+    copied = type(parameters)()
+    for name, value in parameters.serialize().items():
+        copied[name] = value
+    copied["content"] = stripped.text
+    if isinstance(copied, DocumentParameters):
+        copied.useMultipart = False
+    return copied, stripped
@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+
+"""
+Micro-batching of short texts into combined Rosette API requests.
+
+Copyright (c) 2014-2015 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import copy
+import json
+import logging
+import sys
+import threading
+
+from rosette.api import DocumentParameters, EndpointCaller, RosetteException
+from rosette.bulk import map_concurrently
+
+try:
+    _text_types = (str, unicode)
+except NameError:
+    _text_types = (str,)
+
+# endpoints whose results can be split by position, and the key of their list
+_SPLITTABLE = {"tokens": "tokens", "sentences": "sentences", "entities": "entities"}
+
+
+class _Batch(object):
+
+    def __init__(self):
+        self.items = []
+        self.chars = 0
+        self.full = threading.Event()
+
+
+class _Item(object):
+
+    def __init__(self, parameters):
+        self.parameters = parameters
+        self.text = parameters["content"]
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def _spans(strings, text, starts, ends):
+    """ Locates C{strings}, in order, in C{text} and assigns each to the part it falls in.
+    A span reaching into the separator after its part is cut at the part's end.
+    @return: A list of C{(part, string)} pairs, or C{None} if a string is not found or spans parts.
+    """
+    spans = []
+    position = 0
+    part = 0
+    for string in strings:
+        start = text.find(string, position)
+        if start < 0:
+            return None
+        end = start + len(string)
+        while part < len(starts) and start >= ends[part]:
+            part += 1
+        if part == len(starts) or start < starts[part]:
+            return None
+        if end > ends[part]:
+            if text[ends[part]:end].strip():
+                return None
+            string = string[:ends[part] - start]
+        spans.append((part, string))
+        position = end
+    return spans
+
+
+def _split_strings(key, result, text, starts, ends):
+    spans = _spans(result[key], text, starts, ends)
+    if spans is None:
+        return None
+    parts = [[] for _ in starts]
+    for part, string in spans:
+        parts[part].append(string)
+    return parts
+
+
+def _split_entities(key, result, text, starts, ends):
+    parts = [[] for _ in starts]
+    for entity in result[key]:
+        offsets = entity.get("mentionOffsets")
+        if not offsets:
+            return None
+        by_part = {}
+        for offset in offsets:
+            spans = [i for i in range(len(starts))
+                     if starts[i] <= offset["startOffset"] and offset["endOffset"] <= ends[i]]
+            if not spans:
+                return None
+            shifted = dict(offset, startOffset=offset["startOffset"] - starts[spans[0]],
+                           endOffset=offset["endOffset"] - starts[spans[0]])
+            by_part.setdefault(spans[0], []).append(shifted)
+        for part, part_offsets in by_part.items():
+            copied = copy.deepcopy(entity)
+            copied["mentionOffsets"] = part_offsets
+            copied["count"] = len(part_offsets)
+            parts[part].append(copied)
+    # within a text, chains are numbered in order of their first mention
+    for part in parts:
+        part.sort(key=lambda e: e["mentionOffsets"][0]["startOffset"])
+        for chain, entity in enumerate(part):
+            entity["indocChainId"] = chain
+    return parts
+
+
+class MicroBatcher(object):
+    """Combines short texts sent to the same endpoint into one request.
+
+    L{MicroBatcher.call} may be called from many threads.  The first text
+    waits up to C{max_delay} seconds for others with the same parameters;
+    the texts, joined by C{separator}, are then sent as one document, and
+    the result is split back per text by position.  A batch is sent early
+    once it holds C{max_texts} texts or C{max_chars} characters.
+
+    Only C{tokens}, C{sentences} and C{entities} (when the server returns
+    C{mentionOffsets}) results can be split soundly.  Texts for other
+    endpoints, texts without a C{language} (unless C{require_language} is
+    off; the combined text would be detected as a single language), long
+    texts, and batches whose result does not split cleanly at the
+    separators are sent one by one.  Entities that only the context of a
+    neighbouring text would resolve can still differ from single requests.
+    """
+
+    def __init__(self, api, endpoint, max_delay=0.005, max_texts=50, max_chars=8000,
+                 separator=u"\n\n", require_language=True, max_workers=8):
+        """ Create a L{MicroBatcher}.
+        @param api: The L{API} object to send the requests with.
+        @param endpoint: The endpoint, e.g. C{"entities"} or C{"tokens"}.
+        @param max_delay: Seconds the first text of a batch waits for more.
+        @param max_texts: Maximum number of texts per batch.
+        @param max_chars: Maximum combined length of a batch; longer texts are sent alone.
+        @param separator: The string placed between texts.
+        @param require_language: Only batch texts whose C{language} is given.
+        @param max_workers: Maximum concurrent single requests when a batch falls back.
+        """
+        self.api = api
+        self.endpoint = endpoint
+        self.max_delay = max_delay
+        self.max_texts = max_texts
+        self.max_chars = max_chars
+        self.separator = separator
+        self.require_language = require_language
+        self.max_workers = max_workers
+        self.logger = logging.getLogger('rosette.api')
+        self._lock = threading.Lock()
+        self._open = {}  # parameters other than content -> batch being filled
+        self._splittable = endpoint in _SPLITTABLE
+        self._batches = 0
+        self._batched = 0
+        self._single = 0
+
+    @property
+    def stats(self):
+        """ A dictionary with the number of combined C{batches} sent, of texts C{batched} in
+        them, and of texts sent C{single} """
+        with self._lock:
+            return {"batches": self._batches, "batched": self._batched, "single": self._single}
+
+    def _single_call(self, parameters):
+        with self._lock:
+            self._single += 1
+        return EndpointCaller(self.api, self.endpoint).call(parameters)
+
+    def call(self, parameters):
+        """ Sends a text, possibly combined with others, and returns its own result.
+        @param parameters: A L{DocumentParameters} or a string.
+        """
+        if not isinstance(parameters, DocumentParameters):
+            text = parameters
+            parameters = DocumentParameters()
+            parameters["content"] = text
+        text = parameters["content"]
+        if not self._splittable or parameters.useMultipart or not isinstance(text, _text_types) or \
+                len(text) > self.max_chars or (self.require_language and not parameters["language"]):
+            return self._single_call(parameters)
+
+        fixed = parameters.serialize()
+        del fixed["content"]
+        key = json.dumps(fixed, sort_keys=True)
+        item = _Item(parameters)
+        with self._lock:
+            batch = self._open.get(key)
+            leader = batch is None or batch.chars + len(text) > self.max_chars
+            if leader:
+                batch = self._open[key] = _Batch()
+            batch.items.append(item)
+            batch.chars += len(text) + len(self.separator)
+            if len(batch.items) >= self.max_texts:
+                del self._open[key]
+                batch.full.set()
+        if leader:
+            batch.full.wait(self.max_delay)
+            with self._lock:
+                if self._open.get(key) is batch:
+                    del self._open[key]
+            self._send(batch)
+        else:
+            item.done.wait()
+        if item.error is not None:
+            raise item.error
+        return item.result
+
+    def _send(self, batch):
+        items = batch.items
+        try:
+            parts = None
+            if len(items) > 1:
+                parts = self._combined(items)
+            if parts is None:
+                outcomes = map_concurrently(lambda item: self._single_call(item.parameters), items,
+                                            self.max_workers)
+            else:
+                outcomes = [(part, None) for part in parts]
+        except Exception:
+            outcomes = [(None, sys.exc_info()[1])] * len(items)
+        for item, (result, error) in zip(items, outcomes):
+            item.result, item.error = result, error
+            item.done.set()
+
+    def _combined(self, items):
+        """ Sends the texts as one document and splits the result, or returns C{None} """
+        starts, ends = [], []
+        position = 0
+        for item in items:
+            starts.append(position)
+            ends.append(position + len(item.text))
+            position = ends[-1] + len(self.separator)
+        text = self.separator.join(item.text for item in items)
+        combined = DocumentParameters()
+        for name, value in items[0].parameters.serialize().items():
+            combined[name] = value
+        combined["content"] = text
+        try:
+            result = EndpointCaller(self.api, self.endpoint).call(combined)
+        except RosetteException:
+            # let every text get its own answer, or its own error
+            return None
+        key = _SPLITTABLE[self.endpoint]
+        if key not in result:
+            return None
+        split = _split_entities if key == "entities" else _split_strings
+        parts = split(key, result, text, starts, ends)
+        if parts is None:
+            if key == "entities" and any(not e.get("mentionOffsets") for e in result[key]):
+                # the server does not report offsets; no later batch can be split either
+                self.logger.info('Micro-batching disabled for ' + self.endpoint + ': no mention offsets')
+                self._splittable = False
+            return None
+        with self._lock:
+            self._batches += 1
+            self._batched += len(items)
+        results = []
+        for part in parts:
+            single = dict(result)
+            single[key] = part
+            results.append(single)
+        return results
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+
+"""
+Client-side prefilter for the Rosette API name-similarity endpoint.
+
+Copyright (c) 2014-2015 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import re
+import threading
+import unicodedata
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def _name_text(name):
+    """ Returns the text of a C{name} object, or the name itself if it is a string """
+    if isinstance(name, dict):
+        return name.get("text") or ""
+    return name or ""
+
+
+def _normalize(text):
+    """ Case folds and strips diacritics so that trivially different spellings compare equal """
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    return u"".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def _script(text):
+    """ Returns a coarse script label (e.g. LATIN, CJK, ARABIC) for the first letter of C{text} """
+    for c in text:
+        if c.isalpha():
+            try:
+                return unicodedata.name(c).split(" ")[0]
+            except ValueError:
+                return None
+    return None
+
+
+def _comparable(name1, name2):
+    """ Two names can only be judged locally if they are written in the same script.
+    Cross-script pairs (e.g. Latin versus Han) always go to the server, which transliterates them. """
+    for field in ("script", "language"):
+        if isinstance(name1, dict) and isinstance(name2, dict):
+            v1, v2 = name1.get(field), name2.get(field)
+            if v1 is not None and v2 is not None and v1 != v2:
+                return False
+    s1 = _script(_name_text(name1))
+    s2 = _script(_name_text(name2))
+    return s1 is not None and s1 == s2
+
+
+class NamePrefilter(object):
+    """Cheap, in-process similarity check run before the C{name-similarity} endpoint.
+
+    Each name is reduced to hashed character n-gram counts and a hashed
+    token set.  The local score of a pair is the larger of the n-gram cosine
+    similarity and the token-set Jaccard similarity.  Pairs scoring below
+    C{threshold} are answered locally; all other pairs, and pairs whose names
+    are written in different scripts, are sent to the server.
+
+    When NumPy is available, L{NamePrefilter.scores} computes all pairs of a
+    batch as vectorized array operations; otherwise a pure python fallback
+    gives identical results.
+    """
+
+    def __init__(self, threshold=0.2, ngram=3, dimension=4096):
+        """ Create a L{NamePrefilter}.
+        @param threshold: Pairs with a local score below this value are not sent to the server.
+        @param ngram: Length of the character n-grams.
+        @param dimension: Number of hash buckets used for n-grams and tokens.
+        """
+        if ngram < 1:
+            ngram = 1
+        self.threshold = threshold
+        self.ngram = ngram
+        self.dimension = dimension
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def __getstate__(self):
+        return {"threshold": self.threshold, "ngram": self.ngram, "dimension": self.dimension}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        """ Zeroes the call counters reported by L{NamePrefilter.stats} """
+        with self._lock:
+            self._checked = 0
+            self._skipped = 0
+
+    @property
+    def stats(self):
+        """ A dictionary with the number of pairs C{checked}, C{forwarded} to the server
+        and C{skipped} (i.e. server calls saved). """
+        with self._lock:
+            return {"checked": self._checked,
+                    "forwarded": self._checked - self._skipped,
+                    "skipped": self._skipped}
+
+    def _ngrams(self, text):
+        padded = u" " + text + u" "
+        if len(padded) <= self.ngram:
+            return [padded]
+        return [padded[i:i + self.ngram] for i in range(len(padded) - self.ngram + 1)]
+
+    def _features(self, name):
+        text = _normalize(_name_text(name))
+        grams = [hash(g) % self.dimension for g in self._ngrams(text)]
+        tokens = set(hash(t) % self.dimension for t in _TOKEN_RE.findall(text))
+        return grams, tokens
+
+    def _keys(self, features, side, index):
+        """ The C{row * dimension + bucket} keys of one side's n-grams (C{index} 0) or tokens (1)
+        in a batch, sorted and distinct, with the number of times each occurs """
+        rows = []
+        buckets = []
+        for row, pair in enumerate(features):
+            values = pair[side][index]
+            rows.extend([row] * len(values))
+            buckets.extend(values)
+        keys = numpy.array(rows, dtype=numpy.int64) * self.dimension + numpy.array(buckets, dtype=numpy.int64)
+        return numpy.unique(keys, return_counts=True)
+
+    def _scores_numpy(self, features):
+        # sparse: memory grows with the length of the names, not with the dimension
+        n = len(features)
+        dim = self.dimension
+        (grams1, counts1), (grams2, counts2) = self._keys(features, 0, 0), self._keys(features, 1, 0)
+        _, ix1, ix2 = numpy.intersect1d(grams1, grams2, assume_unique=True, return_indices=True)
+        dot = numpy.bincount(grams1[ix1] // dim, weights=counts1[ix1] * counts2[ix2], minlength=n)
+        norms = numpy.sqrt(numpy.bincount(grams1 // dim, weights=counts1 ** 2, minlength=n) *
+                           numpy.bincount(grams2 // dim, weights=counts2 ** 2, minlength=n))
+        cosine = numpy.divide(dot, norms, out=numpy.zeros(n), where=norms > 0)
+        tokens1, tokens2 = self._keys(features, 0, 1)[0], self._keys(features, 1, 1)[0]
+        inter = numpy.bincount(numpy.intersect1d(tokens1, tokens2, assume_unique=True) // dim, minlength=n)
+        union = numpy.bincount(tokens1 // dim, minlength=n) + numpy.bincount(tokens2 // dim, minlength=n) - inter
+        jaccard = numpy.divide(inter, union, out=numpy.zeros(n), where=union > 0)
+        return numpy.maximum(cosine, jaccard).tolist()
+
+    def _scores_python(self, features):
+        result = []
+        for (g1, t1), (g2, t2) in features:
+            c1, c2 = {}, {}
+            for k in g1:
+                c1[k] = c1.get(k, 0) + 1
+            for k in g2:
+                c2[k] = c2.get(k, 0) + 1
+            dot = sum(v * c2.get(k, 0) for k, v in c1.items())
+            norms = (sum(v * v for v in c1.values()) * sum(v * v for v in c2.values())) ** 0.5
+            cosine = dot / float(norms) if norms else 0.0
+            union = len(t1 | t2)
+            jaccard = len(t1 & t2) / float(union) if union else 0.0
+            result.append(max(cosine, jaccard))
+        return result
+
+    def scores(self, pairs):
+        """ Computes local similarity scores for a batch of name pairs.
+        @param pairs: A sequence of C{(name1, name2)} tuples; names are C{name} objects or strings.
+        @return: A list with a score between 0 and 1 for each pair, or C{None} where the
+        names cannot be compared locally.
+        """
+        pairs = list(pairs)
+        comparable = [i for i, (n1, n2) in enumerate(pairs) if _comparable(n1, n2)]
+        result = [None] * len(pairs)
+        if not comparable:
+            return result
+        features = [(self._features(pairs[i][0]), self._features(pairs[i][1])) for i in comparable]
+        if numpy is not None:
+            computed = self._scores_numpy(features)
+        else:
+            computed = self._scores_python(features)
+        for i, score in zip(comparable, computed):
+            result[i] = score
+        return result
+
+    def partition(self, parameters_list):
+        """ Splits L{NameSimilarityParameters} objects into those worth sending to the server
+        and those answered locally, updating L{NamePrefilter.stats}.
+        @param parameters_list: A sequence of L{NameSimilarityParameters}.
+        @return: A pair of lists: the parameters to forward, and C{(parameters, local_result)}
+        tuples for the pairs that were skipped.
+        """
+        parameters_list = list(parameters_list)
+        scores = self.scores((p["name1"], p["name2"]) for p in parameters_list)
+        forward = []
+        skipped = []
+        for parameters, score in zip(parameters_list, scores):
+            if score is None or score >= self.threshold:
+                forward.append(parameters)
+            else:
+                skipped.append((parameters, self.local_result(score)))
+        with self._lock:
+            self._checked += len(parameters_list)
+            self._skipped += len(skipped)
+        return forward, skipped
+
+    def check(self, parameters):
+        """ Runs the prefilter on a single L{NameSimilarityParameters} object.
+        @return: C{None} if the pair should be sent to the server, otherwise the local result.
+        """
+        forward, skipped = self.partition([parameters])
+        if skipped:
+            return skipped[0][1]
+        return None
+
+    def local_result(self, score):
+        """ Builds the result returned in place of a server response for a skipped pair """
+        return {"result": {"score": score}, "prefiltered": True}
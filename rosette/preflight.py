@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+
+"""
+Local validation of Rosette API requests before they are sent.
+
+Copyright (c) 2014-2015 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import logging
+import sys
+import threading
+
+from rosette.api import DocumentParameters, RosetteException, _DocumentParamSetBase
+
+try:
+    _text_types = (str, unicode)
+except NameError:
+    _text_types = (str,)
+
+# ISO639-1 codes of the languages Rosette analyzes, to the ISO639-3 codes it expects
+_ISO639_3 = {
+    "ar": "ara", "zh": "zho", "cs": "ces", "da": "dan", "nl": "nld", "en": "eng", "et": "est",
+    "fa": "fas", "fi": "fin", "fr": "fra", "de": "deu", "el": "ell", "he": "heb", "hi": "hin",
+    "hu": "hun", "id": "ind", "it": "ita", "ja": "jpn", "ko": "kor", "lv": "lav", "ms": "msa",
+    "no": "nor", "pl": "pol", "ps": "pus", "pt": "por", "ro": "ron", "ru": "rus", "sk": "slk",
+    "es": "spa", "sv": "swe", "th": "tha", "tl": "tgl", "tr": "tur", "uk": "ukr", "ur": "urd",
+    "vi": "vie",
+}
+_NAME_FIELDS = ("text", "language", "script", "entityType")
+_ENTITY_TYPES = ("PERSON", "LOCATION", "ORGANIZATION")
+
+
+def _content_size_over(content, limit):
+    """ Whether C{content} is more than C{limit} bytes in UTF-8, encoding it only when needed """
+    if not isinstance(content, _text_types) or (bytes is str and isinstance(content, str)):
+        return len(content) > limit
+    if len(content) > limit:
+        return True
+    if len(content) * 4 <= limit:
+        return False
+    return len(content.encode("utf-8")) > limit
+
+
+class Preflight(object):
+    """Catches requests the server would refuse, before they are sent.
+
+    Document calls are refused locally, with a L{RosetteException} of status
+    C{badArgument}, C{contentTooLarge} or C{unsupportedLanguage}, when the
+    content is missing or blank, when both C{content} and C{contentUri} are
+    given, when the content is over C{max_content_size} bytes, or when the
+    language is not supported.  Name similarity calls are refused when a
+    name is missing, has no text, has unknown fields or an unknown entity
+    type; name translation calls when the name is blank or the target
+    language is missing.
+
+    With C{fix}, what can be repaired without guessing is repaired instead:
+    language codes are lower-cased and two-letter codes replaced by the
+    three-letter ones, an unsupported document language is dropped (the
+    server then detects it), names given as strings become C{name} objects,
+    and unknown name fields are dropped.  The caller's parameters are not
+    modified; the repaired copy is sent.
+
+    The content size limit and the supported languages are taken from the
+    arguments, or else, the first time an L{API} is checked against, from
+    the C{maxContentSize} and C{supportedLanguages} entries of the server's
+    C{info}, if it reports them.  Content of a L{rosette.api.DocumentTemplate}
+    is not checked.
+    """
+
+    def __init__(self, max_content_size=None, languages=None, fix=True):
+        """ Create a L{Preflight}.
+        @param max_content_size: (Optional) Maximum size in bytes of the content.
+        @param languages: (Optional) The ISO639-3 codes of the supported languages.
+        @param fix: Whether to repair the requests that can be, rather than refusing them.
+        """
+        self.max_content_size = max_content_size
+        self.languages = None if languages is None else set(languages)
+        self.fix = fix
+        self._info = None
+        self._reset()
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._info_lock = threading.Lock()
+        self.logger = logging.getLogger('rosette.api')
+        self._checked = 0
+        self._fixed = 0
+        self._refused = 0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in ("_lock", "_info_lock", "logger", "_checked", "_fixed", "_refused"):
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reset()
+
+    @property
+    def stats(self):
+        """ A dictionary with the number of requests C{checked}, C{fixed} and C{refused} """
+        with self._lock:
+            return {"checked": self._checked, "fixed": self._fixed, "refused": self._refused}
+
+    def _limits(self, api):
+        """ The content size limit and supported languages, asking the server once """
+        if api is not None and self._info is None and \
+                (self.max_content_size is None or self.languages is None):
+            with self._info_lock:
+                if self._info is None:
+                    try:
+                        self._info = api.info()
+                    except RosetteException:
+                        self.logger.info('Preflight: server info not available; checking without its limits')
+                        self._info = {}
+        info = self._info or {}
+        limit = self.max_content_size
+        if limit is None:
+            limit = info.get("maxContentSize")
+        languages = self.languages
+        if languages is None and info.get("supportedLanguages") is not None:
+            languages = set(info["supportedLanguages"])
+        return limit, languages
+
+    def check(self, endpoint, parameters, api=None):
+        """ Checks the serialized parameters of a call.
+        @param endpoint: The endpoint called, e.g. C{"entities"}.
+        @param parameters: The serialized parameters, as a dictionary.
+        @param api: (Optional) The L{API} whose server's limits apply.
+        @return: The parameters to send: C{parameters} itself, or a repaired copy.
+        @raise RosetteException: If the call would be refused by the server.
+        """
+        limit, languages = self._limits(api)
+        fixes = []
+        try:
+            if endpoint == "name-similarity":
+                checked = self._check_similarity(parameters, fixes)
+            elif endpoint == "name-translation":
+                checked = self._check_translation(parameters, fixes)
+            else:
+                checked = self._check_document(parameters, limit, languages, fixes)
+        except RosetteException:
+            with self._lock:
+                self._checked += 1
+                self._refused += 1
+            raise
+        with self._lock:
+            self._checked += 1
+            if fixes:
+                self._fixed += 1
+        if fixes:
+            self.logger.info('Preflight: ' + endpoint + ': ' + '; '.join(fixes))
+        return checked
+
+    def check_many(self, endpoint, parameters_list, api=None):
+        """ Checks the parameters of many calls at once, e.g. before sending them concurrently.
+        @param endpoint: The endpoint called, e.g. C{"entities"}.
+        @param parameters_list: An iterable of parameter objects or strings.
+        @param api: (Optional) The L{API} whose server's limits apply.
+        @return: A list of C{(parameters, exception)} tuples in the order of C{parameters_list},
+        exactly one element of each being C{None}; C{parameters} is the (possibly repaired)
+        parameter object to send.
+        """
+        self._limits(api)
+        outcomes = []
+        for parameters in parameters_list:
+            try:
+                if not isinstance(parameters, _DocumentParamSetBase):
+                    text = parameters
+                    parameters = DocumentParameters()
+                    parameters["content"] = text
+                checked = self.check(endpoint, parameters.serialize(), api)
+                outcomes.append((self._rebuilt(parameters, checked), None))
+            except RosetteException:
+                outcomes.append((None, sys.exc_info()[1]))
+        return outcomes
+
+    @staticmethod
+    def _rebuilt(parameters, serialized):
+        if serialized == parameters.serialize():
+            return parameters
+        rebuilt = type(parameters)()
+        for name, value in serialized.items():
+            rebuilt[name] = value
+        rebuilt.useMultipart = parameters.useMultipart
+        if hasattr(parameters, "file_name"):
+            rebuilt.file_name = parameters.file_name
+        return rebuilt
+
+    def _language(self, code, fixes, what):
+        if not isinstance(code, _text_types):
+            raise RosetteException("badArgument", "The " + what + " is not a language code", repr(code))
+        fixed = code.strip().lower()
+        fixed = _ISO639_3.get(fixed, fixed)
+        if fixed != code:
+            if not self.fix:
+                raise RosetteException("unsupportedLanguage",
+                                       "The " + what + " is not an ISO639-3 code", repr(code))
+            fixes.append(what + " " + repr(code) + " changed to " + repr(fixed))
+        return fixed
+
+    def _check_document(self, parameters, limit, languages, fixes):
+        content = parameters.get("content")
+        if content is None and parameters.get("contentUri") is None:
+            raise RosetteException("badArgument", "Must supply one of Content or ContentUri", "bad arguments")
+        if content is not None and parameters.get("contentUri") is not None:
+            raise RosetteException("badArgument", "Cannot supply both Content and ContentUri", "bad arguments")
+        if content is not None:
+            if isinstance(content, _text_types) and not content.strip():
+                raise RosetteException("badArgument", "The content is empty", "bad arguments")
+            if limit is not None and _content_size_over(content, limit):
+                raise RosetteException("contentTooLarge",
+                                       "The content exceeds the limit of {0} bytes".format(limit),
+                                       "bad arguments")
+        language = parameters.get("language")
+        if language is None:
+            return parameters
+        fixed = dict(parameters)
+        fixed["language"] = self._language(language, fixes, "language")
+        if languages is not None and fixed["language"] not in languages:
+            if not self.fix:
+                raise RosetteException("unsupportedLanguage", "The language is not supported", repr(language))
+            fixes.append("unsupported language " + repr(language) + " dropped")
+            del fixed["language"]
+        return fixed if fixes else parameters
+
+    def _check_name(self, name, field, fixes):
+        if name is None:
+            raise RosetteException("missingParameter", "Required Name Similarity parameter not supplied",
+                                   repr(field))
+        if isinstance(name, _text_types):
+            if not self.fix:
+                raise RosetteException("badArgument", "A name must be a name object", repr(field))
+            fixes.append(field + " given as a string")
+            name = {"text": name}
+        if not isinstance(name, dict):
+            raise RosetteException("badArgument", "A name must be a name object", repr(field))
+        text = name.get("text")
+        if not isinstance(text, _text_types) or not text.strip():
+            raise RosetteException("badArgument", "The name has no text", repr(field))
+        unknown = [key for key in name if key not in _NAME_FIELDS]
+        if unknown:
+            if not self.fix:
+                raise RosetteException("badArgument", "Unknown name fields " + ", ".join(sorted(unknown)),
+                                       repr(field))
+            fixes.append("fields " + ", ".join(sorted(unknown)) + " of " + field + " dropped")
+            name = dict((key, value) for (key, value) in name.items() if key in _NAME_FIELDS)
+        if name.get("entityType") is not None and name["entityType"] not in _ENTITY_TYPES:
+            raise RosetteException("badArgument", "The entity type is not one of " + ", ".join(_ENTITY_TYPES),
+                                   repr(name["entityType"]))
+        if name.get("language") is not None:
+            language = self._language(name["language"], fixes, field + " language")
+            if language != name["language"]:
+                name = dict(name, language=language)
+        return name
+
+    def _check_similarity(self, parameters, fixes):
+        fixed = dict(parameters)
+        for field in ("name1", "name2"):
+            fixed[field] = self._check_name(parameters.get(field), field, fixes)
+        return fixed if fixes else parameters
+
+    def _check_translation(self, parameters, fixes):
+        name = parameters.get("name")
+        if not isinstance(name, _text_types) or not name.strip():
+            raise RosetteException("badArgument", "The name to translate is empty", repr("name"))
+        if parameters.get("targetLanguage") is None:
+            raise RosetteException("missingParameter", "Required Name Translation parameter not supplied",
+                                   repr("targetLanguage"))
+        fixed = dict(parameters)
+        for field in ("targetLanguage", "sourceLanguageOfOrigin", "sourceLanguageOfUse"):
+            if fixed.get(field) is not None:
+                fixed[field] = self._language(fixed[field], fixes, field)
+        return fixed if fixes else parameters
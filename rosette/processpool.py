@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+
+"""
+Process-pool execution of Rosette API calls.
+
+Copyright (c) 2014-2015 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import multiprocessing
+import pickle
+import sys
+
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:
+    shared_memory = None
+
+_worker_api = None
+_worker_postprocess = None
+_worker_shm_threshold = None
+
+
+def _worker_init(api, postprocess, shm_threshold):
+    global _worker_api, _worker_postprocess, _worker_shm_threshold
+    _worker_api = api
+    _worker_postprocess = postprocess
+    _worker_shm_threshold = shm_threshold
+
+
+def _worker_call(task):
+    """ Runs one call in a worker process.  The result is pickled once; large
+    results are left in a shared memory block for the parent to read. """
+    method, parameters, kwargs = task
+    try:
+        result = getattr(_worker_api, method)(parameters, **kwargs)
+        if _worker_postprocess is not None:
+            result = _worker_postprocess(result)
+        error = None
+    except Exception:
+        result = None
+        error = sys.exc_info()[1]
+    data = pickle.dumps((result, error), pickle.HIGHEST_PROTOCOL)
+    if shared_memory is None or len(data) < _worker_shm_threshold:
+        return ("inline", data)
+    block = shared_memory.SharedMemory(create=True, size=len(data))
+    block.buf[:len(data)] = data
+    name = block.name
+    block.close()
+    return ("shm", name, len(data))
+
+
+def _collect(message):
+    if message[0] == "inline":
+        return pickle.loads(message[1])
+    block = shared_memory.SharedMemory(name=message[1])
+    try:
+        return pickle.loads(block.buf[:message[2]])
+    finally:
+        block.close()
+        block.unlink()
+
+
+def _discard(message):
+    """ Frees the shared memory block of a result that is not collected """
+    if message[0] != "shm":
+        return
+    try:
+        block = shared_memory.SharedMemory(name=message[1])
+    except OSError:
+        return
+    block.close()
+    block.unlink()
+
+
+class ProcessPoolBatch(object):
+    """Runs L{API} calls, and the parsing and post-processing of their results,
+    in a pool of worker processes.
+
+    The L{API} object is pickled into each worker once, at pool start.  Each
+    result is pickled once in the worker; results of C{shm_threshold} bytes
+    or more are handed back through a shared memory block (Python 3.8+)
+    rather than through the pool's result pipe.  Shared memory only saves
+    the copies through the pipe: every result is still pickled in full in
+    the worker and unpickled in full in the parent.  To send less, reduce
+    results in the worker with C{postprocess}.
+
+    Use as a context manager, or call L{ProcessPoolBatch.close} when done.
+    """
+
+    def __init__(self, api, processes=None, postprocess=None, shm_threshold=64 * 1024):
+        """ Create a L{ProcessPoolBatch}.
+        @param api: The L{API} object to call from the workers.
+        @param processes: Number of worker processes; defaults to the number of CPUs.
+        @param postprocess: (Optional) A picklable function applied to each result in the worker,
+        e.g. to keep only the fields needed.
+        @param shm_threshold: Size in bytes above which results are returned through shared memory.
+        """
+        if shared_memory is not None:
+            # workers must share the parent's tracker, which forgets a block once the parent unlinks it
+            resource_tracker.ensure_running()
+        self._pool = multiprocessing.Pool(processes, _worker_init, (api, postprocess, shm_threshold))
+
+    def map(self, method, parameters_list, **kwargs):
+        """ Calls the L{API} method named C{method} once per element of C{parameters_list}.
+        @param method: Name of an L{API} endpoint method, e.g. C{"entities"}.
+        @param parameters_list: An iterable of parameters objects or strings.
+        @param kwargs: Additional keyword arguments for every call, e.g. C{resolve_entities=True}.
+        @return: A list of results in the order of C{parameters_list}.  The first failed call
+        raises its L{RosetteException} after all calls have finished.
+        """
+        tasks = [(method, parameters, kwargs) for parameters in parameters_list]
+        messages = self._pool.map(_worker_call, tasks)
+        outcomes = []
+        try:
+            for message in messages:
+                outcomes.append(_collect(message))
+        finally:
+            # a result that failed to unpickle has freed its block; free those after it
+            for message in messages[len(outcomes) + 1:]:
+                _discard(message)
+        for result, error in outcomes:
+            if error is not None:
+                raise error
+        return [result for result, error in outcomes]
+
+    def close(self):
+        """ Stops the worker processes """
+        self._pool.terminate()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
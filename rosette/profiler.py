@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+
+"""
+Sampling profiler of the client-side cost of Rosette API calls.
+
+Copyright (c) 2014-2015 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from contextlib import contextmanager
+import json
+import random
+import threading
+import time
+
+from rosette.api import _NO_STAGE
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+try:
+    _cpu_time = time.thread_time
+except AttributeError:
+    _cpu_time = getattr(time, "process_time", None) or time.clock
+
+CALL = "call"
+
+
+class _Totals(object):
+    __slots__ = ("count", "cpu", "wall", "allocated")
+
+    def __init__(self):
+        self.count = 0
+        self.cpu = 0.0
+        self.wall = 0.0
+        self.allocated = 0
+
+
+class ClientProfiler(object):
+    """Measures what a sample of L{API} calls cost on the client.
+
+    A fraction C{sample_rate} of the endpoint calls is profiled.  For each
+    sampled call, the CPU time of the calling thread, the wall time and,
+    with C{trace_memory}, the memory allocated (net: the traced memory at
+    the end less that at the start, using C{tracemalloc}) are recorded for
+    the call as a whole and for each client-side stage:
+
+      - C{serialize}: building the request dictionary from the parameters
+      - C{json.dumps}: encoding the request body
+      - C{_make_request}: sending the request and waiting for the answer
+        (its wall time is mostly network and server time)
+      - C{gzip}: decompressing the response
+      - C{_my_loads}: parsing the response
+
+    C{tracemalloc} is only switched on while a sampled call is running, and
+    counts the allocations of all threads; under concurrency the memory
+    figures of a stage include what other threads allocated meanwhile.
+    Peaks are not measured: the C{tracemalloc} peak is process-wide, and
+    resetting it would wipe that of other sampled calls and of the
+    application.
+    """
+
+    def __init__(self, sample_rate=0.01, trace_memory=True, seed=None):
+        """ Create a L{ClientProfiler}.
+        @param sample_rate: Fraction, between 0 and 1, of the calls to profile.
+        @param trace_memory: Whether to measure allocations with C{tracemalloc} (Python 3.4+).
+        @param seed: (Optional) Seed of the sampling decisions.
+        """
+        self.sample_rate = sample_rate
+        self.trace_memory = trace_memory and tracemalloc is not None
+        self.seed = seed
+        self._reset()
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._random = random.Random(self.seed)
+        self._totals = {}
+        self._calls = 0
+        self._tracing = 0  # sampled calls running with tracemalloc switched on by us
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in ("_lock", "_local", "_random", "_totals", "_calls", "_tracing"):
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reset()
+
+    @contextmanager
+    def call(self, endpoint):
+        """ Context manager around one endpoint call; decides whether it is sampled """
+        with self._lock:
+            self._calls += 1
+            sampled = self._random.random() < self.sample_rate
+            if sampled and self.trace_memory:
+                if self._tracing == 0 and not tracemalloc.is_tracing():
+                    tracemalloc.start()
+                    self._tracing = 1
+                elif self._tracing > 0:
+                    self._tracing += 1
+        if not sampled:
+            yield
+            return
+        self._local.sampled = True
+        try:
+            with self._measure(CALL):
+                yield
+        finally:
+            self._local.sampled = False
+            if self.trace_memory:
+                with self._lock:
+                    if self._tracing > 0:
+                        self._tracing -= 1
+                        if self._tracing == 0:
+                            tracemalloc.stop()
+
+    def stage(self, name):
+        """ Context manager around a stage of a call; only measures inside sampled calls """
+        if not getattr(self._local, "sampled", False):
+            return _NO_STAGE
+        return self._measure(name)
+
+    @contextmanager
+    def _measure(self, name):
+        memory = self.trace_memory and tracemalloc.is_tracing()
+        if memory:
+            start_memory = tracemalloc.get_traced_memory()[0]
+        start_cpu = _cpu_time()
+        start_wall = time.time()
+        try:
+            yield
+        finally:
+            cpu = _cpu_time() - start_cpu
+            wall = time.time() - start_wall
+            allocated = 0
+            if memory and tracemalloc.is_tracing():
+                allocated = tracemalloc.get_traced_memory()[0] - start_memory
+            with self._lock:
+                totals = self._totals.get(name)
+                if totals is None:
+                    totals = self._totals[name] = _Totals()
+                totals.count += 1
+                totals.cpu += cpu
+                totals.wall += wall
+                totals.allocated += allocated
+
+    def report(self):
+        """ Returns the aggregate measurements: the number of C{calls} and of C{sampled} calls, and
+        for C{call} and each stage under C{stages}: the C{count} of measurements, C{cpu} and C{wall}
+        seconds in total and per measurement (C{cpu_mean}, C{wall_mean}), net bytes C{allocated} per
+        measurement, and the C{cpu_share} of the sampled calls' CPU time.
+        """
+        with self._lock:
+            totals = dict(self._totals)
+            calls = self._calls
+        call_cpu = totals[CALL].cpu if CALL in totals else 0.0
+        stages = {}
+        for name, t in totals.items():
+            stages[name] = {"count": t.count, "cpu": t.cpu, "wall": t.wall,
+                            "cpu_mean": t.cpu / t.count, "wall_mean": t.wall / t.count,
+                            "allocated": t.allocated // t.count,
+                            "cpu_share": t.cpu / call_cpu if call_cpu else 0.0}
+        return {"calls": calls, "sampled": totals[CALL].count if CALL in totals else 0, "stages": stages}
+
+    def format(self):
+        """ Returns the report as a text table, stages sorted by CPU time """
+        report = self.report()
+        lines = ["%d of %d calls sampled" % (report["sampled"], report["calls"]),
+                 "%-14s %7s %11s %11s %8s %12s" % (
+                     "stage", "count", "cpu us", "wall us", "cpu %", "alloc B")]
+        stages = report["stages"]
+        for name in sorted(stages, key=lambda n: (n != CALL, -stages[n]["cpu"])):
+            s = stages[name]
+            lines.append("%-14s %7d %11.1f %11.1f %8.1f %12d" % (
+                name, s["count"], s["cpu_mean"] * 1e6, s["wall_mean"] * 1e6, s["cpu_share"] * 100,
+                s["allocated"]))
+        return "\n".join(lines)
+
+    def dump(self, path):
+        """ Writes the report to C{path} as JSON """
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=1, sort_keys=True)
+
+    def reset(self):
+        """ Discards the measurements """
+        with self._lock:
+            self._totals = {}
+            self._calls = 0
+
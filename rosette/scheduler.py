@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+"""
+Priority and fair-share scheduling of Rosette API requests.
+
+Copyright (c) 2014-2015 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from collections import deque
+from contextlib import contextmanager
+import threading
+
+
+class Priority:
+    """Priority classes; a lower value is served first."""
+    HIGH = 0
+    NORMAL = 1
+    LOW = 2
+
+
+class _Ticket(object):
+
+    def __init__(self, queue):
+        self.queue = queue
+        self.granted = False
+
+
+class Scheduler(object):
+    """Limits the number of requests in flight and orders the waiting ones.
+
+    Waiting requests of a higher priority class are always started first.
+    Within a class, named queues (e.g. tenants or jobs) share the capacity in
+    proportion to their weights using start-time fair queuing: each queue
+    carries a virtual time that advances by C{1 / weight} per started
+    request, and the waiting queue with the smallest virtual time goes next.
+    """
+
+    def __init__(self, max_concurrency=4, weights=None):
+        """ Create a L{Scheduler}.
+        @param max_concurrency: Maximum number of requests in flight.
+        @param weights: A dictionary of queue name to weight; unnamed queues have weight 1.
+        """
+        self.max_concurrency = max(1, max_concurrency)
+        self.weights = dict(weights or {})
+        self._reset()
+
+    def _reset(self):
+        self._cond = threading.Condition()
+        self._running = 0
+        self._waiting = {}  # priority -> queue name -> deque of tickets
+        self._vtime = {}  # queue name -> virtual time
+        self._system_vtime = 0.0
+
+    def __getstate__(self):
+        return {"max_concurrency": self.max_concurrency, "weights": self.weights}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reset()
+
+    @property
+    def running(self):
+        """ The number of requests in flight """
+        with self._cond:
+            return self._running
+
+    @property
+    def waiting(self):
+        """ The number of requests waiting to start """
+        with self._cond:
+            return sum(len(d) for queues in self._waiting.values() for d in queues.values())
+
+    def _charge(self, queue):
+        start = max(self._vtime.get(queue, 0.0), self._system_vtime)
+        self._system_vtime = start
+        self._vtime[queue] = start + 1.0 / self.weights.get(queue, 1.0)
+
+    def _grant(self):
+        while self._running < self.max_concurrency and self._waiting:
+            priority = min(self._waiting)
+            queues = self._waiting[priority]
+            queue = min(queues, key=lambda q: max(self._vtime.get(q, 0.0), self._system_vtime))
+            ticket = queues[queue].popleft()
+            if not queues[queue]:
+                del queues[queue]
+            if not queues:
+                del self._waiting[priority]
+            self._charge(queue)
+            self._running += 1
+            ticket.granted = True
+        self._cond.notify_all()
+
+    def acquire(self, priority=Priority.NORMAL, queue="default"):
+        """ Blocks until a request of the given priority class and queue may start """
+        with self._cond:
+            if self._running < self.max_concurrency and not self._waiting:
+                self._charge(queue)
+                self._running += 1
+                return
+            ticket = _Ticket(queue)
+            self._waiting.setdefault(priority, {}).setdefault(queue, deque()).append(ticket)
+            while not ticket.granted:
+                self._cond.wait()
+
+    def release(self):
+        """ Marks a started request as finished, starting the next waiting one """
+        with self._cond:
+            self._running -= 1
+            self._grant()
+
+    @contextmanager
+    def slot(self, priority=Priority.NORMAL, queue="default"):
+        """ Context manager holding a request slot for the duration of the block """
+        self.acquire(priority, queue)
+        try:
+            yield
+        finally:
+            self.release()
@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+
+"""
+Compact on-disk storage of Rosette API results.
+
+Copyright (c) 2014-2015 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from collections import OrderedDict
+import json
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+_MAGIC = b"RSTORE1"
+_JSON = b"j"
+_MSGPACK = b"m"
+_HEADER_SIZE = len(_MAGIC) + 1
+_LENGTH = struct.Struct("<I")
+# index entry after the id: block offset, compressed block length, record offset and length in the block
+_ENTRY = struct.Struct("<QIII")
+
+
+def _encoder(encoding):
+    if encoding == _MSGPACK:
+        if msgpack is None:
+            raise ValueError("The store was written with msgpack, which is not installed")
+        return (lambda value: msgpack.packb(value, use_bin_type=True),
+                lambda data: msgpack.unpackb(data, raw=False))
+    return (lambda value: json.dumps(value, separators=(",", ":")).encode("utf-8"),
+            lambda data: json.loads(bytes(data).decode("utf-8")))
+
+
+class ResultStore(object):
+    """Append-only file of results keyed by document id.
+
+    Results are encoded compactly (MessagePack if installed, otherwise JSON
+    without whitespace) and appended to a buffer; every C{block_size} bytes
+    the buffer is compressed with zlib and written as one block.  A separate
+    index file (C{path + ".idx"}) maps each document id to its block and
+    position, and is read into memory when the store is opened.
+
+    L{ResultStore.get} memory-maps the data file and decompresses only the
+    block holding the result; the last C{cached_blocks} decompressed blocks
+    are kept.  Storing a document id again replaces its result.  Results
+    not yet written as a block are lost if the process dies before
+    L{ResultStore.flush} or L{ResultStore.close}; a partially written block
+    is discarded when the store is reopened.
+    """
+
+    def __init__(self, path, block_size=256 * 1024, level=6, cached_blocks=8):
+        """ Open or create a L{ResultStore}.
+        @param path: Path of the data file; the index is kept next to it.
+        @param block_size: Uncompressed size in bytes at which a block is written.
+        @param level: zlib compression level.
+        @param cached_blocks: Number of decompressed blocks kept for reads; 0 keeps none.
+        """
+        self.path = path
+        self.block_size = block_size
+        self.level = level
+        self.cached_blocks = cached_blocks
+        self._lock = threading.Lock()
+        self._index = {}
+        self._pending = []  # (id, encoded result) not yet written
+        self._pending_ids = {}
+        self._pending_size = 0
+        self._blocks = OrderedDict()
+        self._map = None
+
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            encoding = _MSGPACK if msgpack is not None else _JSON
+            with open(path, "wb") as f:
+                f.write(_MAGIC + encoding)
+            open(path + ".idx", "wb").close()
+        with open(path, "rb") as f:
+            header = f.read(_HEADER_SIZE)
+        if header[:len(_MAGIC)] != _MAGIC:
+            raise ValueError(path + " is not a result store")
+        self._encoding = header[len(_MAGIC):]
+        self._encode, self._decode = _encoder(self._encoding)
+        self._load_index()
+        self._data = open(path, "r+b")
+        self._data.seek(0, os.SEEK_END)
+        self._indexfile = open(path + ".idx", "ab")
+
+    def _load_index(self):
+        end = _HEADER_SIZE
+        size = os.path.getsize(self.path)
+        valid = 0
+        with open(self.path + ".idx", "rb") as f:
+            data = f.read()
+        position = 0
+        while position + _LENGTH.size <= len(data):
+            (id_length,) = _LENGTH.unpack_from(data, position)
+            entry_at = position + _LENGTH.size + id_length
+            if entry_at + _ENTRY.size > len(data):
+                break
+            entry = _ENTRY.unpack_from(data, entry_at)
+            if entry[0] + _LENGTH.size + entry[1] > size:
+                break
+            doc_id = data[position + _LENGTH.size:entry_at].decode("utf-8")
+            self._index[doc_id] = entry
+            end = max(end, entry[0] + _LENGTH.size + entry[1])
+            position = valid = entry_at + _ENTRY.size
+        # drop what a crash left behind
+        if valid < len(data):
+            with open(self.path + ".idx", "r+b") as f:
+                f.truncate(valid)
+        if end < size:
+            with open(self.path, "r+b") as f:
+                f.truncate(end)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._index) + sum(1 for k in self._pending_ids if k not in self._index)
+
+    def __contains__(self, doc_id):
+        with self._lock:
+            return doc_id in self._pending_ids or doc_id in self._index
+
+    def ids(self):
+        """ Returns the document ids in the store """
+        with self._lock:
+            return list(self._index) + [k for k in self._pending_ids if k not in self._index]
+
+    def put(self, doc_id, result):
+        """ Stores C{result} under the string C{doc_id} """
+        self.put_many([(doc_id, result)])
+
+    def put_many(self, items):
+        """ Stores C{(doc_id, result)} pairs """
+        encoded = [(doc_id, self._encode(result)) for doc_id, result in items]
+        with self._lock:
+            for doc_id, data in encoded:
+                self._pending_ids[doc_id] = len(self._pending)
+                self._pending.append((doc_id, data))
+                self._pending_size += len(data)
+                if self._pending_size >= self.block_size:
+                    self._write_block()
+
+    def _write_block(self):
+        if not self._pending:
+            return
+        records = []
+        positions = []
+        offset = 0
+        for doc_id, data in self._pending:
+            positions.append((doc_id, offset, len(data)))
+            records.append(data)
+            offset += len(data)
+        block = zlib.compress(b"".join(records), self.level)
+        block_offset = self._data.tell()
+        self._data.write(_LENGTH.pack(len(block)) + block)
+        self._data.flush()
+        entries = []
+        for doc_id, record_offset, length in positions:
+            entry = (block_offset, len(block), record_offset, length)
+            self._index[doc_id] = entry
+            key = doc_id.encode("utf-8")
+            entries.append(_LENGTH.pack(len(key)) + key + _ENTRY.pack(*entry))
+        self._indexfile.write(b"".join(entries))
+        self._indexfile.flush()
+        self._pending = []
+        self._pending_ids = {}
+        self._pending_size = 0
+
+    def flush(self):
+        """ Writes the buffered results as a block """
+        with self._lock:
+            self._write_block()
+
+    def _block(self, offset, length):
+        block = self._blocks.pop(offset, None)
+        if block is None:
+            if self._map is None or len(self._map) < offset + _LENGTH.size + length:
+                if self._map is not None:
+                    self._map.close()
+                self._map = mmap.mmap(self._data.fileno(), 0, access=mmap.ACCESS_READ)
+            start = offset + _LENGTH.size
+            block = zlib.decompress(self._map[start:start + length])
+            if self.cached_blocks <= 0:
+                return block
+            while len(self._blocks) >= self.cached_blocks:
+                self._blocks.popitem(last=False)
+        self._blocks[offset] = block
+        return block
+
+    def get(self, doc_id, default=None):
+        """ Returns the result stored under C{doc_id}, or C{default} """
+        with self._lock:
+            pending = self._pending_ids.get(doc_id)
+            if pending is not None:
+                data = self._pending[pending][1]
+            else:
+                entry = self._index.get(doc_id)
+                if entry is None:
+                    return default
+                block_offset, block_length, record_offset, length = entry
+                data = memoryview(self._block(block_offset, block_length))[record_offset:record_offset + length]
+        return self._decode(data)
+
+    def __getitem__(self, doc_id):
+        marker = object()
+        result = self.get(doc_id, marker)
+        if result is marker:
+            raise KeyError(doc_id)
+        return result
+
+    def items(self):
+        """ Yields every C{(doc_id, result)} pair, reading the file block by block """
+        self.flush()
+        with self._lock:
+            entries = sorted((entry, doc_id) for doc_id, entry in self._index.items())
+        for (block_offset, block_length, record_offset, length), doc_id in entries:
+            with self._lock:
+                block = self._block(block_offset, block_length)
+            yield doc_id, self._decode(memoryview(block)[record_offset:record_offset + length])
+
+    def close(self):
+        """ Writes the buffered results and closes the files """
+        with self._lock:
+            self._write_block()
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+            self._blocks.clear()
+            self._data.close()
+            self._indexfile.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
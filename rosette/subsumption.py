@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+
+"""
+Answering narrower Rosette API requests from the results of broader ones.
+
+Copyright (c) 2014-2015 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from collections import OrderedDict
+import copy
+import hashlib
+import json
+import threading
+import time
+
+# narrower endpoint -> (broader endpoint, keys of the broader result making up the narrower one),
+# most specific broader endpoint first
+_FACETS = {
+    "morphology/lemmas": "lemmas",
+    "morphology/parts-of-speech": "posTags",
+    "morphology/compound-components": "compoundComponents",
+    "morphology/han-readings": "hanReadings",
+}
+_SOURCES = {"entities": [("entities/linked", ("entities",))], "tokens": []}
+for _facet, _key in _FACETS.items():
+    _SOURCES[_facet] = [("morphology/complete", ("tokens", _key))]
+    _SOURCES["tokens"].append((_facet, ("tokens",)))
+_SOURCES["tokens"].insert(0, ("morphology/complete", ("tokens",)))
+del _facet, _key
+
+_BROADER = set(source for sources in _SOURCES.values() for source, _ in sources)
+
+
+def _project(endpoint, source, keys, result):
+    """ The narrower result held in C{result}, or C{None} if C{result} lacks part of it """
+    if any(key not in result for key in keys):
+        return None
+    if endpoint == "entities" and any("type" not in entity for entity in result["entities"]):
+        # these linked entities only carry the linking, not the extraction, fields
+        return None
+    projected = dict((key, copy.deepcopy(result[key])) for key in keys)
+    projected["derivedFrom"] = source
+    return projected
+
+
+class _Pending(object):
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+class SubsumptionCache(object):
+    """Answers requests locally when a broader request about the same document is known.
+
+    C{morphology/complete} results hold the C{lemmas}, C{posTags},
+    C{compoundComponents} and C{hanReadings} of the single facet endpoints,
+    and, like every facet result, the C{tokens}; C{entities/linked} results
+    hold the C{entities} when the server reports the extraction fields
+    (C{type}, ...) of the linked entities.  The results of these broader
+    endpoints are kept for the last C{capacity} documents.  A call to a
+    narrower endpoint with the same content and other parameters is answered
+    from a kept result, or, if such a broader call is in flight, from its
+    result once it arrives, instead of calling the server.  A derived result
+    has a C{derivedFrom} entry naming the broader endpoint and no
+    C{responseHeaders}.  A call waits at most C{max_wait} seconds for a
+    broader call in flight, and is then sent to the server.
+
+    Tokens derived from morphology assume, as the Rosette server does, that
+    both endpoints use the same tokenizer.
+    """
+
+    def __init__(self, capacity=1000, max_wait=30.0):
+        """ Create a L{SubsumptionCache}.
+        @param capacity: Maximum number of broader results kept.
+        @param max_wait: Maximum seconds a call waits for a broader call in flight.
+        """
+        self.capacity = capacity
+        self.max_wait = max_wait
+        self._reset()
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._results = OrderedDict()  # (endpoint, key) -> result
+        self._pending = {}  # (endpoint, key) -> _Pending
+        self._derived = 0
+        self._waited = 0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in ("_lock", "_results", "_pending", "_derived", "_waited"):
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reset()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._results)
+
+    @property
+    def stats(self):
+        """ A dictionary with the number of calls C{derived} from broader results, and of those
+        that C{waited} for a broader call in flight """
+        with self._lock:
+            return {"derived": self._derived, "waited": self._waited}
+
+    def lookup(self, endpoint, parameters):
+        """ Derives the result of a call from a broader result, if one is known.
+        @param endpoint: The endpoint called.
+        @param parameters: The serialized parameters of the call, as a dictionary.
+        @return: A pair: the result to return instead of calling the server, or C{None}; and a
+        claim to pass to L{SubsumptionCache.release} once the call completes.
+        """
+        sources = _SOURCES.get(endpoint, ())
+        if not sources and endpoint not in _BROADER:
+            return None, None
+        key = hashlib.sha1(json.dumps(parameters, sort_keys=True).encode("utf-8")).hexdigest()
+        waiting = []
+        with self._lock:
+            for source, keys in sources:
+                result = self._results.get((source, key))
+                if result is not None:
+                    projected = _project(endpoint, source, keys, result)
+                    if projected is not None:
+                        self._results[(source, key)] = self._results.pop((source, key))
+                        self._derived += 1
+                        return projected, None
+                pending = self._pending.get((source, key))
+                if pending is not None:
+                    waiting.append((source, keys, pending))
+        deadline = time.time() + self.max_wait
+        for source, keys, pending in waiting:
+            if not pending.done.wait(max(0.0, deadline - time.time())):
+                continue
+            if pending.result is not None and "nearDuplicate" not in pending.result:
+                # a near-duplicate's result is about another document
+                projected = _project(endpoint, source, keys, pending.result)
+                if projected is not None:
+                    with self._lock:
+                        self._derived += 1
+                        self._waited += 1
+                    return projected, None
+        if endpoint not in _BROADER:
+            return None, None
+        claim = (endpoint, key)
+        with self._lock:
+            if claim in self._pending:
+                # the same broader call is already in flight; only the first one is shared
+                return None, None
+            self._pending[claim] = _Pending()
+        return None, claim
+
+    def release(self, claim, result):
+        """ Completes the call of a L{SubsumptionCache.lookup} that returned C{claim}, with
+        its C{result}, or C{None} if the call failed """
+        if claim is None:
+            return
+        with self._lock:
+            pending = self._pending.pop(claim)
+            if result is not None and "nearDuplicate" not in result:
+                self._results.pop(claim, None)
+                self._results[claim] = result
+                while len(self._results) > self.capacity:
+                    self._results.popitem(last=False)
+        pending.result = result
+        pending.done.set()
@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+
+"""
+Tuned connections to Rosette API servers.
+
+Copyright (c) 2014-2015 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import logging
+import select
+import socket
+import ssl
+import threading
+import time
+
+try:
+    import httplib as http_client
+except ImportError:
+    import http.client as http_client
+
+try:
+    import urlparse
+except ImportError:
+    import urllib.parse as urlparse
+
+
+class _Connection(http_client.HTTPConnection):
+
+    def __init__(self, transport, netloc):
+        http_client.HTTPConnection.__init__(self, netloc)
+        self._transport = transport
+        self._netloc = netloc
+
+    def connect(self):
+        self.sock = self._transport._open_socket(self.host, self.port, self.timeout,
+                                                 self.source_address)
+        if self._tunnel_host:
+            self._tunnel()
+
+
+class _SecureConnection(_Connection):
+    default_port = http_client.HTTPS_PORT
+
+    def connect(self):
+        _Connection.connect(self)
+        self.sock = self._transport._wrap(self.sock, self._tunnel_host or self.host, self._netloc)
+
+    def getresponse(self, *args, **kwargs):
+        response = _Connection.getresponse(self, *args, **kwargs)
+        self._transport._save_session(self._netloc, self.sock)
+        return response
+
+    def close(self):
+        self._transport._save_session(self._netloc, self.sock)
+        _Connection.close(self)
+
+
+class Transport(object):
+    """Connection factory for an L{API} that cuts connection setup time.
+
+      - DNS answers are cached for C{dns_ttl} seconds and shared by all
+        connections, so reconnects (e.g. after a 429) skip the lookup.
+      - TLS sessions are kept per server and offered on the next handshake,
+        so reconnects resume the session instead of doing a full handshake.
+      - Sockets are opened with C{TCP_NODELAY} and TCP keepalive.
+      - When the L{API} is created, C{warm_connections} connections per
+        service URL are opened ahead of time.  A thread's first request takes
+        a warm connection if one is available; warm connections idle for more
+        than C{idle_timeout} seconds, or closed by the server, are discarded.
+
+    A L{Transport} is used by a single L{API} object.
+    """
+
+    def __init__(self, warm_connections=0, dns_ttl=60.0, tls_session_reuse=True, nodelay=True,
+                 keepalive=True, idle_timeout=30.0, ssl_context=None):
+        """ Create a L{Transport}.
+        @param warm_connections: Number of connections opened per service URL when the L{API} is created.
+        @param dns_ttl: Seconds a DNS answer is reused; 0 disables the cache.
+        @param tls_session_reuse: Whether to resume TLS sessions on reconnect.
+        @param nodelay: Whether to disable Nagle's algorithm on the sockets.
+        @param keepalive: Whether to enable TCP keepalive on the sockets.
+        @param idle_timeout: Seconds after which an unused warm connection is discarded.
+        @param ssl_context: (Optional) The C{ssl.SSLContext} for HTTPS; by default the system's
+        default context.
+        """
+        self.warm_connections = warm_connections
+        self.dns_ttl = dns_ttl
+        self.tls_session_reuse = tls_session_reuse
+        self.nodelay = nodelay
+        self.keepalive = keepalive
+        self.idle_timeout = idle_timeout
+        self.ssl_context = ssl_context
+        self._reset()
+
+    def _reset(self):
+        self.logger = logging.getLogger('rosette.api')
+        self._lock = threading.Lock()
+        self._addresses = {}  # (host, port) -> (expiry, getaddrinfo result)
+        self._sessions = {}  # netloc -> ssl session
+        self._warm = {}  # (scheme, netloc) -> list of (opened, connection)
+        self._stats = dict.fromkeys(("dns_hits", "dns_lookups", "tls_resumed", "tls_full", "warm_used"), 0)
+        self._context = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in ("logger", "_lock", "_addresses", "_sessions", "_warm", "_stats", "_context"):
+            del state[name]
+        # a custom context (private CA, pinning) must survive a fork; an SSLContext cannot
+        # be pickled, so pickling a transport that has one fails rather than dropping it
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reset()
+
+    @property
+    def stats(self):
+        """ A dictionary with the number of C{dns_hits} and C{dns_lookups}, of resumed
+        (C{tls_resumed}) and full (C{tls_full}) TLS handshakes, and of warm connections used
+        (C{warm_used}). """
+        with self._lock:
+            return dict(self._stats)
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def resolve(self, host, port):
+        """ Returns the C{socket.getaddrinfo} answer for C{host} and C{port}, cached for C{dns_ttl} seconds """
+        key = (host, port)
+        now = time.time()
+        with self._lock:
+            cached = self._addresses.get(key)
+            if cached is not None and cached[0] > now:
+                self._stats["dns_hits"] += 1
+                return cached[1]
+        addresses = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+        with self._lock:
+            self._stats["dns_lookups"] += 1
+            if self.dns_ttl > 0:
+                self._addresses[key] = (now + self.dns_ttl, addresses)
+        return addresses
+
+    def _open_socket(self, host, port, timeout, source_address):
+        error = None
+        for family, socktype, proto, _, address in self.resolve(host, port):
+            sock = None
+            try:
+                sock = socket.socket(family, socktype, proto)
+                if timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+                    sock.settimeout(timeout)
+                if source_address:
+                    sock.bind(source_address)
+                self._configure(sock)
+                sock.connect(address)
+                return sock
+            except socket.error as e:
+                error = e
+                if sock is not None:
+                    sock.close()
+        # the cached answer may be out of date
+        with self._lock:
+            self._addresses.pop((host, port), None)
+        raise error or socket.error("getaddrinfo returns an empty list")
+
+    def _configure(self, sock):
+        if self.nodelay:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if self.keepalive:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            for name, value in (("TCP_KEEPIDLE", 30), ("TCP_KEEPINTVL", 10), ("TCP_KEEPCNT", 3)):
+                if hasattr(socket, name):
+                    sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, name), value)
+
+    def _wrap(self, sock, hostname, netloc):
+        with self._lock:
+            if self._context is None:
+                self._context = self.ssl_context or ssl.create_default_context()
+            context = self._context
+            session = self._sessions.get(netloc) if self.tls_session_reuse else None
+        if session is not None:
+            sock = context.wrap_socket(sock, server_hostname=hostname, session=session)
+        else:
+            sock = context.wrap_socket(sock, server_hostname=hostname)
+        self._count("tls_resumed" if getattr(sock, "session_reused", False) else "tls_full")
+        self._save_session(netloc, sock)
+        return sock
+
+    def _save_session(self, netloc, sock):
+        # TLS 1.3 servers send the session ticket after the handshake, so this
+        # is also called once a response has been received and on close
+        session = getattr(sock, "session", None)
+        if self.tls_session_reuse and session is not None:
+            with self._lock:
+                self._sessions[netloc] = session
+
+    def _new(self, scheme, netloc):
+        if scheme == "https":
+            return _SecureConnection(self, netloc)
+        return _Connection(self, netloc)
+
+    def _alive(self, opened, connection):
+        if time.time() - opened > self.idle_timeout or connection.sock is None:
+            return False
+        # an idle connection is readable only if the server closed it
+        return not select.select([connection.sock], [], [], 0)[0]
+
+    def connection(self, scheme, netloc):
+        """ Returns a connection to C{netloc}: a warm one if available, otherwise a new one
+        that connects on its first request """
+        while True:
+            with self._lock:
+                warm = self._warm.get((scheme, netloc))
+                if not warm:
+                    break
+                opened, connection = warm.pop()
+            if self._alive(opened, connection):
+                self._count("warm_used")
+                return connection
+            connection.close()
+        return self._new(scheme, netloc)
+
+    def warm(self, service_urls):
+        """ Opens C{warm_connections} connections to each of C{service_urls}.
+        Failures are logged and otherwise ignored. """
+        for url in service_urls:
+            parsed = urlparse.urlparse(url)
+            key = (parsed.scheme, parsed.netloc)
+            for _ in range(self.warm_connections):
+                connection = self._new(*key)
+                try:
+                    connection.connect()
+                except (socket.error, ssl.SSLError, http_client.HTTPException) as e:
+                    self.logger.warning('Could not pre-open a connection to ' + url + ': ' + str(e))
+                    connection.close()
+                    break
+                with self._lock:
+                    self._warm.setdefault(key, []).append((time.time(), connection))
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (c) 2014-2015 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+# To run tests, run `py.test test_accounting.py`
+
+import gzip
+import httpretty
+import json
+import threading
+import time
+import pytest
+from io import BytesIO
+from rosette.accounting import Accounting, Budget
+from rosette.api import API, RosetteException
+from tests.local_server import LocalServer
+
+
+def _server():
+    throttled = set()
+
+    def respond(path, body):
+        # the first request of each document is throttled once
+        if body not in throttled and b"throttle" in body:
+            throttled.add(body)
+            return 429, {"code": "overCapacity", "message": "slow down"}
+        return 200, {"result": "x" * 10}
+    return LocalServer(respond)
+
+# Test the counts per endpoint and tag, across threads
+
+
+def test_counts():
+    server = _server()
+    try:
+        accounting = Accounting()
+        api = API('key', server.service_url, refresh_duration=0, accounting=accounting)
+
+        def job(name):
+            with api.tag(name):
+                for _ in range(5):
+                    api.language("some text")
+                    api.entities("more text")
+
+        threads = [threading.Thread(target=job, args=("job%d" % i,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        api.sentiment("throttle me")
+        api.ping()
+
+        report = accounting.report()
+        assert report["total"]["calls"] == 42
+        assert report["endpoints"]["language"]["calls"] == 20
+        assert report["endpoints"]["sentiment"]["retries"] == 1
+        assert report["endpoints"]["sentiment"]["request_bytes"] == 2 * len(server.bodies[-2])
+        assert report["tags"]["job2"]["calls"] == 10
+        assert report["tags"][None]["calls"] == 2
+        assert accounting.usage(tag="job1", endpoint="entities")["response_bytes"] == \
+            5 * len(json.dumps({"result": "x" * 10}))
+        assert report["total"]["request_bytes"] == sum(len(body) for body in server.bodies)
+    finally:
+        server.close()
+
+# Test that budgets slow down and then stop the calls
+
+
+def test_budgets():
+    server = _server()
+    try:
+        accounting = Accounting([Budget(hard=3, soft=2, tag="job"), Budget(hard=100, metric="request_bytes")],
+                                soft_delay=0.2)
+        api = API('key', server.service_url, accounting=accounting)
+        with api.tag("job"):
+            api.language("one")
+            api.language("two")
+            start = time.time()
+            api.language("three")
+            assert time.time() - start >= 0.2
+            with pytest.raises(RosetteException) as e_rosette:
+                api.language("four")
+            assert e_rosette.value.status == "budgetExceeded"
+        assert len(server.bodies) == 3
+        assert accounting.usage(tag="job")["calls"] == 3
+
+        api.language("x" * 100)
+        with pytest.raises(RosetteException) as e_rosette:
+            api.language("other")
+        assert e_rosette.value.status == "budgetExceeded"
+    finally:
+        server.close()
+
+# Test that the counts are saved and resumed
+
+
+def test_snapshot(tmpdir):
+    path = str(tmpdir.join("usage.json"))
+    server = _server()
+    try:
+        accounting = Accounting(snapshot_path=path, snapshot_interval=0.05)
+        api = API('key', server.service_url, accounting=accounting)
+        with api.tag("nightly"):
+            api.language("some text")
+        time.sleep(0.3)
+        with open(path) as f:
+            saved = json.load(f)
+        assert saved["counts"][0]["tag"] == "nightly"
+        assert saved["counts"][0]["calls"] == 1
+        api.language("more text")
+        accounting.close()
+
+        resumed = Accounting([Budget(hard=2)], snapshot_path=path)
+        assert resumed.report()["tags"]["nightly"]["calls"] == 1
+        api = API('key', server.service_url, accounting=resumed)
+        with pytest.raises(RosetteException):
+            api.language("again")
+        resumed.close()
+    finally:
+        server.close()
+
+# Test that response bytes are counted as received, before decompression
+
+
+def test_gzipped_response_bytes():
+    buf = BytesIO()
+    f = gzip.GzipFile(fileobj=buf, mode="wb")
+    f.write(json.dumps({"result": "x" * 1000}).encode("utf-8"))
+    f.close()
+    body = buf.getvalue()
+    httpretty.enable()
+    try:
+        httpretty.register_uri(httpretty.POST, "https://api.rosette.com/rest/v1/language",
+                               body=body, status=200)
+        for options in ({}, {"max_response_memory": 100}):
+            accounting = Accounting()
+            api = API('key', accounting=accounting, **options)
+            assert api.language("some text")["result"] == "x" * 1000
+            assert accounting.report()["total"]["response_bytes"] == len(body)
+    finally:
+        httpretty.disable()
+        httpretty.reset()
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (c) 2014-2015 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+# To run tests, run `py.test test_balancer.py`
+
+import gc
+import httpretty
+import json
+import pytest
+import time
+import weakref
+from rosette.api import API, RosetteException
+from rosette.balancer import Balancer
+
+_DOWN = "http://127.0.0.1:1/rest/v1/"
+_UP = "https://api.rosette.com/rest/v1/"
+
+
+@pytest.fixture
+def json_response(scope="module"):
+    body = json.dumps({'name': 'Rosette API', 'versionChecked': True})
+    return body
+
+# Test that the node with the fewest outstanding requests is chosen
+
+
+def test_least_outstanding():
+    balancer = Balancer(["a/", "b/", "c/"])
+    assert balancer.acquire() == "a/"
+    assert balancer.acquire() == "b/"
+    balancer.release("a/")
+    assert balancer.acquire() == "a/"
+    assert balancer.acquire(exclude=["a/", "b/"]) == "c/"
+    assert balancer.acquire(exclude=["a/", "b/", "c/"]) is None
+
+# Test that ejected nodes are skipped until readmitted
+
+
+def test_ejection():
+    balancer = Balancer(["a/", "b/"])
+    balancer.eject("a/")
+    assert not balancer.healthy("a/")
+    assert balancer.acquire() == "b/"
+    assert balancer.acquire() == "b/"
+    balancer.readmit("a/")
+    assert balancer.acquire() == "a/"
+
+# Test that a request fails over when a server cannot be reached
+
+
+def test_failover(json_response):
+    httpretty.enable()
+    httpretty.register_uri(httpretty.GET, _UP + "ping",
+                           body=json_response, status=200, content_type="application/json")
+
+    api = API('bogus_key', service_url=[_DOWN, _UP], health_check_interval=0)
+    result = api.ping()
+    assert result["name"] == "Rosette API"
+    assert not api.balancer.healthy(_DOWN)
+    api.close()
+    httpretty.disable()
+    httpretty.reset()
+
+# Test the error when no server can be reached
+
+
+def test_all_down():
+    api = API('bogus_key', service_url=[_DOWN, "http://127.0.0.1:2/rest/v1"], health_check_interval=0)
+    with pytest.raises(RosetteException) as e_rosette:
+        api.ping()
+    assert e_rosette.value.status == "ConnectionError"
+
+# Test that the health checker ejects failing nodes and readmits answering ones
+
+
+def test_health_checks():
+    balancer = Balancer(["a/", "b/"])
+    balancer.eject("b/")
+
+    def check(node):
+        if node == "a/":
+            raise RosetteException("ConnectionError", "down", node)
+
+    balancer.start_health_checks(check, 0.01)
+    time.sleep(0.2)
+    balancer.stop()
+    assert not balancer.healthy("a/")
+    assert balancer.healthy("b/")
+
+# Test that the health checker does not keep an unused API alive
+
+
+def test_health_checker_released():
+    api = API('bogus_key', service_url=[_DOWN, "http://127.0.0.1:2/rest/v1/"], health_check_interval=0.05)
+    checker = api.balancer._checker
+    assert checker.is_alive()
+    api_ref = weakref.ref(api)
+    del api
+    gc.collect()
+    assert api_ref() is None
+    checker.join(1.0)
+    assert not checker.is_alive()
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (c) 2014-2015 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+# To run tests, run `py.test test_bulk.py`
+
+import httpretty
+import json
+import pytest
+from rosette.api import API, NameTranslationParameters, RosetteException
+from rosette.bulk import PersistentMemo
+
+
+_sent = []
+
+
+def _translation_callback(request, uri, headers):
+    name = json.loads(request.body.decode("utf-8"))["name"]
+    _sent.append(name)
+    if name == "fail":
+        return (500, headers, json.dumps({"code": "unexpectedError", "message": "failed"}))
+    return (200, headers, json.dumps({"result": {"translation": name.upper()}}))
+
+
+def _params(name):
+    params = NameTranslationParameters()
+    params["name"] = name
+    params["targetLanguage"] = "eng"
+    params["entityType"] = "PERSON"
+    return params
+
+# Test that duplicates are sent once and results keep the input order.
+# httpretty is not thread safe, so these tests use a single worker.
+
+
+def test_name_translation_many(tmpdir):
+    httpretty.enable()
+    httpretty.register_uri(httpretty.POST, "https://api.rosette.com/rest/v1/name-translation",
+                           body=_translation_callback, content_type="application/json")
+
+    del _sent[:]
+    api = API('bogus_key')
+    path = str(tmpdir.join("memo.db"))
+    names = ["ali", "bo", "ali", "cy", "bo"]
+    results = api.name_translation_many([_params(n) for n in names], memo=path, max_workers=1)
+    assert [r["result"]["translation"] for r in results] == ["ALI", "BO", "ALI", "CY", "BO"]
+    assert sorted(_sent) == ["ali", "bo", "cy"]
+
+    # a second run is served entirely from the on-disk memo
+    results = api.name_translation_many([_params("cy"), _params("ali")], memo=path, max_workers=1)
+    assert [r["result"]["translation"] for r in results] == ["CY", "ALI"]
+    assert len(_sent) == 3
+    httpretty.disable()
+    httpretty.reset()
+
+# Test that failures are raised after successful results are memoized
+
+
+def test_name_translation_many_error():
+    httpretty.enable()
+    httpretty.register_uri(httpretty.POST, "https://api.rosette.com/rest/v1/name-translation",
+                           body=_translation_callback, content_type="application/json")
+
+    memo = PersistentMemo()
+    with pytest.raises(RosetteException):
+        API('bogus_key', retries=1).name_translation_many([_params("ali"), _params("fail")], memo=memo, max_workers=1)
+    assert len(memo) == 1
+    httpretty.disable()
+    httpretty.reset()
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (c) 2014-2015 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+# To run tests, run `py.test test_cassette.py`
+
+import gzip
+import httpretty
+import json
+import pickle
+import pytest
+from io import BytesIO
+from rosette.api import API, DocumentParameters, RosetteException
+from rosette.cassette import Cassette
+
+
+def _gzipped(obj):
+    buf = BytesIO()
+    f = gzip.GzipFile(fileobj=buf, mode="wb")
+    f.write(json.dumps(obj).encode("utf-8"))
+    f.close()
+    return buf.getvalue()
+
+
+def _params(text):
+    params = DocumentParameters()
+    params['content'] = text
+    return params
+
+# Test that recorded exchanges are replayed without a server
+
+
+def test_record_and_replay(tmpdir):
+    path = str(tmpdir.join("traffic.cassette"))
+    httpretty.enable()
+    httpretty.register_uri(httpretty.POST, "https://api.rosette.com/rest/v1/language",
+                           responses=[httpretty.Response(body=_gzipped({"language": "eng"}), status=200),
+                                      httpretty.Response(body=_gzipped({"language": "fra"}), status=200)])
+    httpretty.register_uri(httpretty.GET, "https://api.rosette.com/rest/v1/ping",
+                           body=json.dumps({"message": "ok"}), status=200, content_type="application/json")
+
+    with Cassette(path, mode="record") as cassette:
+        api = API('secret_key', cassette=cassette)
+        assert api.language(_params("hello"))["language"] == "eng"
+        assert api.language(_params("hello"))["language"] == "fra"
+        assert api.ping()["message"] == "ok"
+    httpretty.disable()
+    httpretty.reset()
+
+    with gzip.open(path, "rb") as f:
+        recorded = f.read()
+    assert b"secret_key" not in recorded
+    assert b"X-RosetteAPI-Binding" in recorded
+
+    cassette = Cassette(path, latency_scale=0)
+    assert len(cassette) == 3
+    api = API('other_key', service_url="http://replay.invalid/rest/v1/", cassette=cassette)
+    assert [api.language(_params("hello"))["language"] for _ in range(3)] == ["eng", "fra", "eng"]
+    assert api.ping()["message"] == "ok"
+    with pytest.raises(RosetteException) as e_rosette:
+        api.language(_params("never sent"))
+    assert e_rosette.value.status == "notRecorded"
+
+    # a replaying cassette goes to forked processes; a recording one refuses to
+    api._after_fork()
+    assert api.ping()["message"] == "ok"
+    clone = pickle.loads(pickle.dumps(api))
+    assert clone.language(_params("hello"))["language"] == "eng"
+    with Cassette(str(tmpdir.join("other.cassette")), mode="record") as recording:
+        with pytest.raises(TypeError):
+            pickle.dumps(API('secret_key', cassette=recording))
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (c) 2014-2015 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+# To run tests, run `py.test test_circuit.py`
+
+import httpretty
+import json
+import pytest
+import time
+from rosette.api import API, DocumentParameters, RosetteException
+from rosette.circuit import CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+
+# Test the closed, open and half-open transitions
+
+
+def test_state_machine():
+    breaker = CircuitBreaker(error_rate=0.5, window=4, min_calls=4, open_duration=0.05)
+    for success in (True, False, True):
+        assert breaker.allow("k")
+        breaker.record("k", success, 0.01)
+    assert breaker.state("k") == CLOSED
+    breaker.record("k", False, 0.01)
+    assert breaker.state("k") == OPEN
+    assert not breaker.allow("k")
+
+    time.sleep(0.06)
+    assert breaker.state("k") == HALF_OPEN
+    assert breaker.allow("k")
+    assert not breaker.allow("k")  # only one probe at a time
+    breaker.record("k", False, 0.01)
+    assert breaker.state("k") == OPEN
+
+    time.sleep(0.06)
+    assert breaker.allow("k")
+    breaker.record("k", True, 0.01)
+    assert breaker.state("k") == CLOSED
+
+# Test that slow requests count as failures
+
+
+def test_slow_calls():
+    breaker = CircuitBreaker(window=2, min_calls=2, slow_call_duration=0.5)
+    breaker.record("k", True, 1.0)
+    breaker.record("k", True, 1.0)
+    assert breaker.state("k") == OPEN
+
+# Test that an open circuit fails fast for its endpoint only
+
+
+def test_circuit_open():
+    httpretty.enable()
+    body = json.dumps({'code': 'unexpectedError', 'message': 'server error'})
+    httpretty.register_uri(httpretty.POST, "https://api.rosette.com/rest/v1/relationships",
+                           body=body, status=500, content_type="application/json")
+    httpretty.register_uri(httpretty.POST, "https://api.rosette.com/rest/v1/entities",
+                           body=json.dumps({'entities': []}), status=200, content_type="application/json")
+
+    api = API('bogus_key', circuit_breaker=CircuitBreaker(window=2, min_calls=2))
+    params = DocumentParameters()
+    params['content'] = 'Sample test string'
+    for _ in range(2):
+        with pytest.raises(RosetteException) as e_rosette:
+            api.relationships(params)
+        assert e_rosette.value.status == 'unexpectedError'
+
+    with pytest.raises(RosetteException) as e_rosette:
+        api.relationships(params)
+    assert e_rosette.value.status == 'circuitOpen'
+    assert api.entities(params)["entities"] == []
+    httpretty.disable()
+    httpretty.reset()
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (c) 2014-2015 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+# To run tests, run `py.test test_dedup.py`
+
+import io
+import json
+import os
+import pytest
+from rosette import dedup
+from rosette.api import API, DocumentParameters
+from rosette.dedup import NearDuplicateIndex
+from tests.local_server import LocalServer
+
+REQUEST_DIR = os.path.join(os.path.dirname(__file__), "mock-data", "request")
+
+
+def _document(name):
+    with io.open(os.path.join(REQUEST_DIR, name), encoding="utf-8") as f:
+        return json.load(f)["content"]
+
+ARTICLE = _document("eng-doc-entities.json")
+OTHER = _document("spa-doc-entities.json")
+
+
+@pytest.fixture
+def server():
+    server = LocalServer(lambda path, body: (200, {"entities": [{"count": len(body)}]}))
+    yield server
+    server.close()
+
+
+def _params(content, language=None):
+    params = DocumentParameters()
+    params["content"] = content
+    if language is not None:
+        params["language"] = language
+    return params
+
+# Test that near-identical documents are sent once
+
+
+def test_reuse(server):
+    index = NearDuplicateIndex(threshold=0.8)
+    api = API('key', server.service_url, near_duplicates=index)
+    first = api.entities(_params(ARTICLE))
+    edited = api.entities(_params(ARTICLE.replace("Friday", "Thursday") + " Updated."))
+    assert len(server.bodies) == 1
+    assert edited["entities"] == first["entities"]
+    assert 0.8 <= edited["nearDuplicate"]["similarity"] <= 1.0
+    assert "nearDuplicate" not in first
+
+    api.entities(_params(OTHER))
+    api.entities(_params(ARTICLE, language="eng"))  # other parameters
+    api.sentiment(_params(ARTICLE))  # other endpoint
+    assert len(server.bodies) == 4
+    assert index.stats == {"hits": 1, "misses": 4}
+
+
+def test_flag(server):
+    api = API('key', server.service_url, near_duplicates=NearDuplicateIndex(mode="flag"))
+    api.entities(_params(ARTICLE))
+    assert api.entities(_params(ARTICLE)) == {"nearDuplicate": {"similarity": 1.0}}
+    assert len(server.bodies) == 1
+
+
+def test_eviction(server):
+    index = NearDuplicateIndex(capacity=2)
+    api = API('key', server.service_url, near_duplicates=index)
+    for text in (ARTICLE, OTHER, "a completely different short text", ARTICLE):
+        api.entities(_params(text))
+    assert len(server.bodies) == 4
+    assert len(index) == 2
+
+
+def test_signature_without_numpy(monkeypatch):
+    index = NearDuplicateIndex()
+    signature = index.signature(ARTICLE)
+    monkeypatch.setattr(dedup, "numpy", None)
+    assert index.signature(ARTICLE) == signature
+    assert len(signature) == 64
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (c) 2014-2015 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+# To run tests, run `py.test test_futures.py`
+
+import json
+import threading
+import time
+import pytest
+from concurrent.futures import as_completed, wait
+from rosette.accounting import Accounting
+from rosette.api import API, RosetteException
+from tests.local_server import LocalServer
+
+
+def _server(delay=0.2):
+    lock = threading.Lock()
+    state = {"in_flight": 0, "peak": 0}
+
+    def respond(path, body):
+        if path.endswith("ping"):
+            return 200, {"message": "pong"}
+        content = json.loads(body.decode("utf-8"))["content"]
+        if content == "bad":
+            return 400, {"code": "badRequest", "message": "bad"}
+        with lock:
+            state["in_flight"] += 1
+            state["peak"] = max(state["peak"], state["in_flight"])
+        time.sleep(delay)
+        with lock:
+            state["in_flight"] -= 1
+        return 200, {"tokens": content.split()}
+    server = LocalServer(respond)
+    server.state = state
+    return server
+
+# Test that the calls of futures overlap and complete through as_completed
+
+
+def test_futures_overlap():
+    server = _server()
+    api = API('key', server.service_url, future_workers=4)
+    try:
+        start = time.time()
+        futures = dict((api.tokens_future("text number %d" % i), i) for i in range(8))
+        seen = set()
+        for future in as_completed(futures):
+            assert future.result()["tokens"][-1] == str(futures[future])
+            seen.add(futures[future])
+        assert seen == set(range(8))
+        # eight calls of 0.2s on four threads
+        assert time.time() - start < 1.2
+        assert server.state["peak"] == 4
+        assert api.ping_future().result()["message"] == "pong"
+    finally:
+        api.close()
+        server.close()
+
+# Test that errors are held by the future
+
+
+def test_future_error():
+    server = _server(delay=0)
+    api = API('key', server.service_url)
+    try:
+        good, bad = api.tokens_future("a b"), api.tokens_future("bad")
+        done, not_done = wait([good, bad])
+        assert not not_done
+        assert good.result()["tokens"] == ["a", "b"]
+        with pytest.raises(RosetteException) as e_rosette:
+            bad.result()
+        assert e_rosette.value.status == 'badRequest'
+    finally:
+        api.close()
+        server.close()
+
+# Test that a call not yet started can be cancelled
+
+
+def test_cancel():
+    server = _server()
+    api = API('key', server.service_url, future_workers=1)
+    try:
+        running = api.tokens_future("first")
+        waiting = api.tokens_future("second")
+        time.sleep(0.05)
+        assert not running.cancel()
+        assert waiting.cancel()
+        assert running.result()["tokens"] == ["first"]
+        assert waiting.cancelled()
+        assert len(server.bodies) == 1
+    finally:
+        api.close()
+        server.close()
+
+# Test that the calls are charged to the tag of the thread that submitted them
+
+
+def test_tag_carried():
+    server = _server(delay=0)
+    accounting = Accounting()
+    api = API('key', server.service_url, accounting=accounting)
+    try:
+        with api.tag("job"):
+            future = api.submit(api.tokens, "a b")
+        future.result()
+        api.tokens_future("c").result()
+        assert accounting.usage(tag="job")["calls"] == 1
+        assert accounting.usage()["calls"] == 2
+    finally:
+        api.close()
+        server.close()
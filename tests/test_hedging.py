@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (c) 2014-2015 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+# To run tests, run `py.test test_hedging.py`
+
+import threading
+import time
+import pytest
+from rosette.api import API, RosetteException
+from rosette.circuit import CircuitBreaker
+from rosette.hedging import HedgePolicy
+from tests.local_server import LocalServer
+
+
+def _server(delay=0.005):
+    lock = threading.Lock()
+    seen = set()
+
+    def respond(path, body):
+        if b"bad" in body:
+            return 400, {"code": "badRequest", "message": "bad"}
+        with lock:
+            # a request marked slow is slow the first time only, so its second copy is fast
+            slow = b"slow" in body and body not in seen
+            seen.add(body)
+        time.sleep(1.0 if slow else delay)
+        return 200, {"language": "eng"}
+    return LocalServer(respond)
+
+
+def _latencies(api, n):
+    latencies = []
+    for i in range(n):
+        start = time.time()
+        text = ("slow text %d" if i % 8 == 7 else "some text %d") % i
+        assert api.language(text)["language"] == "eng"
+        latencies.append(time.time() - start)
+    return latencies
+
+# Test that slow calls are answered by a second copy
+
+
+def test_hedging_cuts_tail():
+    server = _server()
+    try:
+        hedging = HedgePolicy(percentile=80, min_samples=5, max_extra=0.5, endpoints=["language"])
+        breaker = CircuitBreaker(window=100, min_calls=1)
+        api = API('key', server.service_url, hedging=hedging, circuit_breaker=breaker)
+        latencies = _latencies(api, 40)
+        stats = hedging.stats
+        assert stats["calls"] == 40
+        assert stats["hedge_wins"] >= 3
+        assert stats["hedged"] <= 20
+        assert max(latencies[8:]) < 0.5
+        # the cancelled first copies are not counted as failures
+        assert all(False not in circuit.outcomes for circuit in breaker._circuits.values())
+
+        with pytest.raises(RosetteException) as e_rosette:
+            api.language("bad text")
+        assert e_rosette.value.status == "badRequest"
+    finally:
+        server.close()
+
+
+def test_extra_load_cap():
+    server = _server()
+    try:
+        hedging = HedgePolicy(percentile=50, min_samples=2, max_extra=0)
+        api = API('key', server.service_url, hedging=hedging)
+        latencies = _latencies(api, 10)
+        assert hedging.stats["hedged"] == 0
+        assert max(latencies) >= 1.0
+    finally:
+        server.close()
+
+
+def test_other_endpoints_not_hedged():
+    hedging = HedgePolicy(min_samples=1, endpoints=["language"])
+    hedging._record("entities", 0.1, False)
+    hedging._record("language", 0.1, False)
+    assert hedging.delay("entities") is None
+    assert hedging.delay("language") == 0.1
+
+# Test that calls run on their own threads, only second copies using the bounded workers
+
+
+def test_workers_bounded():
+    server = _server(delay=0.1)
+    try:
+        hedging = HedgePolicy(percentile=50, min_samples=1, max_extra=1, endpoints=["language"],
+                              max_workers=1, idle_timeout=0.5)
+        api = API('key', server.service_url, hedging=hedging)
+        api.ping()
+        assert len(hedging._workers) == 0
+
+        def run(callers):
+            threads = [threading.Thread(target=api.language, args=("text %d" % i,)) for i in range(callers)]
+            start = time.time()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            return time.time() - start
+
+        # no hedges: the calls are as concurrent as without hedging
+        hedging._record("language", 1.0, False)
+        assert run(8) < 0.6
+        assert len(hedging._workers) == 0
+
+        # every call is slow enough to be hedged, but one second copy at most runs at a time
+        hedging._latencies.clear()
+        hedging._record("language", 0.01, False)
+        assert run(8) < 0.6
+        assert len(hedging._workers) <= 1
+        assert 1 <= hedging.stats["hedged"] <= 8
+        deadline = time.time() + 5
+        while len(hedging._workers) > 0 and time.time() < deadline:
+            time.sleep(0.05)
+        assert len(hedging._workers) == 0
+    finally:
+        server.close()
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (c) 2014-2015 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+# To run tests, run `py.test test_import_time.py`; add `-s` to see the import time.
+
+import os
+import subprocess
+import sys
+import pytest
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that must only be imported when the feature needing them is used
+_LAZY = ("requests", "gzip", "http.client", "httplib", "sqlite3", "numpy", "multiprocessing",
+         "concurrent.futures")
+
+
+def _import_times(statement):
+    """ Runs C{statement} in a fresh interpreter under C{-X importtime} and returns
+    a dictionary of module name to cumulative import time in microseconds """
+    env = dict(os.environ)
+    env["PYTHONPATH"] = _ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    proc = subprocess.Popen([sys.executable, "-X", "importtime", "-c", statement],
+                            stderr=subprocess.PIPE, env=env, cwd=_ROOT)
+    _, err = proc.communicate()
+    assert proc.returncode == 0, err
+    times = {}
+    for line in err.decode("utf-8").splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, name = line[len("import time:"):].split("|")
+            if cumulative.strip().isdigit():
+                times[name.strip()] = int(cumulative)
+    return times
+
+# Benchmark the cold start: importing the package and creating an API object
+
+
+@pytest.mark.skipif(sys.version_info < (3, 7), reason="-X importtime requires Python 3.7")
+def test_import_time():
+    times = _import_times("import rosette.api; rosette.api.API('bogus_key')")
+    print("\nimport rosette.api: %.1f ms" % (times["rosette.api"] / 1000.0))
+    assert not [name for name in _LAZY if name in times]
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (c) 2014-2015 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+# To run tests, run `py.test test_incremental.py`
+
+import json
+import re
+import pytest
+from rosette.api import API, DocumentParameters, RosetteException
+from rosette.incremental import IncrementalProcessor, merge_results, segment
+from tests.local_server import LocalServer
+
+
+def _respond(path, body):
+    """ Every capitalized word is an entity; the label is "pos" if the text says "good" """
+    content = json.loads(body.decode("utf-8"))["content"]
+    entities = {}
+    for match in re.finditer(r"[A-Z]\w+", content):
+        entity = entities.setdefault(match.group(), {"type": "X", "mention": match.group(),
+                                                     "normalized": match.group(), "count": 0,
+                                                     "mentionOffsets": []})
+        entity["count"] += 1
+        entity["mentionOffsets"].append({"startOffset": match.start(), "endOffset": match.end()})
+    label = "pos" if "good" in content else "neg"
+    return 200, {"entities": list(entities.values()), "document": {"label": label, "confidence": 1.0}}
+
+
+@pytest.fixture
+def server():
+    server = LocalServer(_respond)
+    yield server
+    server.close()
+
+PARAGRAPHS = ["Alice met Bob in Paris.", "The weather was good.", "Bob flew home to Boston.",
+              "Alice stayed."]
+
+
+def _check_offsets(result, text):
+    for entity in result["entities"]:
+        assert entity["count"] == len(entity["mentionOffsets"])
+        for offsets in entity["mentionOffsets"]:
+            assert text[offsets["startOffset"]:offsets["endOffset"]] == entity["mention"]
+
+
+def test_segment():
+    text = "\n\n".join(PARAGRAPHS) + "\n"
+    assert [block for _, block in segment(text)] == PARAGRAPHS[:3] + ["Alice stayed.\n"]
+    assert all(text[start:start + len(block)] == block for start, block in segment(text))
+    long_paragraph = "One sentence here. Another one there. And a third."
+    assert [block for _, block in segment(long_paragraph, max_block=10)] == \
+        ["One sentence here.", "Another one there.", "And a third."]
+
+# Test that only edited paragraphs are sent and offsets refer to the new version
+
+
+def test_incremental(server):
+    api = API('key', server.service_url)
+    processor = IncrementalProcessor(api)
+    text = "\n\n".join(PARAGRAPHS)
+    first = processor.process("doc", text)
+    assert first["incremental"] == {"blocks": 4, "sent": 4}
+    _check_offsets(first, text)
+    counts = dict((e["mention"], e["count"]) for e in first["entities"])
+    assert counts == {"Alice": 2, "Bob": 2, "Paris": 1, "The": 1, "Boston": 1}
+    assert "responseHeaders" not in first
+
+    edited = "\n\n".join(["Alice met Bob and Carol in Paris."] + PARAGRAPHS[1:])
+    second = processor.process("doc", edited)
+    assert second["incremental"] == {"blocks": 4, "sent": 1}
+    _check_offsets(second, edited)
+    assert "Carol" in [e["mention"] for e in second["entities"]]
+
+    moved = "\n\n".join([PARAGRAPHS[2], PARAGRAPHS[0], PARAGRAPHS[1]])
+    third = processor.process("doc", moved)
+    assert third["incremental"]["sent"] == 1  # only the original first paragraph was dropped
+    _check_offsets(third, moved)
+    assert processor.stats == {"sent": 6, "reused": 5}
+
+    assert processor.process("doc", moved, endpoint="sentiment")["document"]["label"] == "neg"
+
+    processor.forget("doc")
+    assert processor.process("doc", moved)["incremental"]["sent"] == 3
+
+    # byte content is decoded; a contentUri cannot be split
+    assert processor.process("doc", moved.encode("utf-8"))["incremental"]["sent"] == 0
+    params = DocumentParameters()
+    params["contentUri"] = "http://example.com/doc"
+    with pytest.raises(RosetteException) as e_rosette:
+        processor.process("uri", params)
+    assert e_rosette.value.status == "badArgument"
+    assert processor.stats["sent"] == 12
+
+
+def test_merge_document_sentiment():
+    merged = merge_results([(0, 100, {"document": {"label": "pos", "confidence": 0.9}}),
+                            (101, 10, {"document": {"label": "neg", "confidence": 1.0}})])
+    assert merged["document"]["label"] == "pos"
+    assert merged["document"]["confidence"] == pytest.approx(90.0 / 110)
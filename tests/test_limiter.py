@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (c) 2014-2015 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+# To run tests, run `py.test test_limiter.py`
+
+import pickle
+import threading
+import time
+from rosette.api import API, NameTranslationParameters
+from rosette.limiter import AdaptiveLimiter
+from tests.local_server import LocalServer
+
+
+def _round(limiter, overloaded=False):
+    """ Starts as many requests as the limit allows and finishes them """
+    tokens = [limiter.acquire() for _ in range(limiter.limit)]
+    for token in tokens:
+        limiter.release(token, overloaded)
+
+# Test additive increase and multiplicative decrease
+
+
+def test_aimd():
+    limiter = AdaptiveLimiter(initial=4, maximum=6, latency_tolerance=1000)
+    for _ in range(20):
+        limiter.release(limiter.acquire())  # one at a time does not need more
+    assert limiter.limit == 4
+    for _ in range(3):
+        _round(limiter)  # about one more per round
+    assert limiter.limit == 5
+    for _ in range(10):
+        _round(limiter)
+    assert limiter.limit == 6
+    assert limiter.in_flight == 0
+
+    _round(limiter, overloaded=True)  # one cut for the whole burst
+    assert limiter.limit == 3
+    token = limiter.acquire()
+    limiter.release(token, overloaded=True)
+    assert limiter.limit == 1
+    _round(limiter, overloaded=True)
+    assert limiter.limit == 1
+
+    clone = pickle.loads(pickle.dumps(limiter))
+    assert clone.limit == 4 and clone.maximum == 6
+
+
+def test_latency_spike():
+    limiter = AdaptiveLimiter(initial=4, latency_tolerance=2.0)
+    for _ in range(5):
+        limiter.release(limiter.acquire(), latency=0.01)
+    token = limiter.acquire()
+    limiter.release(token - 1.0)  # took a second longer
+    assert limiter.limit == 2
+
+# Test that calls of varying cost, failures and other endpoints are not taken for overload
+
+
+def test_mixed_latencies():
+    limiter = AdaptiveLimiter(initial=16, maximum=16, latency_tolerance=2.0)
+    for i in range(200):
+        limiter.release(limiter.acquire(), endpoint="entities", latency=0.01 if i % 2 else 0.1)
+    assert limiter.limit == 16
+
+    for _ in range(3):
+        limiter.release(limiter.acquire(), endpoint="language", latency=0.001, success=False)
+    for _ in range(50):
+        limiter.release(limiter.acquire(), endpoint="language", latency=0.02)
+    assert limiter.limit == 16
+
+    # a slow endpoint does not make a fast one look overloaded, nor the reverse
+    for _ in range(20):
+        limiter.release(limiter.acquire(), endpoint="relationships", latency=1.0)
+        limiter.release(limiter.acquire(), endpoint="language", latency=0.02)
+    assert limiter.limit == 16
+
+    limiter.release(limiter.acquire(), endpoint="language", latency=0.5)
+    assert limiter.limit == 8
+
+# Test that the limit settles near the server's capacity
+
+
+def test_tracks_capacity():
+    lock = threading.Lock()
+    state = {"in_flight": 0, "peak": 0}
+
+    def respond(path, body):
+        with lock:
+            state["in_flight"] += 1
+            busy = state["in_flight"] > 3
+            if not busy:
+                state["peak"] = max(state["peak"], state["in_flight"])
+        try:
+            if busy:
+                return 429, {"code": "overCapacity", "message": "busy"}
+            time.sleep(0.02)
+            return 200, {"result": {"translation": "x"}}
+        finally:
+            with lock:
+                state["in_flight"] -= 1
+
+    server = LocalServer(respond)
+    try:
+        limiter = AdaptiveLimiter(initial=1, maximum=16)
+        api = API('key', server.service_url, refresh_duration=0.01, limiter=limiter)
+        names = []
+        for i in range(80):
+            params = NameTranslationParameters()
+            params["name"] = "name %d" % i
+            params["targetLanguage"] = "eng"
+            names.append(params)
+        results = api.name_translation_many(names)
+        assert len(results) == 80
+        assert state["peak"] >= 2
+        assert 1 <= limiter.limit <= 6
+        assert limiter.in_flight == 0
+    finally:
+        server.close()
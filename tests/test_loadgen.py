@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (c) 2014-2015 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+# To run tests, run `py.test test_loadgen.py`
+
+import os
+from rosette.api import API
+from rosette.loadgen import LoadGenerator, load_payloads
+from tests.local_server import LocalServer
+
+REQUEST_DIR = os.path.join(os.path.dirname(__file__), "mock-data", "request")
+
+
+def _server():
+    # the English document is throttled by language and rejected by entities
+    def respond(path, body):
+        if b'Samsung' not in body:
+            return 200, {}
+        if path.endswith("/language"):
+            return 429, {"code": "overCapacity", "message": "slow down"}
+        return 400, {"code": "badRequest", "message": "no"}
+    return LocalServer(respond)
+
+
+def test_load_payloads():
+    payloads = load_payloads(REQUEST_DIR)
+    assert list(payloads) == ["entities"]
+    assert len(payloads["entities"]) == len(os.listdir(REQUEST_DIR))
+    assert payloads["entities"][0]["content"]
+
+
+def test_closed_loop():
+    server = _server()
+    try:
+        payloads = load_payloads(REQUEST_DIR)
+        payloads["language"] = payloads["entities"]
+        api = API('key', server.service_url, retries=1, refresh_duration=0)
+        generator = LoadGenerator(api, payloads, {"entities": 1, "language": 1}, concurrency=4, seed=1)
+        report = generator.run(duration=30, requests=60)
+        summary = report.summary()
+        assert summary["all"]["requests"] == 60
+        assert summary["entities"]["requests"] + summary["language"]["requests"] == 60
+        assert summary["entities"]["throttle_rate"] == 0
+        assert summary["entities"]["error_rate"] > 0
+        assert summary["language"]["throttle_rate"] > 0
+        assert summary["language"]["error_rate"] == 0
+        s = summary["all"]
+        assert s["p50"] <= s["p90"] <= s["p99"] <= s["max"]
+        assert s["throughput"] > 0
+        assert "language" in report.format()
+    finally:
+        server.close()
+
+
+def test_open_loop_probe():
+    server = _server()
+    try:
+        api = API('key', server.service_url, retries=1, refresh_duration=0)
+        generator = LoadGenerator(api, load_payloads(REQUEST_DIR), concurrency=2, rate=100, seed=2)
+        steps = generator.probe([50, 200], duration=0.3)
+        assert [level for level, report in steps] == [50, 200]
+        assert steps[0][1].summary()["all"]["requests"] < steps[1][1].summary()["all"]["requests"]
+    finally:
+        server.close()
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (c) 2014-2015 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+# To run tests, run `py.test test_markup.py`
+
+import io
+import json
+import random
+from rosette.api import API, DocumentParameters
+from rosette.markup import MarkupStripper, strip_document, strip_markup
+from tests.local_server import LocalServer
+
+_PAGE = (u"<html><head><title>New Ghostbusters Film</title><style>p { color: red }</style></head>"
+         u"<body><!-- nav --><p>Original  Ghostbuster\n Dan Aykroyd &amp; caf&eacute; <b>cast</b>,</p>"
+         u"<script>if (a < b) { run(); }</script><div>Café&nbsp;&#8220;Reporter&#x201d;</div></body></html>")
+_TEXT = u"New Ghostbusters Film\nOriginal Ghostbuster Dan Aykroyd & café cast,\nCafé “Reporter”"
+
+# Test the visible text and the map back to the markup
+
+
+def test_strip():
+    stripped = strip_markup(_PAGE)
+    assert stripped.text == _TEXT
+    assert stripped.source_length == len(_PAGE)
+    for word, source in ((u"Aykroyd", u"Aykroyd"), (u"&", u"&amp;"), (u"café", u"caf&eacute;"),
+                         (u"Café", u"Café"), (u"”", u"&#x201d;")):
+        start = stripped.text.index(word)
+        span = stripped.source_span(start, start + len(word))
+        assert _PAGE[span[0]:span[1]] == source
+    assert strip_markup(_PAGE, normalization=None).text.endswith(u"Café “Reporter”")
+
+    # characters whose lower case is longer do not move the end of a hidden element
+    for page, text in ((u"<script>İİİİİİİİ</SCRIPT><p>visible text</p>", u"visible text"),
+                       (u"<p>İİİİ</p><script>x</script><p>after</p>", u"İİİİ\nafter")):
+        stripped = strip_markup(page)
+        assert stripped.text == text
+        span = stripped.source_span(len(text) - 4, len(text))
+        assert page[span[0]:span[1]] == text[-4:]
+
+# Test that the text and map do not depend on how the document is split into pieces
+
+
+def test_streaming():
+    whole = strip_markup(_PAGE)
+    data = _PAGE.encode("utf-8")
+    rand = random.Random(7)
+    for _ in range(50):
+        stripper = MarkupStripper()
+        position = 0
+        while position < len(data):
+            size = rand.randint(1, 9)
+            stripper.feed(data[position:position + size])
+            position += size
+        pieces = stripper.close()
+        assert pieces.text == whole.text
+        assert [pieces.source_span(i, i + 1) for i in range(len(pieces))] == \
+            [whole.source_span(i, i + 1) for i in range(len(whole))]
+    assert strip_markup(io.BytesIO(data)).text == whole.text
+
+# Test that a loaded HTML file is sent as text, and the result offsets moved back to the markup
+
+
+def test_strip_document(tmpdir):
+    bodies = []
+
+    def respond(path, body):
+        request = json.loads(body.decode("utf-8"))
+        bodies.append(request)
+        start = request["content"].index(u"Dan Aykroyd")
+        return 200, {"entities": [{"mention": u"Dan Aykroyd", "mentionOffsets": [
+            {"startOffset": start, "endOffset": start + len(u"Dan Aykroyd")}]}]}
+    server = LocalServer(respond)
+    path = tmpdir.join("page.html")
+    path.write_binary(_PAGE.encode("utf-8"))
+    try:
+        params = DocumentParameters()
+        params["language"] = "eng"
+        params.load_document_file(str(path))
+        stripped_params, stripped = strip_document(params)
+        assert not stripped_params.useMultipart
+        result = API('key', server.service_url).entities(stripped_params)
+        assert bodies == [{"content": _TEXT, "language": "eng"}]
+        offsets = stripped.translate(result)["entities"][0]["mentionOffsets"][0]
+        assert _PAGE[offsets["startOffset"]:offsets["endOffset"]] == u"Dan Aykroyd"
+    finally:
+        server.close()
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (c) 2014-2015 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+# To run tests, run `py.test test_microbatch.py`
+
+import json
+import re
+import threading
+from rosette.api import API, DocumentParameters
+from rosette.microbatch import MicroBatcher
+from tests.local_server import LocalServer
+
+TWEETS = [u"Loving the new phone from Samsung!", u"Rain again in Boston. Staying in.",
+          u"Just landed in Paris", u"Apple and Samsung both announced phones today. Big day.",
+          u"ok", u"Heading to the game with Bob", u"What a match!", u"Coffee first. Then Boston."]
+
+
+def _respond(offsets):
+    def respond(path, body):
+        content = json.loads(body.decode("utf-8"))["content"]
+        if path.endswith("/tokens"):
+            return 200, {"tokens": re.findall(r"\w+|[^\w\s]", content, re.UNICODE)}
+        if path.endswith("/sentences"):
+            return 200, {"sentences": re.findall(r"\S.*?(?:[.!?]\s*|\n\s*|$)", content, re.S)}
+        entities = {}
+        for match in re.finditer(r"[A-Z]\w+", content):
+            entity = entities.setdefault(match.group(), {"type": "X", "mention": match.group(),
+                                                         "count": 0, "indocChainId": len(entities),
+                                                         "mentionOffsets": []})
+            entity["count"] += 1
+            entity["mentionOffsets"].append({"startOffset": match.start(), "endOffset": match.end()})
+        if not offsets:
+            for entity in entities.values():
+                del entity["mentionOffsets"]
+        return 200, {"entities": sorted(entities.values(), key=lambda e: e["indocChainId"])}
+    return respond
+
+
+def _params(text):
+    params = DocumentParameters()
+    params["content"] = text
+    params["language"] = "eng"
+    return params
+
+
+def _run(batcher):
+    results = [None] * len(TWEETS)
+
+    def send(i):
+        results[i] = batcher.call(_params(TWEETS[i]))
+    threads = [threading.Thread(target=send, args=(i,)) for i in range(len(TWEETS))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def _without_headers(result):
+    return dict((k, v) for (k, v) in result.items() if k != "responseHeaders")
+
+# Test that batched results are those of single requests
+
+
+def test_batched_results_match_single():
+    server = LocalServer(_respond(True))
+    try:
+        api = API('key', server.service_url)
+        for endpoint in ("tokens", "sentences", "entities"):
+            batcher = MicroBatcher(api, endpoint, max_delay=0.2)
+            results = _run(batcher)
+            expected = [_without_headers(getattr(api, endpoint)(_params(t))) for t in TWEETS]
+            assert [_without_headers(r) for r in results] == expected
+            assert batcher.stats["batched"] == len(TWEETS)
+            assert batcher.stats["batches"] < len(TWEETS)
+    finally:
+        server.close()
+
+
+def test_fallback():
+    server = LocalServer(_respond(False))
+    try:
+        api = API('key', server.service_url)
+        batcher = MicroBatcher(api, "entities", max_delay=0.2)
+        results = _run(batcher)
+        assert [e["mention"] for e in results[0]["entities"]] == ["Loving", "Samsung"]
+        assert batcher.stats["batched"] == 0
+        requests = len(server.bodies)
+        batcher.call(_params(TWEETS[0]))
+        assert len(server.bodies) == requests + 1
+        assert batcher.stats["single"] == len(TWEETS) + 1
+
+        sentiment = MicroBatcher(api, "sentiment")
+        sentiment.call(_params("Great day"))
+        no_language = MicroBatcher(api, "tokens")
+        no_language.call("Great day")
+        assert sentiment.stats["single"] == 1 and no_language.stats["single"] == 1
+    finally:
+        server.close()
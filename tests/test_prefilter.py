@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (c) 2014-2015 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+# To run tests, run `py.test test_prefilter.py`
+
+import httpretty
+import json
+import pytest
+from rosette import prefilter
+from rosette.api import API, NameSimilarityParameters
+from rosette.prefilter import NamePrefilter
+
+
+@pytest.fixture
+def json_response(scope="module"):
+    body = json.dumps({'result': {'score': 0.9}})
+    return body
+
+
+def _params(name1, name2):
+    params = NameSimilarityParameters()
+    params["name1"] = {"text": name1, "entityType": "PERSON"}
+    params["name2"] = {"text": name2, "entityType": "PERSON"}
+    return params
+
+# Test that local scores rank similar names above unrelated ones
+
+
+def test_scores():
+    scores = NamePrefilter().scores([("Michael Jackson", "Michael Jackson"),
+                                     ("Michael Jackson", "Micheal Jakson"),
+                                     ("Michael Jackson", "Xu Qing"),
+                                     (u"Michael Jackson", u"迈克尔·杰克逊")])
+    assert scores[0] == pytest.approx(1.0)
+    assert scores[1] > 0.3
+    assert scores[2] < 0.1
+    assert scores[3] is None
+
+# Test that the pure python fallback agrees with the NumPy path
+
+
+def test_scores_without_numpy(monkeypatch):
+    pairs = [("José Martínez", "Jose Martinez"), ("Anna Smith", "Ana Smyth"), ("Bob", "Zhang Wei")]
+    expected = NamePrefilter().scores(pairs)
+    crowded = NamePrefilter(dimension=16).scores(pairs)  # hash collisions within and across names
+    monkeypatch.setattr(prefilter, "numpy", None)
+    assert NamePrefilter().scores(pairs) == pytest.approx(expected)
+    assert NamePrefilter(dimension=16).scores(pairs) == pytest.approx(crowded)
+
+# Test that dissimilar pairs are answered locally and counted
+
+
+def test_name_similarity_prefiltered(json_response):
+    httpretty.enable()
+    httpretty.register_uri(httpretty.POST, "https://api.rosette.com/rest/v1/name-similarity",
+                           body=json_response, status=200, content_type="application/json")
+
+    api = API('bogus_key', name_prefilter=NamePrefilter(threshold=0.3))
+    result = api.name_similarity(_params("Michael Jackson", "Xu Qing"))
+    assert result["prefiltered"]
+    assert result["result"]["score"] < 0.3
+
+    result = api.name_similarity(_params("Michael Jackson", "Micheal Jackson"))
+    assert result["result"]["score"] == 0.9
+    assert api.name_prefilter.stats == {"checked": 2, "forwarded": 1, "skipped": 1}
+    httpretty.disable()
+    httpretty.reset()
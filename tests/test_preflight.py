@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (c) 2014-2015 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+# To run tests, run `py.test test_preflight.py`
+
+import json
+import pytest
+from rosette.api import API, DocumentParameters, NameSimilarityParameters, NameTranslationParameters, \
+    RosetteException
+from rosette.preflight import Preflight
+from tests.local_server import LocalServer
+
+
+def _server(info):
+    def respond(path, body):
+        if path.endswith("info"):
+            return 200, info
+        return 200, {"request": json.loads(body.decode("utf-8"))}
+    return LocalServer(respond)
+
+
+def _params(content, language=None):
+    params = DocumentParameters()
+    params["content"] = content
+    params["language"] = language
+    return params
+
+# Test that the server's limits are fetched once and applied before sending
+
+
+def test_server_limits():
+    server = _server({"name": "Rosette API", "maxContentSize": 100, "supportedLanguages": ["eng", "fra"]})
+    preflight = Preflight()
+    api = API('key', server.service_url, preflight=preflight)
+    try:
+        params = _params("Some text", "EN")
+        assert api.language(params)["request"] == {"content": "Some text", "language": "eng"}
+        assert params["language"] == "EN"
+        assert api.language(_params("Texto", "spa"))["request"] == {"content": "Texto"}
+        with pytest.raises(RosetteException) as e_rosette:
+            api.entities(_params(u"é" * 60))
+        assert e_rosette.value.status == "contentTooLarge"
+        with pytest.raises(RosetteException) as e_rosette:
+            api.entities(_params(" \n "))
+        assert e_rosette.value.status == "badArgument"
+        assert len(server.bodies) == 3  # info and two calls
+        assert preflight.stats == {"checked": 4, "fixed": 2, "refused": 2}
+    finally:
+        server.close()
+
+# Test that without fixing, repairable requests are refused
+
+
+def test_no_fix():
+    preflight = Preflight(languages=["eng"], fix=False)
+    with pytest.raises(RosetteException) as e_rosette:
+        preflight.check("entities", {"content": "text", "language": "spa"})
+    assert e_rosette.value.status == "unsupportedLanguage"
+    with pytest.raises(RosetteException):
+        preflight.check("entities", {"content": "text", "language": "en"})
+    with pytest.raises(RosetteException):
+        preflight.check("name-similarity", {"name1": "Ann", "name2": {"text": "Anne"}})
+    params = {"content": "text", "language": "eng"}
+    assert preflight.check("entities", params) is params
+
+# Test the checks of names
+
+
+def test_names():
+    preflight = Preflight()
+    checked = preflight.check("name-similarity", {"name1": "Ann", "name2": {"text": "Anne", "lang": "eng",
+                                                                             "language": "EN"}})
+    assert checked == {"name1": {"text": "Ann"}, "name2": {"text": "Anne", "language": "eng"}}
+    for name2 in (None, {"language": "eng"}, {"text": " "}, {"text": "Anne", "entityType": "CITY"}, 42):
+        with pytest.raises(RosetteException):
+            preflight.check("name-similarity", {"name1": "Ann", "name2": name2})
+    assert preflight.check("name-translation", {"name": "Ann", "targetLanguage": "ja"}) == \
+        {"name": "Ann", "targetLanguage": "jpn"}
+    with pytest.raises(RosetteException):
+        preflight.check("name-translation", {"name": "", "targetLanguage": "eng"})
+
+# Test checking a batch against a server whose info reports no limits
+
+
+def test_check_many():
+    server = _server({})
+    api = API('key', server.service_url)
+    try:
+        preflight = Preflight(max_content_size=10)
+        names = NameSimilarityParameters()
+        names["name1"] = "Ann"
+        names["name2"] = {"text": "Anne"}
+        outcomes = preflight.check_many("entities", ["short", _params("far too long"), _params("ok", "fr")], api)
+        assert outcomes[0][0]["content"] == "short" and outcomes[0][1] is None
+        assert outcomes[1][0] is None and outcomes[1][1].status == "contentTooLarge"
+        assert outcomes[2][0]["language"] == "fra"
+        fixed, error = preflight.check_many("name-similarity", [names])[0]
+        assert isinstance(fixed, NameSimilarityParameters) and fixed["name1"] == {"text": "Ann"}
+        translation = NameTranslationParameters()
+        translation["name"] = "Ann"
+        translation["targetLanguage"] = "eng"
+        assert preflight.check_many("name-translation", [translation])[0] == (translation, None)
+    finally:
+        server.close()
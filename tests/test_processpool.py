@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (c) 2014-2015 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+# To run tests, run `py.test test_processpool.py`
+
+import json
+import multiprocessing
+import os
+import pickle
+import pytest
+from rosette.api import API, RosetteException
+from rosette.circuit import CircuitBreaker
+from rosette.prefilter import NamePrefilter
+from rosette import processpool
+from rosette.processpool import ProcessPoolBatch
+from rosette.scheduler import Scheduler
+from tests.local_server import LocalServer
+
+
+def _tokens(path, body):
+    content = json.loads(body.decode("utf-8"))["content"]
+    if content == "bad":
+        return 400, {"code": "badRequest", "message": "bad content"}
+    return 200, {"tokens": content.split() * (5000 if content == "big" else 1)}
+
+
+@pytest.fixture
+def service_url():
+    server = LocalServer(_tokens)
+    yield server.service_url
+    server.close()
+
+
+def _count_tokens(result):
+    return len(result["tokens"])
+
+# Test that an API object survives pickling with its helpers
+
+
+def test_pickle_api():
+    api = API('bogus_key', service_url=["http://a/rest/v1/", "http://b/rest/v1/"], health_check_interval=0,
+              name_prefilter=NamePrefilter(threshold=0.4), circuit_breaker=CircuitBreaker(window=3),
+              scheduler=Scheduler(max_concurrency=2))
+    copy = pickle.loads(pickle.dumps(api))
+    assert copy.user_key == 'bogus_key'
+    assert copy.balancer.nodes == ["http://a/rest/v1/", "http://b/rest/v1/"]
+    assert copy.name_prefilter.threshold == 0.4
+    assert copy.circuit_breaker.window == 3
+    assert copy.scheduler.max_concurrency == 2
+    assert copy.http_connection is None
+
+# Test that a forked API object drops the connections of its parent
+
+
+def test_fork_detection(service_url):
+    api = API('bogus_key', service_url=service_url)
+    api.tokens("one two")
+    assert api.http_connection is not None
+    parent_connection = api.http_connection
+    api._pid = -1  # pretend this object was created in another process
+    api.tokens("one two")
+    assert api.http_connection is not parent_connection
+
+# Test calls, post-processing and error propagation in worker processes
+
+
+def test_process_pool_batch(service_url):
+    api = API('bogus_key', service_url=service_url)
+    with ProcessPoolBatch(api, processes=2, shm_threshold=1024) as batch:
+        results = batch.map("tokens", ["a b", "big", "c"])
+        assert [len(r["tokens"]) for r in results] == [2, 5000, 1]
+
+    with ProcessPoolBatch(api, processes=2, postprocess=_count_tokens) as batch:
+        assert batch.map("tokens", ["a b c", "d"]) == [3, 1]
+        with pytest.raises(RosetteException) as e_rosette:
+            batch.map("tokens", ["a", "bad"])
+        assert e_rosette.value.status == "badRequest"
+
+
+def _unpicklable_in_parent():
+    if multiprocessing.current_process().name == "MainProcess":
+        raise ValueError("cannot load this result here")
+
+
+class _Unloadable(object):
+
+    def __reduce__(self):
+        return _unpicklable_in_parent, ()
+
+
+def _unloadable(result):
+    return [_Unloadable(), result]
+
+# Test that the shared memory blocks of a batch are freed when a result cannot be read
+
+
+def test_shared_memory_freed(service_url):
+    if processpool.shared_memory is None or not os.path.isdir("/dev/shm"):
+        pytest.skip("shared memory blocks are not visible")
+    before = set(os.listdir("/dev/shm"))
+    api = API('bogus_key', service_url=service_url)
+    with ProcessPoolBatch(api, processes=2, postprocess=_unloadable, shm_threshold=1024) as batch:
+        with pytest.raises(ValueError):
+            batch.map("tokens", ["big", "big", "big"])
+    assert set(os.listdir("/dev/shm")) <= before
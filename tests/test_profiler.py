@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (c) 2014-2015 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+# To run tests, run `py.test test_profiler.py`
+
+import gzip
+import httpretty
+import json
+import pickle
+import pytest
+from io import BytesIO
+from rosette.api import API, DocumentParameters
+from rosette.profiler import ClientProfiler
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+def _gzipped(result):
+    buf = BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode="wb") as f:
+        f.write(json.dumps(result).encode("utf-8"))
+    return buf.getvalue()
+
+
+@pytest.fixture
+def tokens_server():
+    httpretty.enable()
+    httpretty.register_uri(httpretty.POST, "https://api.rosette.com/rest/v1/tokens",
+                           body=_gzipped({"tokens": ["word"] * 1000}), status=200,
+                           content_type="application/json")
+    yield
+    httpretty.disable()
+    httpretty.reset()
+
+
+def _call(api, n):
+    for _ in range(n):
+        params = DocumentParameters()
+        params["content"] = "word " * 1000
+        assert len(api.tokens(params)["tokens"]) == 1000
+
+# Test that every stage of a sampled call is measured
+
+
+def test_stages_measured(tokens_server):
+    profiler = ClientProfiler(sample_rate=1.0)
+    api = API('bogus_key', profiler=profiler)
+    _call(api, 5)
+    report = profiler.report()
+    assert report["calls"] == 5
+    assert report["sampled"] == 5
+    stages = report["stages"]
+    assert set(stages) == set(["call", "serialize", "json.dumps", "_make_request", "gzip", "_my_loads"])
+    for stage in stages.values():
+        assert stage["count"] == 5
+        assert stage["cpu"] >= 0 and stage["wall"] >= 0
+    assert stages["call"]["wall"] >= stages["_make_request"]["wall"]
+    if tracemalloc is not None:
+        # the parsed result of 1000 tokens stays allocated
+        assert stages["_my_loads"]["allocated"] > 1000
+        assert stages["gzip"]["allocated"] > 1000
+        assert not tracemalloc.is_tracing()
+    assert "5 of 5 calls sampled" in profiler.format()
+
+    if tracemalloc is not None:
+        # the peak of an application already tracing is left alone
+        tracemalloc.start()
+        try:
+            block = bytearray(10 ** 7)
+            del block
+            _call(api, 1)
+            assert tracemalloc.get_traced_memory()[1] >= 10 ** 7
+        finally:
+            tracemalloc.stop()
+
+# Test that only a fraction of the calls is sampled
+
+
+def test_sampling(tokens_server):
+    profiler = ClientProfiler(sample_rate=0.25, seed=3)
+    api = API('bogus_key', profiler=profiler)
+    _call(api, 40)
+    report = profiler.report()
+    assert report["calls"] == 40
+    assert 0 < report["sampled"] < 40
+    assert report["stages"]["gzip"]["count"] == report["sampled"]
+
+    profiler.reset()
+    assert profiler.report() == {"calls": 0, "sampled": 0, "stages": {}}
+
+# Test the JSON dump, and that a copied profiler starts empty
+
+
+def test_dump_and_pickle(tokens_server, tmpdir):
+    profiler = ClientProfiler(sample_rate=1.0, trace_memory=False)
+    api = API('bogus_key', profiler=profiler)
+    _call(api, 2)
+    path = str(tmpdir.join("profile.json"))
+    profiler.dump(path)
+    with open(path) as f:
+        dumped = json.load(f)
+    assert dumped["sampled"] == 2
+    assert dumped["stages"]["gzip"]["allocated"] == 0
+    assert abs(sum(s["cpu_share"] for n, s in dumped["stages"].items() if n != "call")) <= 1.0 + 1e-6
+
+    copied = pickle.loads(pickle.dumps(profiler))
+    assert copied.sample_rate == 1.0
+    assert copied.report()["calls"] == 0
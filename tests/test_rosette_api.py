@@ -30,7 +30,8 @@ try:
 except ImportError:
     from io import BytesIO as streamIO
 import gzip
-from rosette.api import API, DocumentParameters, NameTranslationParameters, NameSimilarityParameters, RelationshipsParameters, RosetteException
+from rosette.api import API, DocumentParameters, DocumentTemplate, MorphologyOutput, NameTranslationParameters, NameSimilarityParameters, RelationshipsParameters, RosetteException
+from tests.local_server import LocalServer
 
 _IsPy3 = sys.version_info[0] == 3
 
@@ -497,3 +498,111 @@ def test_for_name_translation_required_parameters(api, json_response):
 
     httpretty.disable()
     httpretty.reset()
+
+# Test that a filled template sends the same body as DocumentParameters
+
+
+def test_document_template(api, json_response):
+    httpretty.enable()
+    httpretty.register_uri(httpretty.POST, "https://api.rosette.com/rest/v1/relationships",
+                           body=json_response, status=200, content_type="application/json")
+
+    template = DocumentTemplate(language="eng", options={"accuracyMode": "PRECISION"})
+    result = api.relationships(template.fill(u"some text data \u2013 \"quoted\""))
+    assert result["name"] == "Rosette API"
+    assert json.loads(httpretty.last_request().body.decode("utf-8")) == {
+        "content": u"some text data \u2013 \"quoted\"",
+        "language": "eng",
+        "options": {"accuracyMode": "PRECISION"}}
+
+    result = api.relationships(DocumentTemplate().fill("text"))
+    assert json.loads(httpretty.last_request().body.decode("utf-8")) == {"content": "text"}
+
+    with pytest.raises(RosetteException) as e_rosette:
+        api.relationships(template.fill(None))
+    assert e_rosette.value.status == 'badArgument'
+    with pytest.raises(RosetteException) as e_rosette:
+        api.name_translation(template.fill("text"))
+    assert e_rosette.value.status == 'incompatible'
+    httpretty.disable()
+    httpretty.reset()
+
+# Test enumeration validation
+
+
+def test_pseudo_enum_validate():
+    MorphologyOutput.validate("lemmas", "facet")
+    with pytest.raises(RosetteException) as e_rosette:
+        MorphologyOutput.validate("stems", "facet")
+    assert e_rosette.value.status == 'unknownVariable'
+    assert sorted(MorphologyOutput.values()) == sorted(
+        ["lemmas", "parts-of-speech", "compound-components", "han-readings", "complete"])
+
+# Test that bytes-like content is sent as JSON without being decoded.
+# The body is written in pieces, which httpretty does not reassemble, so this
+# test uses a local server.
+
+
+@pytest.mark.skipif(not _IsPy3, reason="bytes are text on Python 2")
+def test_binary_content():
+    server = LocalServer(lambda path, body: (200, {'name': 'Rosette API'}))
+    api = API('bogus_key', service_url=server.service_url)
+
+    text = u'Bill \u201cMurray\u201d\\\n\t"quoted"\x01'
+    for content in (text.encode("utf-8"), bytearray(text.encode("utf-8")), memoryview(text.encode("utf-8"))):
+        params = DocumentParameters()
+        params.load_document_string(content)
+        params["language"] = "eng"
+        result = api.entities(params)
+        assert result["name"] == "Rosette API"
+        assert json.loads(server.bodies[-1].decode("utf-8")) == {"content": text, "language": "eng"}
+
+    result = api.entities(DocumentTemplate().fill(b"plain"))
+    assert json.loads(server.bodies[-1].decode("utf-8")) == {"content": "plain"}
+    server.close()
+
+# Test that large responses are spilled to disk and oversized ones refused
+
+
+class _FakeResponse(object):
+
+    def __init__(self, body, length=None):
+        self._body = streamIO(body)
+        self._length = length
+
+    def read(self, size=-1):
+        return self._body.read(size)
+
+    def getheader(self, name):
+        return self._length
+
+
+def test_response_spill():
+    body = json.dumps({'tokens': ['word'] * 10000}).encode("utf-8")
+    buf = streamIO()
+    gzip.GzipFile(fileobj=buf, mode="wb").write(body)
+    gzipped = buf.getvalue()
+
+    api = API('bogus_key', max_response_memory=1024)
+    assert api._read_body(_FakeResponse(b'{"a": 1}'), "url") == b'{"a": 1}'
+    for raw in (body, gzipped):
+        spilled = api._read_body(_FakeResponse(raw), "url")
+        assert len(spilled) == len(body)
+        assert spilled.loads()['tokens'] == ['word'] * 10000
+
+    httpretty.enable()
+    httpretty.register_uri(httpretty.POST, "https://api.rosette.com/rest/v1/tokens",
+                           body=gzipped, status=200, content_type="application/json")
+    params = DocumentParameters()
+    params['content'] = 'word'
+    assert len(api.tokens(params)['tokens']) == 10000
+
+    api = API('bogus_key', max_response_size=1024)
+    with pytest.raises(RosetteException) as e_rosette:
+        api.tokens(params)
+    assert e_rosette.value.status == 'responseTooLarge'
+    with pytest.raises(RosetteException) as e_rosette:
+        api._read_body(_FakeResponse(b'{}', str(len(body))), "url")
+    assert e_rosette.value.status == 'responseTooLarge'
+    httpretty.disable()
+    httpretty.reset()
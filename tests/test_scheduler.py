@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (c) 2014-2015 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+# To run tests, run `py.test test_scheduler.py`
+
+import httpretty
+import json
+import threading
+import time
+from rosette.api import API
+from rosette.scheduler import Priority, Scheduler
+
+
+def _start_order(scheduler, requests):
+    """ Queues C{(priority, queue)} requests behind a held slot, then releases it and
+    returns the queue names in the order the requests started """
+    order = []
+    scheduler.acquire()
+
+    def run(priority, queue):
+        with scheduler.slot(priority, queue):
+            order.append(queue)
+
+    threads = []
+    for priority, queue in requests:
+        t = threading.Thread(target=run, args=(priority, queue))
+        t.start()
+        threads.append(t)
+        while scheduler.waiting < len(threads):
+            time.sleep(0.001)
+    scheduler.release()
+    for t in threads:
+        t.join()
+    return order
+
+# Test that higher priority requests jump the queue
+
+
+def test_priority():
+    order = _start_order(Scheduler(max_concurrency=1),
+                         [(Priority.LOW, "bulk"), (Priority.LOW, "bulk"), (Priority.HIGH, "user")])
+    assert order == ["user", "bulk", "bulk"]
+
+# Test that queues of one priority class share capacity by weight
+
+
+def test_weighted_fair_share():
+    order = _start_order(Scheduler(max_concurrency=1, weights={"a": 3}),
+                         [(Priority.NORMAL, "a")] * 6 + [(Priority.NORMAL, "b")] * 2)
+    assert order[:4].count("a") == 3
+    assert order.count("b") == 2
+
+# Test that API requests hold a slot and take the thread's priority
+
+
+def test_api_priority():
+    httpretty.enable()
+    httpretty.register_uri(httpretty.GET, "https://api.rosette.com/rest/v1/ping",
+                           body=json.dumps({'message': 'ok'}), status=200, content_type="application/json")
+
+    scheduler = Scheduler(max_concurrency=1)
+    api = API('bogus_key', scheduler=scheduler)
+    with api.priority(Priority.HIGH, "user"):
+        assert api._schedule() == (Priority.HIGH, "user")
+        assert api.ping()["message"] == "ok"
+    assert api._schedule() == (Priority.NORMAL, "default")
+    assert scheduler.running == 0
+    httpretty.disable()
+    httpretty.reset()
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (c) 2014-2015 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+# To run tests, run `py.test test_store.py`
+
+import io
+import json
+import os
+import pytest
+from rosette import store
+from rosette.store import ResultStore
+
+RESPONSE = os.path.join(os.path.dirname(__file__), "mock-data", "response", "eng-doc-entities.json")
+
+
+def _result(i):
+    with io.open(RESPONSE, encoding="utf-8") as f:
+        result = json.load(f)
+    result["entities"][0]["count"] = i
+    return result
+
+
+@pytest.fixture(params=["default", "json"])
+def path(request, tmpdir, monkeypatch):
+    if request.param == "json":
+        monkeypatch.setattr(store, "msgpack", None)
+    return str(tmpdir.join("results.store"))
+
+
+def test_store_and_reopen(path):
+    with ResultStore(path, block_size=16 * 1024) as results:
+        results.put_many(("doc%d" % i, _result(i)) for i in range(500))
+        assert results.get("doc7")["entities"][0]["count"] == 7  # before and after the block is written
+        results.flush()
+        assert results["doc7"]["entities"][0]["count"] == 7
+        results.put("doc7", {"replaced": True})
+        assert results["doc7"] == {"replaced": True}
+
+    pretty = sum(len(json.dumps(_result(i), indent=2)) for i in range(500))
+    assert os.path.getsize(path) + os.path.getsize(path + ".idx") < pretty / 10
+
+    results = ResultStore(path)
+    assert len(results) == 500
+    assert results["doc499"] == _result(499)
+    assert results["doc7"] == {"replaced": True}
+    assert "doc500" not in results
+    assert results.get("doc500") is None
+    with pytest.raises(KeyError):
+        results["doc500"]
+    assert dict(results.items())["doc123"] == _result(123)
+    results.close()
+
+    with ResultStore(path, cached_blocks=0) as results:
+        assert results["doc499"] == _result(499)
+        assert results["doc499"] == _result(499)
+
+
+def test_crash_recovery(path):
+    results = ResultStore(path, block_size=1024)
+    results.put_many(("doc%d" % i, _result(i)) for i in range(20))
+    results.close()
+    size = os.path.getsize(path)
+    with open(path, "ab") as f:
+        f.write(b"\x10\x00\x00\x00partial")
+    with open(path + ".idx", "ab") as f:
+        f.write(b"\x04\x00\x00\x00doc")
+
+    results = ResultStore(path)
+    assert os.path.getsize(path) == size
+    assert len(results) == 20
+    results.put("doc20", _result(20))
+    results.close()
+    with ResultStore(path) as results:
+        assert results["doc20"] == _result(20)
+
+
+def test_not_a_store(tmpdir):
+    path = str(tmpdir.join("other"))
+    with open(path, "w") as f:
+        f.write("{}")
+    with pytest.raises(ValueError):
+        ResultStore(path)
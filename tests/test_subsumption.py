@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (c) 2014-2015 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+# To run tests, run `py.test test_subsumption.py`
+
+import json
+import pickle
+import pytest
+import threading
+import time
+from rosette.api import API, DocumentParameters, EndpointCaller, MorphologyOutput
+from rosette.subsumption import SubsumptionCache
+from tests.local_server import LocalServer
+
+_COMPLETE = {"tokens": ["Dogs", "ran"], "lemmas": ["dog", "run"], "posTags": ["NOUN", "VERB"],
+             "compoundComponents": [None, None], "hanReadings": [None, None]}
+
+
+def _server(delay=0.0, linked_types=True):
+    calls = []
+
+    def respond(path, body):
+        endpoint = path.split("/rest/v1/")[1]
+        content = json.loads(body.decode("utf-8"))["content"]
+        calls.append(endpoint)
+        time.sleep(delay)
+        if endpoint == "morphology/complete":
+            return 200, _COMPLETE
+        if endpoint == "morphology/lemmas":
+            return 200, {"tokens": _COMPLETE["tokens"], "lemmas": _COMPLETE["lemmas"]}
+        if endpoint == "entities/linked":
+            entity = {"entityId": "Q1", "mention": content, "indocChainId": 0, "confidence": 0.5}
+            if linked_types:
+                entity.update(type="PERSON", normalized=content, count=1)
+            return 200, {"entities": [entity]}
+        if endpoint == "entities":
+            return 200, {"entities": [{"mention": content, "type": "PERSON", "count": 1}]}
+        return 200, {"tokens": content.split()}
+    server = LocalServer(respond)
+    server.calls = calls
+    return server
+
+
+def _params(text, language=None):
+    params = DocumentParameters()
+    params["content"] = text
+    params["language"] = language
+    return params
+
+# Test that facets and tokens are projected from a kept complete morphology
+
+
+def test_morphology_facets():
+    server = _server()
+    cache = SubsumptionCache()
+    api = API('key', server.service_url, subsumption=cache)
+    try:
+        api.morphology(_params("Dogs ran"))
+        lemmas = api.morphology(_params("Dogs ran"), MorphologyOutput.LEMMAS)
+        assert lemmas == {"tokens": ["Dogs", "ran"], "lemmas": ["dog", "run"],
+                          "derivedFrom": "morphology/complete"}
+        pos = api.morphology(_params("Dogs ran"), MorphologyOutput.PARTS_OF_SPEECH)
+        assert pos["posTags"] == ["NOUN", "VERB"]
+        assert api.tokens(_params("Dogs ran"))["tokens"] == ["Dogs", "ran"]
+        assert server.calls == ["morphology/complete"]
+
+        # other content or parameters are sent
+        api.tokens(_params("Cats ran"))
+        api.morphology(_params("Dogs ran", "eng"), MorphologyOutput.LEMMAS)
+        assert server.calls == ["morphology/complete", "tokens", "morphology/lemmas"]
+        assert cache.stats == {"derived": 3, "waited": 0}
+        assert len(cache) == 2
+    finally:
+        server.close()
+
+# Test that a narrower call waits for a broader call in flight
+
+
+def test_in_flight():
+    server = _server(delay=0.3)
+    cache = SubsumptionCache()
+    api = API('key', server.service_url, subsumption=cache)
+    try:
+        complete = []
+        thread = threading.Thread(target=lambda: complete.append(api.morphology(_params("Dogs ran"))))
+        thread.start()
+        time.sleep(0.1)
+        lemmas = api.morphology(_params("Dogs ran"), MorphologyOutput.LEMMAS)
+        thread.join()
+        assert lemmas["lemmas"] == ["dog", "run"]
+        assert complete[0]["lemmas"] == ["dog", "run"]
+        assert server.calls == ["morphology/complete"]
+        assert cache.stats == {"derived": 1, "waited": 1}
+    finally:
+        server.close()
+
+# Test that entities are projected from linked entities only when they carry the extraction fields
+
+
+def test_linked_entities():
+    for linked_types, calls in ((True, ["entities/linked"]), (False, ["entities/linked", "entities"])):
+        server = _server(linked_types=linked_types)
+        api = API('key', server.service_url, subsumption=SubsumptionCache())
+        try:
+            api.entities(_params("Ann"), resolve_entities=True)
+            entities = api.entities(_params("Ann"))
+            assert entities["entities"][0]["type"] == "PERSON"
+            assert server.calls == calls
+        finally:
+            server.close()
+
+# Test that the kept results are bounded, and not pickled
+
+
+def test_capacity_and_pickle():
+    cache = SubsumptionCache(capacity=1)
+    for text in ("a", "b"):
+        _, claim = cache.lookup("morphology/complete", {"content": text})
+        cache.release(claim, dict(_COMPLETE))
+    assert len(cache) == 1
+    assert cache.lookup("tokens", {"content": "a"}) == (None, None)
+    assert cache.lookup("tokens", {"content": "b"})[0]["tokens"] == ["Dogs", "ran"]
+    copied = pickle.loads(pickle.dumps(cache))
+    assert copied.capacity == 1 and len(copied) == 0
+
+# Test that a waiting call does not derive its result from a near-duplicate's
+
+
+def test_in_flight_near_duplicate():
+    cache = SubsumptionCache()
+    _, claim = cache.lookup("morphology/complete", {"content": "a"})
+    waited = []
+    thread = threading.Thread(target=lambda: waited.append(cache.lookup("tokens", {"content": "a"})))
+    thread.start()
+    time.sleep(0.1)
+    cache.release(claim, dict(_COMPLETE, nearDuplicate={"similarity": 0.9}))
+    thread.join()
+    assert waited == [(None, None)]
+    assert len(cache) == 0
+    assert cache.stats == {"derived": 0, "waited": 0}
+
+# Test that an interrupted broader call releases its claim, and that waits are bounded
+
+
+def test_interrupted_and_bounded_wait(monkeypatch):
+    server = _server()
+    cache = SubsumptionCache(max_wait=0.2)
+    api = API('key', server.service_url, subsumption=cache)
+    try:
+        def interrupted(*args):
+            raise KeyboardInterrupt()
+        monkeypatch.setattr(EndpointCaller, "_request", interrupted)
+        with pytest.raises(KeyboardInterrupt):
+            api.morphology(_params("Dogs ran"))
+        monkeypatch.undo()
+        assert api.tokens(_params("Dogs ran"))["tokens"] == ["Dogs", "ran"]
+        assert server.calls == ["tokens"]
+
+        _, claim = cache.lookup("morphology/complete", {"content": "stuck"})
+        start = time.time()
+        assert cache.lookup("tokens", {"content": "stuck"}) == (None, None)
+        assert 0.2 <= time.time() - start < 1.0
+        cache.release(claim, None)
+    finally:
+        server.close()
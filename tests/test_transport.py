@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (c) 2014-2015 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+# To run tests, run `py.test test_transport.py`
+
+import os
+import pickle
+import socket
+import ssl
+import subprocess
+import pytest
+from rosette.api import API, RosetteException
+from rosette.transport import Transport
+from tests.local_server import LocalServer
+
+
+def _throttling_server():
+    calls = []
+
+    def respond(path, body):
+        calls.append(path)
+        if len(calls) == 1:
+            return 429, {"code": "overCapacity", "message": "slow down"}
+        return 200, {"message": "ok"}
+    return LocalServer(respond)
+
+# Test that warm connections are used, sockets are tuned and reconnects skip DNS
+
+
+def test_warm_connections_and_dns_cache():
+    server = _throttling_server()
+    try:
+        transport = Transport(warm_connections=2)
+        api = API('key', server.service_url, refresh_duration=0, transport=transport)
+        assert transport.stats["dns_lookups"] == 1
+        assert transport.stats["dns_hits"] == 1
+        assert api.ping()["message"] == "ok"  # reconnects after the 429
+        sock = api.http_connection.sock
+        assert sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY)
+        assert sock.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE)
+        stats = transport.stats
+        assert stats["warm_used"] == 1
+        assert stats["dns_lookups"] == 1
+        assert stats["dns_hits"] == 2
+
+        clone = pickle.loads(pickle.dumps(transport))
+        assert clone.warm_connections == 2
+        assert clone.stats["warm_used"] == 0
+    finally:
+        server.close()
+
+
+def test_stale_warm_connection_is_discarded():
+    server = _throttling_server()
+    transport = Transport(warm_connections=1, idle_timeout=0)
+    try:
+        api = API('key', server.service_url, refresh_duration=0, transport=transport)
+        assert api.ping()["message"] == "ok"
+        assert transport.stats["warm_used"] == 0
+    finally:
+        server.close()
+
+
+def test_unreachable_server():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    transport = Transport(warm_connections=1)
+    api = API('key', "http://127.0.0.1:%d/rest/v1/" % port, transport=transport)
+    with pytest.raises(RosetteException) as e_rosette:
+        api.ping()
+    assert e_rosette.value.status == "ConnectionError"
+
+# Test that TLS sessions are resumed on reconnect
+
+
+def _certificate(tmpdir):
+    cert = str(tmpdir.join("cert.pem"))
+    key = str(tmpdir.join("key.pem"))
+    try:
+        with open(os.devnull, "w") as devnull:
+            subprocess.check_call(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+                                   "-subj", "/CN=localhost", "-addext", "subjectAltName=DNS:localhost",
+                                   "-keyout", key, "-out", cert], stdout=devnull, stderr=subprocess.STDOUT)
+    except (OSError, subprocess.CalledProcessError):
+        pytest.skip("openssl is not available")
+    return cert, key
+
+
+def test_tls_session_resumption(tmpdir):
+    cert, key = _certificate(tmpdir)
+    server_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    server_context.load_cert_chain(cert, key)
+    calls = []
+
+    def respond(path, body):
+        calls.append(path)
+        if len(calls) == 1:
+            return 429, {"code": "overCapacity", "message": "slow down"}
+        return 200, {"message": "ok"}
+    server = LocalServer(respond, ssl_context=server_context)
+    try:
+        transport = Transport(ssl_context=ssl.create_default_context(cafile=cert))
+        api = API('key', server.service_url, refresh_duration=0, transport=transport)
+        assert api.ping()["message"] == "ok"
+        assert transport.stats["tls_full"] == 1
+        assert transport.stats["tls_resumed"] == 1
+
+        # a forked child keeps the private CA
+        context = transport.ssl_context
+        api._after_fork()
+        assert api.transport.ssl_context is context
+        assert api.ping()["message"] == "ok"
+        with pytest.raises(TypeError):
+            pickle.dumps(transport)
+    finally:
+        server.close()